@@ -1,3 +1,38 @@
 from django.contrib import admin
+from authentication.admin import admin_site
+from .models import Account, LedgerEntry, Transfer
 
-# Register your models here.
+@admin.register(Account, site=admin_site)
+class AccountAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'name', 'asset', 'balance', 'allow_negative', 'updated_at')
+    list_filter = ('asset', 'allow_negative')
+    search_fields = ('owner__email', 'name')
+    # Balances only change through ledger postings
+    readonly_fields = ('balance', 'created_at', 'updated_at')
+
+@admin.register(Transfer, site=admin_site)
+class TransferAdmin(admin.ModelAdmin):
+    list_display = ('id', 'source', 'destination', 'amount', 'initiated_by', 'created_at')
+    search_fields = ('initiated_by__email', 'memo')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(LedgerEntry, site=admin_site)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'account', 'transfer', 'amount', 'balance_after', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,169 @@
+import contextlib
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connections, router
+from django.dispatch import receiver
+from django.utils import timezone
+
+from backend.sqlite import write_atomic
+
+from .models import Account, LedgerEntry, Transfer
+
+# serialization_failure, deadlock_detected, lock_not_available
+RETRYABLE_SQLSTATES = {'40001', '40P01', '55P03'}
+
+
+class LedgerError(Exception):
+    """A transfer that cannot be posted; the message is safe to show users"""
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class TransferConflict(LedgerError):
+    """Raised when a transfer still conflicts after every retry"""
+
+
+def is_retryable(exc):
+    """True for errors that mean "another transaction got there first; try again" """
+    cause = exc.__cause__
+    # psycopg 3 exposes .sqlstate, psycopg2 .pgcode
+    sqlstate = getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    message = str(exc)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+class TransferEngine:
+    """Posts transfers under row locks taken in a deterministic order.
+
+    Both accounts are locked first, ordered by primary key, so two transfers
+    touching the same pair (in either direction) queue instead of deadlocking.
+    The lock is ``FOR NO KEY UPDATE`` where supported: the Transfer and entry
+    inserts take ``FOR KEY SHARE`` on the accounts through their foreign keys,
+    which conflicts with ``FOR UPDATE`` but not with the weaker lock. While the
+    locks are held the transaction inserts the header, writes both balances in
+    one UPDATE and inserts the two entries.
+
+    Databases without row locks (SQLite) fall back to a per-process writer
+    lock around the whole transaction. Serialization failures, deadlocks and
+    "database is locked" errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_retries=5, backoff=0.005, max_backoff=0.2):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._committed = 0
+        self._retries = 0
+        self._conflicts = 0
+
+    def transfer(self, source, destination, amount, initiated_by=None, memo=''):
+        if amount <= 0:
+            raise LedgerError('Amount must be positive')
+        if source.pk == destination.pk:
+            raise LedgerError('Cannot transfer to the same account')
+        if source.asset != destination.asset:
+            raise LedgerError('Accounts hold different assets')
+
+        using = router.db_for_write(Account)
+        # Inside an outer transaction a failed attempt cannot be rolled back on its own
+        attempts = 1 if connections[using].in_atomic_block else self.max_retries + 1
+        for attempt in range(attempts):
+            try:
+                with self._serialized(using):
+                    transfer = self._post(using, source, destination, amount, initiated_by, memo)
+            except DatabaseError as e:
+                if not is_retryable(e):
+                    raise
+                if attempt + 1 == attempts:
+                    self._count('_conflicts')
+                    raise TransferConflict('Account is busy; please retry') from e
+                self._count('_retries')
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                continue
+            self._count('_committed')
+            return transfer
+
+    def _post(self, using, source, destination, amount, initiated_by, memo):
+        features = connections[using].features
+        with write_atomic(using):
+            now = timezone.now()
+            # Critical section: lock, header INSERT, one UPDATE for both balances, one INSERT for both entries
+            locked = {
+                account.pk: account
+                for account in Account.objects.using(using)
+                .select_for_update(no_key=features.has_select_for_no_key_update)
+                .filter(pk__in=[source.pk, destination.pk])
+                .order_by('pk')
+                .only('balance', 'allow_negative')
+            }
+            debit, credit = locked[source.pk], locked[destination.pk]
+            if not debit.allow_negative and debit.balance < amount:
+                raise InsufficientFunds('Insufficient funds')
+            transfer = Transfer.objects.using(using).create(
+                initiated_by=initiated_by,
+                source_id=source.pk,
+                destination_id=destination.pk,
+                amount=amount,
+                memo=memo,
+                created_at=now,
+            )
+            debit.balance -= amount
+            credit.balance += amount
+            debit.updated_at = credit.updated_at = now
+            Account.objects.using(using).bulk_update([debit, credit], ['balance', 'updated_at'])
+            LedgerEntry.objects.using(using).bulk_create([
+                LedgerEntry(transfer=transfer, account_id=source.pk, amount=-amount, balance_after=debit.balance, created_at=now),
+                LedgerEntry(transfer=transfer, account_id=destination.pk, amount=amount, balance_after=credit.balance, created_at=now),
+            ])
+
+        source.balance, destination.balance = debit.balance, credit.balance
+        transfer.source, transfer.destination = source, destination
+        return transfer
+
+    def _serialized(self, using):
+        if connections[using].features.has_select_for_update:
+            return contextlib.nullcontext()
+        return self._writer_lock
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'committed': self._committed,
+                'retries': self._retries,
+                'conflicts': self._conflicts,
+            }
+
+
+_engine = None
+
+
+def get_transfer_engine():
+    global _engine
+    if _engine is None:
+        _engine = TransferEngine(
+            max_retries=settings.LEDGER_TRANSFER_MAX_RETRIES,
+            backoff=settings.LEDGER_TRANSFER_BACKOFF,
+            max_backoff=settings.LEDGER_TRANSFER_MAX_BACKOFF,
+        )
+    return _engine
+
+
+@receiver(setting_changed)
+def reset_transfer_engine(*, setting, **kwargs):
+    global _engine
+    if setting.startswith('LEDGER_TRANSFER_'):
+        _engine = None
@@ -0,0 +1,70 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from .models import LedgerEntry
+
+EXPORT_FIELDS = ('id', 'transfer_id', 'coin', 'amount', 'balance_after', 'created_at')
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+# Rows encoded into each chunk written to the client
+EXPORT_WRITE_BATCH = 500
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the line instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(accounts, since=None, until=None):
+    """Yield ``EXPORT_FIELDS`` tuples of every entry of ``accounts``, oldest first per asset.
+
+    Each account is read in index order through ``iterator()`` (a server-side
+    cursor where the database supports one), so only one chunk of rows is
+    held in memory however long the history is. Date filters are applied in
+    the query.
+    """
+    for account in accounts.order_by('asset').only('asset'):
+        entries = LedgerEntry.objects.using(accounts.db).filter(account=account)
+        if since is not None:
+            entries = entries.filter(created_at__gte=since)
+        if until is not None:
+            entries = entries.filter(created_at__lt=until)
+        entries = entries.order_by('created_at', 'id').values_list('id', 'transfer_id', 'amount', 'balance_after', 'created_at')
+        # Outside a transaction PostgreSQL materializes the whole result of a
+        # (WITH HOLD) server-side cursor before the first fetch
+        with transaction.atomic(using=entries.db):
+            for entry_id, transfer_id, amount, balance_after, created_at in entries.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                yield entry_id, transfer_id, account.asset, amount, balance_after, created_at
+
+
+def _batched(rows, encode):
+    rows = iter(rows)
+    while batch := list(islice(rows, EXPORT_WRITE_BATCH)):
+        yield ''.join(encode(row) for row in batch)
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    # The header goes out before the first query runs
+    yield writer.writerow(EXPORT_FIELDS)
+    yield from _batched(rows, lambda row: writer.writerow(row[:5] + (row[5].isoformat(),)))
+
+
+def stream_ndjson(rows):
+    def encode(row):
+        entry = dict(zip(EXPORT_FIELDS, row))
+        entry.update(amount=str(entry['amount']), balance_after=str(entry['balance_after']), created_at=entry['created_at'].isoformat())
+        return json.dumps(entry) + '\n'
+
+    yield from _batched(rows, encode)
+
+
+FORMATS = {
+    'csv': ('text/csv', stream_csv),
+    'ndjson': ('application/x-ndjson', stream_ndjson),
+}
@@ -0,0 +1,161 @@
+import contextlib
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# ``response`` is None while the first request with the key is still running
+IdempotencyRecord = namedtuple('IdempotencyRecord', 'fingerprint response')
+StoredResponse = namedtuple('StoredResponse', 'status data headers', defaults=((),))
+
+
+class IdempotencyError(Exception):
+    """The message is safe to show users"""
+
+
+class KeyReused(IdempotencyError):
+    """The key was already used for a different request"""
+
+
+class RequestInProgress(IdempotencyError):
+    """The first request with the key did not finish within the wait timeout"""
+
+
+def request_fingerprint(request):
+    """Hash of what makes two requests "the same": method, path and parsed body"""
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method}\n{request.path}\n{body}'.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Remembers the response to each ``(scope, Idempotency-Key)`` for ``ttl`` seconds.
+
+    The first request with a key claims it and runs; a replay with the same
+    fingerprint gets the stored response back without running again, and a
+    duplicate that arrives while the first is still running waits for it (up
+    to ``wait_timeout``) instead of racing it. 5xx responses and exceptions
+    release the claim so the client can retry.
+
+    By default records live in a per-process LRU bounded by ``max_size``;
+    set ``cache_alias`` to a shared Django cache when several processes serve
+    the API. Claims then rely on ``cache.add`` being atomic and waiters poll.
+    """
+
+    key_prefix = 'idempotency:'
+    # A claim left behind by a crashed worker blocks its key for at most this long
+    claim_timeout = 60
+    poll_interval = 0.05
+
+    def __init__(self, ttl=86400, max_size=10000, cache_alias=None, wait_timeout=10):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._changed = threading.Condition()
+
+    def run(self, scope, key, fingerprint, execute):
+        """Return ``(StoredResponse, replayed)``, calling ``execute()`` only if the key is new"""
+        deadline = time.monotonic() + self.wait_timeout
+        # Locally, checking the key and starting to wait happen under one lock
+        # so the first request's notify cannot slip in between
+        with contextlib.nullcontext() if self.cache_alias else self._changed:
+            while (record := self._claim(f'{scope}:{key}', fingerprint)) is not None:
+                if record.fingerprint != fingerprint:
+                    raise KeyReused('Idempotency-Key was already used for a different request')
+                if record.response is not None:
+                    return record.response, True
+                if not self._wait(deadline):
+                    raise RequestInProgress('A request with this Idempotency-Key is still being processed')
+
+        try:
+            response = execute()
+        except BaseException:
+            self._release(f'{scope}:{key}')
+            raise
+        if response.status >= 500:
+            self._release(f'{scope}:{key}')
+        else:
+            self._store(f'{scope}:{key}', IdempotencyRecord(fingerprint, response))
+        return response, False
+
+    def _claim(self, key, fingerprint):
+        """Claim ``key`` and return None, or return the record already there"""
+        claim = IdempotencyRecord(fingerprint, None)
+        if self.cache_alias:
+            cache = caches[self.cache_alias]
+            if cache.add(self.key_prefix + key, tuple(claim), self.claim_timeout):
+                return None
+            stored = cache.get(self.key_prefix + key)
+            # Expired or released between add() and get(): try again
+            return IdempotencyRecord(*stored) if stored else IdempotencyRecord(fingerprint, None)
+
+        with self._changed:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+            self._entries[key] = (claim, now + self.claim_timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return None
+
+    def _store(self, key, record):
+        if self.cache_alias:
+            caches[self.cache_alias].set(self.key_prefix + key, tuple(record), self.ttl)
+            return
+        with self._changed:
+            self._entries[key] = (record, time.monotonic() + self.ttl)
+            self._changed.notify_all()
+
+    def _release(self, key):
+        if self.cache_alias:
+            caches[self.cache_alias].delete(self.key_prefix + key)
+            return
+        with self._changed:
+            self._entries.pop(key, None)
+            self._changed.notify_all()
+
+    def _wait(self, deadline):
+        """Block until the store may have changed; False once ``deadline`` has passed.
+
+        In local mode the caller holds ``self._changed``.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if self.cache_alias:
+            time.sleep(min(self.poll_interval, remaining))
+        else:
+            self._changed.wait(remaining)
+        return True
+
+
+_store = None
+
+
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(
+            ttl=settings.IDEMPOTENCY_TTL,
+            max_size=settings.IDEMPOTENCY_MAX_KEYS,
+            cache_alias=settings.IDEMPOTENCY_CACHE_ALIAS,
+            wait_timeout=settings.IDEMPOTENCY_WAIT_TIMEOUT,
+        )
+    return _store
+
+
+@receiver(setting_changed)
+def reset_idempotency_store(*, setting, **kwargs):
+    global _store
+    if setting.startswith('IDEMPOTENCY_'):
+        _store = None
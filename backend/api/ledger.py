@@ -0,0 +1,97 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from backend.sqlite import write_atomic
+
+from .engine import InsufficientFunds, LedgerError, TransferConflict, get_transfer_engine
+from .models import Account, LedgerEntry
+
+
+def get_system_account(name, asset):
+    """Treasury/settlement style account that funds user accounts and may go negative"""
+    account, _ = Account.objects.get_or_create(owner=None, name=name, asset=asset, defaults={'allow_negative': True})
+    return account
+
+
+def post_transfer(source, destination, amount, initiated_by=None, memo=''):
+    """Move ``amount`` from ``source`` to ``destination`` and return the Transfer.
+
+    The Transfer, its two ledger entries and both materialized balances are
+    written in one transaction by the transfer engine, so a balance always
+    equals the sum of its account's entries.
+    """
+    return get_transfer_engine().transfer(source, destination, amount, initiated_by=initiated_by, memo=memo)
+
+
+def _entry_totals(entries, key):
+    """``{key: sum of amount}`` over ``entries``.
+
+    SQLite would add up the TEXT amounts (see ``AmountField``) as floats, so
+    there the entries are summed in Python.
+    """
+    if connections[entries.db].vendor != 'sqlite':
+        return dict(entries.values_list(key).annotate(total=Sum('amount')).order_by())
+    totals = defaultdict(Decimal)
+    for value, amount in entries.values_list(key, 'amount').iterator():
+        totals[value] += amount
+    return totals
+
+
+@contextmanager
+def _snapshot(using):
+    """Run the enclosed reads against one snapshot of ``using``.
+
+    PostgreSQL's default READ COMMITTED takes a new snapshot per statement, so
+    the outermost transaction is switched to REPEATABLE READ. SQLite and
+    MySQL's default isolation already read one snapshot per transaction.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        yield
+
+
+def find_inconsistencies():
+    """Yield ``(account, stored_balance, ledger_balance)`` for every account that disagrees with its entries.
+
+    Entries and balances are read in one snapshot, so transfers committing
+    meanwhile are not reported as drift.
+    """
+    using = LedgerEntry.objects.db
+    with _snapshot(using):
+        totals = _entry_totals(LedgerEntry.objects.using(using), 'account')
+        mismatches = []
+        for account in Account.objects.using(using).order_by('pk').iterator():
+            ledger_balance = totals.get(account.pk) or 0
+            if account.balance != ledger_balance:
+                mismatches.append((account, account.balance, ledger_balance))
+    yield from mismatches
+
+
+def unbalanced_transfers():
+    """Transfers whose entries do not sum to zero (a broken double-entry invariant)"""
+    if connections[LedgerEntry.objects.db].vendor == 'sqlite':
+        return sorted(transfer for transfer, total in _entry_totals(LedgerEntry.objects.all(), 'transfer').items() if total)
+    return (
+        LedgerEntry.objects.values('transfer')
+        .annotate(total=Sum('amount'))
+        .exclude(total=0)
+        .values_list('transfer', flat=True)
+        .order_by('transfer')
+    )
+
+
+def rebuild_balance(account):
+    """Reset ``account.balance`` to the sum of its ledger entries under a row lock"""
+    with write_atomic():
+        account = Account.objects.select_for_update().get(pk=account.pk)
+        account.balance = _entry_totals(account.entries.all(), 'account').get(account.pk) or 0
+        account.save(update_fields=['balance', 'updated_at'])
+    return account
@@ -0,0 +1,123 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+from backend.benchmarking import summarize, write_report
+
+# Environment each mode's process is started with (see DATABASES in settings)
+MODES = {
+    'per-request': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': 'False'},
+    'persistent': {'DB_CONN_MAX_AGE': '600', 'DB_POOL': 'False'},
+    'pooled': {'DB_POOL': 'True'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure what per-request database connection handling costs: a new connection per request, '
+            'persistent connections (CONN_MAX_AGE with health checks) or a psycopg pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent request threads')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        # Each mode runs in its own process so DATABASES is built from its environment
+        parser.add_argument('--mode', choices=sorted(MODES), help='Run a single mode in this process')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options['mode'], options)))
+            return
+
+        modes = ['per-request', 'persistent']
+        if connection.vendor == 'postgresql':
+            modes.append('pooled')
+        else:
+            self.stderr.write(f'Skipping pooled mode: connection pools need PostgreSQL, not {connection.vendor}')
+        results = [self.spawn(mode, options) for mode in modes]
+        write_report(self, results, options['json'], columns=('rps', 'p50_ms', 'p99_ms', 'connects', 'backends'))
+
+    def spawn(self, mode, options):
+        command = [
+            sys.executable, sys.argv[0], 'bench_connections', '--mode', mode,
+            '--requests', str(options['requests']),
+            '--threads', str(options['threads']),
+        ]
+        completed = subprocess.run(command, env={**os.environ, **MODES[mode]}, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{mode} benchmark failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_mode(self, mode, options):
+        """Run requests that each make one small query, bracketed by Django's request signals.
+
+        ``request_started``/``request_finished`` are what close (or keep) the
+        connection between real requests, so the difference between modes is
+        the connection setup the handler would pay. ``connects`` counts
+        connections opened (or checked out of the pool) and ``backends`` the
+        distinct PostgreSQL server processes that answered.
+        """
+        # Backend pid on PostgreSQL; elsewhere just a round trip
+        query = 'SELECT pg_backend_pid()' if connection.vendor == 'postgresql' else 'SELECT 1'
+        connects = 0
+        backends = set()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def count_connect(**kwargs):
+            nonlocal connects
+            with lock:
+                connects += 1
+
+        def work(count):
+            local, pids = [], set()
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    request_started.send(sender=self.__class__)
+                    with connection.cursor() as cursor:
+                        cursor.execute(query)
+                        pids.add(cursor.fetchone()[0])
+                    request_finished.send(sender=self.__class__)
+                    local.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local)
+                    backends.update(pids)
+
+        connection_created.connect(count_connect)
+        per_thread, extra = divmod(options['requests'], options['threads'])
+        threads = [
+            threading.Thread(target=work, args=(per_thread + (i < extra),))
+            for i in range(options['threads'])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        connection_created.disconnect(count_connect)
+        connections.close_all()
+
+        if errors:
+            raise CommandError(f'{len(errors)} thread(s) failed, first error: {errors[0]!r}')
+        return summarize(
+            latencies, elapsed,
+            name=f'{connection.vendor} {mode} x{options["threads"]}',
+            vendor=connection.vendor,
+            mode=mode,
+            connects=connects,
+            backends=len(backends) if connection.vendor == 'postgresql' else '-',
+        )
@@ -0,0 +1,137 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+from authentication.backends import ClerkAuthentication
+from authentication.identity_cache import identity_cache
+from backend.benchmarking import benchmark_database, summarize, write_report
+from backend.sqlite import write_atomic
+
+User = get_user_model()
+
+MODES = {
+    'default': {'DB_SQLITE_TUNED': 'False'},
+    'tuned': {'DB_SQLITE_TUNED': 'True'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Load a file-backed SQLite database from many threads with and without the tuned profile '
+            '(DB_SQLITE_TUNED) and report throughput and "database is locked" errors')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent request threads')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per thread')
+        parser.add_argument('--users', type=int, default=50, help='Distinct users the requests are spread over')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        # Each mode runs in its own process so DATABASES is built from its environment
+        parser.add_argument('--mode', choices=sorted(MODES), help='Run a single mode in this process')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options['mode'], options)))
+            return
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'bench_sqlite needs the SQLite profile, not {connection.vendor}')
+        results = [self.spawn(mode, options) for mode in MODES]
+        write_report(self, results, options['json'], columns=('rps', 'p50_ms', 'p99_ms', 'locked', 'journal'))
+
+    def spawn(self, mode, options):
+        command = [
+            sys.executable, sys.argv[0], 'bench_sqlite', '--mode', mode,
+            '--threads', str(options['threads']),
+            '--requests', str(options['requests']),
+            '--users', str(options['users']),
+        ]
+        completed = subprocess.run(command, env={**os.environ, **MODES[mode]}, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{mode} benchmark failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_mode(self, mode, options):
+        with benchmark_database():
+            users = User.objects.bulk_create([
+                User(clerk_id=f'bench_{i}', email=f'bench_{i}@example.com') for i in range(options['users'])
+            ])
+            with connection.cursor() as cursor:
+                journal = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            connection.close()
+            return self.load(mode, users, journal, options)
+
+    def load(self, mode, users, journal, options):
+        """Run request-shaped work from ``--threads`` threads.
+
+        Every request authenticates (a profile change makes it write the user
+        row, like a changed Clerk profile does) and reads the user back; every
+        fourth also runs a read-then-write transaction. A request that fails
+        with "database is locked" counts as locked and is not retried.
+        """
+        backend = ClerkAuthentication()
+        latencies = []
+        locked = 0
+        errors = []
+        lock = threading.Lock()
+
+        def request(user, n):
+            request_started.send(sender=self.__class__)
+            try:
+                claims = {'sub': user.clerk_id, 'email': f'{user.clerk_id}+{n}@example.com'}
+                authenticated = backend.get_or_create_user(claims)
+                User.objects.filter(pk=authenticated.pk).values('email', 'is_staff').get()
+                if n % 4 == 0:
+                    with write_atomic():
+                        row = User.objects.get(pk=authenticated.pk)
+                        row.first_name = str(n)
+                        row.save(update_fields=['first_name'])
+            finally:
+                request_finished.send(sender=self.__class__)
+
+        def work(offset):
+            nonlocal locked
+            local, local_locked = [], 0
+            try:
+                for n in range(options['requests']):
+                    user = users[(offset + n) % len(users)]
+                    start = time.perf_counter()
+                    try:
+                        request(user, n)
+                    except Exception as e:
+                        if 'database is locked' not in str(e):
+                            raise
+                        local_locked += 1
+                        continue
+                    local.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local)
+                    locked += local_locked
+
+        identity_cache.clear()
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if errors:
+            raise CommandError(f'{len(errors)} thread(s) failed, first error: {errors[0]!r}')
+        return summarize(
+            latencies, elapsed,
+            name=f'sqlite {mode} x{options["threads"]}',
+            mode=mode,
+            journal=journal,
+            locked=locked,
+        )
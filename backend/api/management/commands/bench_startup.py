@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarking import write_report
+
+# Run in a fresh interpreter under -X importtime. The marker written between
+# the phases splits the import log into startup and first-request imports.
+CHILD = '''
+import io, json, os, sys, time
+start = time.perf_counter()
+from backend.wsgi import application
+ready = time.perf_counter()
+os.write(2, b'--- first request\\n')
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+}
+status = []
+b''.join(application(environ, lambda s, headers, exc_info=None: status.append(s)))
+done = time.perf_counter()
+print(json.dumps({'setup_ms': (ready - start) * 1000, 'request_ms': (done - ready) * 1000, 'status': status[0]}))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \| ( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = ('Measure process startup: per-package import cost (from python -X importtime) while loading '
+            'Django and while serving the first request, and the time until that request is answered')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes to measure (medians are reported)')
+        parser.add_argument('--path', default='/api/v1/auth/me/', help='Path of the first request')
+        parser.add_argument('--top', type=int, default=20, help='Packages to list, by total import time')
+        parser.add_argument('--modules', action='store_true', help='Report individual modules instead of packages')
+        parser.add_argument('--budget', type=float, help='Fail if the median time to first response exceeds this (ms)')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        # One untimed run so bytecode compilation is not measured
+        self.run_once(options)
+        runs = [self.run_once(options) for _ in range(options['runs'])]
+
+        timings = [
+            self.timing('interpreter startup', [run['process_ms'] - run['setup_ms'] - run['request_ms'] for run in runs]),
+            self.timing('django.setup()', [run['setup_ms'] for run in runs]),
+            self.timing(f'first request ({runs[0]["status"]})', [run['request_ms'] for run in runs]),
+            self.timing('time to first response', [run['process_ms'] for run in runs]),
+        ]
+        imports = self.import_costs(runs, options['top'], options['modules'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'timings': timings, 'imports': imports}, indent=2))
+        else:
+            write_report(self, timings, columns=('median_ms', 'min_ms', 'max_ms'))
+            self.stdout.write('')
+            write_report(self, imports, columns=('startup_ms', 'request_ms', 'modules'))
+
+        if options['budget'] is not None and timings[-1]['median_ms'] > options['budget']:
+            raise CommandError(
+                f'Time to first response {timings[-1]["median_ms"]} ms is over the {options["budget"]} ms budget'
+            )
+
+    def run_once(self, options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE, 'ALLOWED_HOSTS': 'localhost'}
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD, options['path']],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        process_ms = (time.perf_counter() - start) * 1000
+        if completed.returncode:
+            raise CommandError(f'Startup run failed:\n{completed.stderr[-2000:]}')
+
+        phase = 'startup_ms'
+        modules = defaultdict(lambda: {'startup_ms': 0.0, 'request_ms': 0.0})
+        for line in completed.stderr.splitlines():
+            if line == '--- first request':
+                phase = 'request_ms'
+                continue
+            match = IMPORT_LINE.match(line)
+            if match:
+                modules[match[3]][phase] += int(match[1]) / 1000
+        return {**json.loads(completed.stdout.strip().splitlines()[-1]), 'process_ms': process_ms, 'modules': modules}
+
+    def timing(self, name, values):
+        return {
+            'name': name,
+            'median_ms': round(statistics.median(values), 1),
+            'min_ms': round(min(values), 1),
+            'max_ms': round(max(values), 1),
+        }
+
+    def import_costs(self, runs, top, by_module):
+        """Median self import time per package (or module) in each phase, largest first"""
+        per_run = []
+        for run in runs:
+            groups = defaultdict(lambda: {'startup_ms': 0.0, 'request_ms': 0.0, 'modules': 0})
+            for module, cost in run['modules'].items():
+                group = groups[module if by_module else module.split('.')[0]]
+                group['startup_ms'] += cost['startup_ms']
+                group['request_ms'] += cost['request_ms']
+                group['modules'] += 1
+            per_run.append(groups)
+
+        names = set().union(*per_run)
+        rows = []
+        for name in names:
+            samples = [groups.get(name, {'startup_ms': 0.0, 'request_ms': 0.0, 'modules': 0}) for groups in per_run]
+            rows.append({
+                'name': name,
+                'startup_ms': round(statistics.median(s['startup_ms'] for s in samples), 1),
+                'request_ms': round(statistics.median(s['request_ms'] for s in samples), 1),
+                'modules': max(s['modules'] for s in samples),
+            })
+        rows.sort(key=lambda row: row['startup_ms'] + row['request_ms'], reverse=True)
+        total = {
+            'name': 'total',
+            'startup_ms': round(sum(row['startup_ms'] for row in rows), 1),
+            'request_ms': round(sum(row['request_ms'] for row in rows), 1),
+            'modules': sum(row['modules'] for row in rows),
+        }
+        return [*rows[:top], total]
@@ -0,0 +1,97 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.engine import get_transfer_engine
+from api.ledger import find_inconsistencies, get_system_account, post_transfer, unbalanced_transfers
+from api.models import Account, LedgerEntry
+from backend.benchmarking import benchmark_database, summarize, write_report
+
+
+class Command(BaseCommand):
+    help = ('Stress the transfer engine with concurrent transfers between a few hot accounts, check for lost '
+            'updates and report committed transfers per second (rps)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writer threads')
+        parser.add_argument('--transfers', type=int, default=250, help='Transfers per thread')
+        parser.add_argument('--accounts', type=int, default=2,
+                            help='Hot accounts transfers bounce between (fewer means more contention)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            result = self.run(options)
+        write_report(self, [result], options['json'], columns=('rps', 'p50_ms', 'p99_ms', 'retries', 'conflicts'))
+
+    def run(self, options):
+        if options['accounts'] < 2:
+            raise CommandError('--accounts must be at least 2')
+        treasury = get_system_account('treasury', 'USDT')
+        hot = [Account.objects.create(name=f'settlement_{i}', asset='USDT') for i in range(options['accounts'])]
+        opening = Decimal('1000000')
+        for account in hot:
+            post_transfer(treasury, account, opening)
+
+        # Precompute every transfer so the expected balances are known up front
+        rng = random.Random(options['seed'])
+        expected = {account.pk: opening for account in hot}
+        plans = []
+        for _ in range(options['threads']):
+            plan = []
+            for _ in range(options['transfers']):
+                source, destination = rng.sample(hot, 2)
+                amount = Decimal(rng.randint(1, 100))
+                expected[source.pk] -= amount
+                expected[destination.pk] += amount
+                plan.append((source, destination, amount))
+            plans.append(plan)
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def work(plan):
+            local = []
+            try:
+                for source, destination, amount in plan:
+                    start = time.perf_counter()
+                    post_transfer(Account(pk=source.pk, asset='USDT'), Account(pk=destination.pk, asset='USDT'), amount)
+                    local.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local)
+
+        stats_before = get_transfer_engine().stats()
+        threads = [threading.Thread(target=work, args=(plan,)) for plan in plans]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stats = get_transfer_engine().stats()
+
+        if errors:
+            raise CommandError(f'{len(errors)} worker(s) failed, first error: {errors[0]!r}')
+        actual = dict(Account.objects.filter(pk__in=expected).values_list('pk', 'balance'))
+        lost = {pk: (expected[pk], actual[pk]) for pk in expected if actual[pk] != expected[pk]}
+        if lost or list(find_inconsistencies()) or list(unbalanced_transfers()):
+            raise CommandError(f'Ledger inconsistent after the run (expected, actual): {lost}')
+
+        return summarize(
+            latencies, elapsed,
+            name=f'{connection.vendor} {options["threads"]}x{options["transfers"]} over {len(hot)} accounts',
+            vendor=connection.vendor,
+            entries=LedgerEntry.objects.count(),
+            retries=stats['retries'] - stats_before['retries'],
+            conflicts=stats['conflicts'] - stats_before['conflicts'],
+        )
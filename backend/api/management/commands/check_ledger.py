@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ledger import find_inconsistencies, rebuild_balance, unbalanced_transfers
+
+
+class Command(BaseCommand):
+    help = 'Verify materialized account balances against the ledger, optionally rebuilding them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Reset every inconsistent balance to the sum of its ledger entries')
+
+    def handle(self, *args, **options):
+        broken_transfers = list(unbalanced_transfers())
+        for transfer_id in broken_transfers:
+            self.stderr.write(f'Transfer {transfer_id}: entries do not sum to zero')
+
+        mismatches = list(find_inconsistencies())
+        for account, stored, expected in mismatches:
+            self.stderr.write(f'Account {account.pk} ({account}): balance {stored}, ledger {expected}')
+            if options['rebuild']:
+                rebuild_balance(account)
+
+        if options['rebuild'] and mismatches:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(mismatches)} balance(s) from the ledger'))
+        if broken_transfers or (mismatches and not options['rebuild']):
+            raise CommandError(f'{len(mismatches)} inconsistent balance(s), {len(broken_transfers)} unbalanced transfer(s)')
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Ledger is consistent'))
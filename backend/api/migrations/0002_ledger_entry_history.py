@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', '-created_at', '-id'], name='ledger_entry_history'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='api.account'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:05
+
+import api.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_ledger_entry_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='balance',
+            field=api.models.AmountField(decimal_places=18, default=0, max_digits=36),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='amount',
+            field=api.models.AmountField(decimal_places=18, max_digits=36),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='balance_after',
+            field=api.models.AmountField(decimal_places=18, max_digits=36),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='amount',
+            field=api.models.AmountField(decimal_places=18, max_digits=36),
+        ),
+    ]
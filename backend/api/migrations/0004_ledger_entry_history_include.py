@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_exact_amounts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ledgerentry',
+            name='ledger_entry_history',
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', '-created_at', '-id'], include=('amount', 'balance_after', 'transfer'), name='ledger_entry_history'),
+        ),
+    ]
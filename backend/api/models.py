@@ -1,3 +1,130 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+AMOUNT_DIGITS = 36
+AMOUNT_PLACES = 18
+
+class AmountField(models.DecimalField):
+    """``DecimalField`` that keeps every decimal place on SQLite too.
+
+    SQLite has no decimal type: a ``decimal`` column stores a float, which
+    keeps about 15 significant digits. There the value is stored as TEXT at
+    the full scale instead, with zero written as ``'0'`` so the check
+    constraints' comparisons with 0 still hold on the text. Other databases
+    get the usual ``numeric`` column. SQL ``SUM()`` over the TEXT column is
+    still computed in floating point, see ``api.ledger``.
+    """
+
+    def get_internal_type(self):
+        # Not "DecimalField": the SQLite backend would read it back through a float
+        return 'AmountField'
+
+    def db_type(self, connection):
+        if connection.vendor == 'sqlite':
+            return 'text'
+        return connection.data_types['DecimalField'] % self.db_type_parameters(connection)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if connection.vendor != 'sqlite' or not isinstance(value, Decimal):
+            return value
+        if not value:
+            return '0'
+        return format(value.quantize(Decimal(1).scaleb(-self.decimal_places), context=self.context), 'f')
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            return Decimal(value).quantize(Decimal(1).scaleb(-self.decimal_places), context=self.context)
+        return value
+
+class Account(models.Model):
+    """One asset balance held by a user (or by the system when ``owner`` is null).
+
+    ``balance`` is materialized: it is updated in the same transaction as every
+    ledger entry posted to the account, so reads never sum the history.
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True, related_name='accounts')
+    # Frontend account identifier, e.g. 'main' or 'binance_main'
+    name = models.CharField(max_length=64)
+    asset = models.CharField(max_length=16)
+    balance = AmountField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES, default=0)
+    # System accounts (treasury, settlement) may go negative when funding users
+    allow_negative = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ledger_accounts'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name', 'asset'], name='ledger_account_owner_name_asset'),
+            models.UniqueConstraint(fields=['name', 'asset'], condition=models.Q(owner__isnull=True), name='ledger_system_account_name_asset'),
+            models.CheckConstraint(
+                condition=models.Q(allow_negative=True) | models.Q(balance__gte=0),
+                name='ledger_account_balance_non_negative',
+            ),
+        ]
+
+    def __str__(self):
+        owner = self.owner_id or 'system'
+        return f'{owner}:{self.name}:{self.asset}'
+
+class Transfer(models.Model):
+    """A movement of ``amount`` between two accounts of the same asset"""
+    initiated_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True, related_name='transfers')
+    source = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='outgoing_transfers')
+    destination = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='incoming_transfers')
+    amount = AmountField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    memo = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'ledger_transfers'
+        constraints = [
+            models.CheckConstraint(condition=models.Q(amount__gt=0), name='ledger_transfer_amount_positive'),
+        ]
+
+class LedgerEntryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError('Ledger entries are append-only')
+
+    def delete(self):
+        raise TypeError('Ledger entries are append-only')
+
+class LedgerEntry(models.Model):
+    """Append-only double-entry line; the entries of a transfer sum to zero.
+
+    ``amount`` is signed (negative debits the account) and ``balance_after`` is
+    the account balance once the entry was applied.
+    """
+    transfer = models.ForeignKey(Transfer, on_delete=models.PROTECT, related_name='entries')
+    # Covered by the leading column of the history index below
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='entries', db_index=False)
+    amount = AmountField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    balance_after = AmountField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = LedgerEntryQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'ledger_entries'
+        indexes = [
+            # Keyset pagination of an account's history, newest first. The
+            # INCLUDE columns make history pages index-only scans on PostgreSQL
+            # (other databases ignore them).
+            models.Index(
+                fields=['account', '-created_at', '-id'],
+                include=['amount', 'balance_after', 'transfer'],
+                name='ledger_entry_history',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError('Ledger entries are append-only')
+        super().save(*args, **kwargs)
 
-# Create your models here.
+    def delete(self, *args, **kwargs):
+        raise TypeError('Ledger entries are append-only')
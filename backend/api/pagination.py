@@ -0,0 +1,51 @@
+import base64
+import heapq
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+
+from .models import LedgerEntry
+
+HISTORY_FIELDS = ('id', 'transfer_id', 'amount', 'balance_after', 'created_at')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, entry_id):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{entry_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def history_page(accounts, cursor=None, limit=50):
+    """One page of ledger entries for ``accounts``, newest first, and the cursor of the next page.
+
+    Each account is read with a keyset query on the (account, created_at, id)
+    index: ``created_at <= t AND (created_at < t OR id < i)``, newest first,
+    limited to ``limit + 1`` rows. Page N therefore reads the same number of
+    index entries as page 1 however long the history is. The per-account
+    streams (one per asset) are merged in Python.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    streams = []
+    for account in accounts:
+        rows = LedgerEntry.objects.filter(account=account)
+        if position:
+            created_at, entry_id = position
+            rows = rows.filter(Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=entry_id))
+        rows = rows.order_by('-created_at', '-id').values(*HISTORY_FIELDS)[:limit + 1]
+        streams.append([{**row, 'asset': account.asset} for row in rows])
+
+    merged = list(islice(heapq.merge(*streams, key=lambda row: (row['created_at'], row['id']), reverse=True), limit + 1))
+    page, has_more = merged[:limit], len(merged) > limit
+    next_cursor = encode_cursor(page[-1]['created_at'], page[-1]['id']) if has_more else None
+    return page, next_cursor
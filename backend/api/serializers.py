@@ -0,0 +1,45 @@
+from rest_framework import serializers
+from .models import AMOUNT_DIGITS, AMOUNT_PLACES, Account, Transfer
+
+class BalanceSerializer(serializers.ModelSerializer):
+    available = serializers.DecimalField(source='balance', max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    locked = serializers.SerializerMethodField()
+    total = serializers.DecimalField(source='balance', max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    
+    class Meta:
+        model = Account
+        fields = ['asset', 'available', 'locked', 'total', 'updated_at']
+    
+    def get_locked(self, account):
+        # Transfers settle immediately, so nothing is ever held
+        return '0'
+
+class TransferRequestSerializer(serializers.Serializer):
+    fromAccount = serializers.CharField(max_length=64)
+    toAccount = serializers.CharField(max_length=64)
+    coin = serializers.CharField(max_length=16)
+    amount = serializers.DecimalField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES, min_value=0)
+    memo = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+    
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Amount must be positive')
+        return value
+
+class TransferSerializer(serializers.ModelSerializer):
+    fromAccount = serializers.CharField(source='source.name')
+    toAccount = serializers.CharField(source='destination.name')
+    coin = serializers.CharField(source='source.asset')
+    
+    class Meta:
+        model = Transfer
+        fields = ['id', 'fromAccount', 'toAccount', 'coin', 'amount', 'memo', 'created_at']
+
+class LedgerEntrySerializer(serializers.Serializer):
+    """Serializes the lean history rows returned by ``pagination.history_page``"""
+    id = serializers.IntegerField()
+    transfer_id = serializers.IntegerField()
+    coin = serializers.CharField(source='asset')
+    amount = serializers.DecimalField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    balance_after = serializers.DecimalField(max_digits=AMOUNT_DIGITS, decimal_places=AMOUNT_PLACES)
+    created_at = serializers.DateTimeField()
@@ -1,3 +1,628 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from backend.replicas import ReplicaRouter
+from backend.sqlite import write_atomic
+from backend.statement_timeout import StatementTimeoutMiddleware
+
+from . import ledger
+from .engine import TransferEngine, get_transfer_engine
+from .idempotency import IdempotencyStore, KeyReused, RequestInProgress, StoredResponse, get_idempotency_store
+from .ledger import (
+    InsufficientFunds, LedgerError, TransferConflict, find_inconsistencies, get_system_account, post_transfer,
+    rebuild_balance, unbalanced_transfers,
+)
+from .models import Account, LedgerEntry, Transfer
+
+User = get_user_model()
+
+
+class LedgerTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.treasury = get_system_account('treasury', 'USDT')
+        self.main = Account.objects.create(owner=self.user, name='binance_main', asset='USDT')
+        post_transfer(self.treasury, self.main, Decimal('100'))
+
+
+class PostTransferTests(LedgerTestMixin, TestCase):
+    def test_entries_and_balances_move_together(self):
+        sub = Account.objects.create(owner=self.user, name='okx_sub1', asset='USDT')
+        transfer = post_transfer(self.main, sub, Decimal('30.5'), initiated_by=self.user)
+        self.main.refresh_from_db()
+        sub.refresh_from_db()
+        self.assertEqual(self.main.balance, Decimal('69.5'))
+        self.assertEqual(sub.balance, Decimal('30.5'))
+        self.assertEqual(sorted(e.amount for e in transfer.entries.all()), [Decimal('-30.5'), Decimal('30.5')])
+        self.assertEqual(transfer.entries.get(account=sub).balance_after, Decimal('30.5'))
+
+    def test_insufficient_funds_writes_nothing(self):
+        sub = Account.objects.create(owner=self.user, name='okx_sub1', asset='USDT')
+        entries = LedgerEntry.objects.count()
+        with self.assertRaises(InsufficientFunds):
+            post_transfer(self.main, sub, Decimal('100.01'))
+        self.assertEqual(LedgerEntry.objects.count(), entries)
+        self.main.refresh_from_db()
+        self.assertEqual(self.main.balance, Decimal('100'))
+
+    def test_rejects_mismatched_assets(self):
+        eth = Account.objects.create(owner=self.user, name='okx_sub1', asset='ETH')
+        with self.assertRaises(LedgerError):
+            post_transfer(self.main, eth, Decimal('1'))
+
+    def test_entries_are_append_only(self):
+        entry = LedgerEntry.objects.first()
+        with self.assertRaises(TypeError):
+            entry.save()
+        with self.assertRaises(TypeError):
+            entry.delete()
+        with self.assertRaises(TypeError):
+            LedgerEntry.objects.update(amount=0)
+
+    def test_amounts_keep_every_decimal_place(self):
+        sub = Account.objects.create(owner=self.user, name='okx_sub1', asset='USDT')
+        amount = Decimal('1.000000000000000001')
+        transfer = post_transfer(self.main, sub, amount)
+        transfer.refresh_from_db()
+        sub.refresh_from_db()
+        self.main.refresh_from_db()
+        self.assertEqual(transfer.amount, amount)
+        self.assertEqual(sub.balance, amount)
+        self.assertEqual(self.main.balance, Decimal('98.999999999999999999'))
+        self.assertEqual(sorted(e.amount for e in transfer.entries.all()), [-amount, amount])
+        self.assertEqual(str(transfer.entries.get(account=sub).balance_after), '1.000000000000000001')
+        self.assertEqual(list(find_inconsistencies()), [])
+        self.assertEqual(list(unbalanced_transfers()), [])
+        self.assertEqual(rebuild_balance(self.main).balance, Decimal('98.999999999999999999'))
+
+    def test_check_constraints_hold_at_full_scale(self):
+        Account.objects.filter(pk=self.main.pk).update(balance=0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Account.objects.filter(pk=self.main.pk).update(balance=Decimal('-0.000000000000000001'))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Transfer.objects.create(source=self.treasury, destination=self.main, amount=0)
+        Transfer.objects.create(source=self.treasury, destination=self.main, amount=Decimal('0.000000000000000001'))
+
+
+class TransferEngineTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.sub = Account.objects.create(owner=self.user, name='okx_sub1', asset='USDT')
+
+    def test_critical_section_is_lock_insert_update_insert(self):
+        engine = TransferEngine()
+        with self.assertNumQueries(6):
+            # savepoint, locked SELECT, transfer INSERT, balances UPDATE, entries INSERT, release
+            engine.transfer(self.main, self.sub, Decimal('1'))
+
+
+class TransferRetryTests(TransactionTestCase):
+    """Outside TestCase's transaction, where the engine is allowed to retry"""
+
+    def setUp(self):
+        treasury = get_system_account('treasury', 'USDT')
+        self.main = Account.objects.create(name='main', asset='USDT')
+        self.sub = Account.objects.create(name='sub', asset='USDT')
+        post_transfer(treasury, self.main, Decimal('10'))
+
+    def test_retries_lock_errors(self):
+        engine = TransferEngine(max_retries=2, backoff=0)
+        post = engine._post
+        calls = []
+
+        def fail_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return post(*args)
+
+        with mock.patch.object(engine, '_post', side_effect=fail_once):
+            engine.transfer(self.main, self.sub, Decimal('1'))
+        self.assertEqual(engine.stats(), {'committed': 1, 'retries': 1, 'conflicts': 0})
+
+    @override_settings(LEDGER_TRANSFER_MAX_RETRIES=1, LEDGER_TRANSFER_BACKOFF=0)
+    def test_gives_up_with_conflict(self):
+        engine = get_transfer_engine()
+        with mock.patch.object(engine, '_post', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(TransferConflict):
+                engine.transfer(self.main, self.sub, Decimal('1'))
+        self.assertEqual(engine.stats()['retries'], 1)
+
+    def test_other_database_errors_are_not_retried(self):
+        engine = TransferEngine(backoff=0)
+        with mock.patch.object(engine, '_post', side_effect=OperationalError('disk I/O error')) as post:
+            with self.assertRaises(OperationalError):
+                engine.transfer(self.main, self.sub, Decimal('1'))
+        self.assertEqual(post.call_count, 1)
+
+
+class ConcurrentTransferTests(TransactionTestCase):
+    def test_no_lost_updates(self):
+        user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+        treasury = get_system_account('treasury', 'USDT')
+        hot = [Account.objects.create(owner=user, name=f'hot_{i}', asset='USDT') for i in range(3)]
+        for account in hot:
+            post_transfer(treasury, account, Decimal('1000'))
+
+        expected = {account.pk: Decimal('1000') for account in hot}
+        plans = []
+        for worker in range(8):
+            plan = []
+            for i in range(20):
+                source, destination = hot[(worker + i) % 3], hot[(worker + i + 1 + i % 2) % 3]
+                amount = Decimal(i % 5 + 1)
+                expected[source.pk] -= amount
+                expected[destination.pk] += amount
+                plan.append((source, destination, amount))
+            plans.append(plan)
+
+        errors = []
+
+        def run(plan):
+            try:
+                for source, destination, amount in plan:
+                    post_transfer(Account(pk=source.pk, asset='USDT'), Account(pk=destination.pk, asset='USDT'), amount)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(plan,)) for plan in plans]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual({a.pk: a.balance for a in Account.objects.filter(owner=user)}, expected)
+        self.assertEqual(list(find_inconsistencies()), [])
+        self.assertEqual(LedgerEntry.objects.count(), 2 * (3 + 8 * 20))
+
+    @skipUnless(connection.vendor == 'postgresql', 'row locks need PostgreSQL')
+    def test_same_pair_in_both_directions_does_not_deadlock(self):
+        treasury = get_system_account('treasury', 'USDT')
+        left = Account.objects.create(name='left', asset='USDT')
+        right = Account.objects.create(name='right', asset='USDT')
+        post_transfer(treasury, left, Decimal('1000'))
+        post_transfer(treasury, right, Decimal('1000'))
+        # No retries, so a deadlock (or any lock conflict) surfaces as TransferConflict
+        engine = TransferEngine(max_retries=0)
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def run(worker):
+            source, destination = (left, right) if worker % 2 else (right, left)
+            try:
+                barrier.wait()
+                for _ in range(25):
+                    engine.transfer(Account(pk=source.pk, asset='USDT'), Account(pk=destination.pk, asset='USDT'), Decimal('1'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(engine.stats(), {'committed': 200, 'retries': 0, 'conflicts': 0})
+        left.refresh_from_db()
+        right.refresh_from_db()
+        self.assertEqual((left.balance, right.balance), (Decimal('1000'), Decimal('1000')))
+        self.assertEqual(list(find_inconsistencies()), [])
+
+
+    @skipUnless(connection.vendor == 'postgresql', 'snapshots of a live ledger need PostgreSQL')
+    def test_transfers_during_a_check_are_not_drift(self):
+        treasury = get_system_account('treasury', 'USDT')
+        account = Account.objects.create(name='hot', asset='USDT')
+        post_transfer(treasury, account, Decimal('1000'))
+        entry_totals = ledger._entry_totals
+
+        def totals_then_transfer(entries, key):
+            totals = entry_totals(entries, key)
+
+            def run():
+                try:
+                    post_transfer(Account(pk=treasury.pk, asset='USDT'), Account(pk=account.pk, asset='USDT'), Decimal('1'))
+                finally:
+                    connection.close()
+
+            # Commits between the entry sums and the balance reads
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+            return totals
+
+        with mock.patch('api.ledger._entry_totals', side_effect=totals_then_transfer):
+            self.assertEqual(list(find_inconsistencies()), [])
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('1001'))
+
+
+class LedgerEndpointTests(LedgerTestMixin, TestCase):
+    def test_balance_read_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/balances/binance_main/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['balances'][0]['asset'], 'USDT')
+        self.assertEqual(Decimal(response.json()['balances'][0]['available']), Decimal('100'))
+
+    def test_transfer_and_history(self):
+        response = self.client.post(
+            '/api/v1/transfers/',
+            {'fromAccount': 'binance_main', 'toAccount': 'okx_sub1', 'coin': 'USDT', 'amount': '40'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['toAccount'], 'okx_sub1')
+
+        balances = self.client.get('/api/v1/balances/okx_sub1/').json()['balances']
+        self.assertEqual(Decimal(balances[0]['total']), Decimal('40'))
+        history = self.client.get('/api/v1/transactions/binance_main/').json()['transactions']
+        self.assertEqual([Decimal(e['amount']) for e in history], [Decimal('-40'), Decimal('100')])
+
+    def test_transfer_errors(self):
+        data = {'fromAccount': 'binance_main', 'toAccount': 'okx_sub1', 'coin': 'USDT', 'amount': '1000'}
+        response = self.client.post('/api/v1/transfers/', data, format='json')
+        self.assertEqual(response.json(), {'error': 'Insufficient funds'})
+        response = self.client.post('/api/v1/transfers/', {**data, 'coin': 'BTC', 'amount': '1'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/transfers/', {**data, 'amount': '0'}, format='json')
+        self.assertIn('amount', response.json())
+
+    def test_accounts_are_scoped_to_user(self):
+        other = User.objects.create_user(clerk_id='user_456', email='other@example.com')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/v1/balances/binance_main/').json()['balances'], [])
+        self.assertEqual(self.client.get('/api/v1/transactions/binance_main/').json()['transactions'], [])
+
+
+class IdempotencyStoreTests(SimpleTestCase):
+    def test_runs_once_and_replays(self):
+        store = IdempotencyStore()
+        execute = mock.Mock(return_value=StoredResponse(201, {'id': 1}))
+        self.assertEqual(store.run(1, 'k', 'fp', execute), (StoredResponse(201, {'id': 1}), False))
+        self.assertEqual(store.run(1, 'k', 'fp', execute), (StoredResponse(201, {'id': 1}), True))
+        self.assertEqual(store.run(2, 'k', 'fp', execute)[1], False)
+        self.assertEqual(execute.call_count, 2)
+        with self.assertRaises(KeyReused):
+            store.run(1, 'k', 'other', execute)
+
+    def test_failures_release_the_key(self):
+        store = IdempotencyStore()
+        with self.assertRaises(RuntimeError):
+            store.run(1, 'k', 'fp', mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(store.run(1, 'k', 'fp', lambda: StoredResponse(503, {}))[1], False)
+        self.assertEqual(store.run(1, 'k', 'fp', lambda: StoredResponse(201, {}))[1], False)
+
+    def test_bounded_and_expiring(self):
+        store = IdempotencyStore(ttl=60, max_size=2)
+        for key in 'abc':
+            store.run(1, key, 'fp', lambda: StoredResponse(201, {}))
+        self.assertEqual(store.run(1, 'a', 'fp', lambda: StoredResponse(201, {}))[1], False)
+        with mock.patch('api.idempotency.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(store.run(1, 'c', 'fp', lambda: StoredResponse(201, {}))[1], False)
+
+    def check_duplicates_wait_for_the_first(self, store):
+        started, finish = threading.Event(), threading.Event()
+        results = []
+
+        def first():
+            started.set()
+            finish.wait(5)
+            return StoredResponse(201, {'id': 1})
+
+        thread = threading.Thread(target=lambda: results.append(store.run(1, 'k', 'fp', first)))
+        thread.start()
+        started.wait(5)
+        threading.Timer(0.1, finish.set).start()
+        self.assertEqual(store.run(1, 'k', 'fp', mock.Mock(side_effect=AssertionError)), (StoredResponse(201, {'id': 1}), True))
+        thread.join()
+        self.assertEqual(results, [(StoredResponse(201, {'id': 1}), False)])
+
+    def test_duplicates_wait_for_the_first(self):
+        self.check_duplicates_wait_for_the_first(IdempotencyStore())
+
+    def test_duplicates_wait_for_the_first_with_shared_cache(self):
+        self.check_duplicates_wait_for_the_first(IdempotencyStore(cache_alias='default'))
+
+    def test_gives_up_waiting(self):
+        store = IdempotencyStore(wait_timeout=0.05)
+        store._claim('1:k', 'fp')
+        with self.assertRaises(RequestInProgress):
+            store.run(1, 'k', 'fp', mock.Mock(side_effect=AssertionError))
+
+
+class IdempotentTransferTests(LedgerTestMixin, TestCase):
+    data = {'fromAccount': 'binance_main', 'toAccount': 'okx_sub1', 'coin': 'USDT', 'amount': '40'}
+
+    def setUp(self):
+        super().setUp()
+        get_idempotency_store()._entries.clear()
+
+    def post(self, data, key):
+        return self.client.post('/api/v1/transfers/', data, format='json', headers={'Idempotency-Key': key})
+
+    def test_replay_returns_the_first_response_without_queries(self):
+        first = self.post(self.data, 'key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        with self.assertNumQueries(0):
+            replay = self.post(self.data, 'key-1')
+        self.assertEqual((replay.status_code, replay.json()), (201, first.json()))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Account.objects.get(pk=self.main.pk).balance, Decimal('60'))
+
+    def test_errors_are_replayed_too(self):
+        self.assertEqual(self.post({**self.data, 'amount': '1000'}, 'key-1').json(), {'error': 'Insufficient funds'})
+        post_transfer(self.treasury, self.main, Decimal('1000'))
+        self.assertEqual(self.post({**self.data, 'amount': '1000'}, 'key-1').json(), {'error': 'Insufficient funds'})
+
+    def test_key_reuse_and_bad_keys(self):
+        self.post(self.data, 'key-1')
+        self.assertEqual(self.post({**self.data, 'amount': '41'}, 'key-1').status_code, 422)
+        self.assertEqual(self.post(self.data, 'k' * 256).status_code, 400)
+        self.assertEqual(self.post(self.data, 'key-2').status_code, 201)
+        self.assertEqual(Account.objects.get(pk=self.main.pk).balance, Decimal('20'))
+
+    def test_conflicts_are_not_stored(self):
+        with mock.patch('api.views.post_transfer', side_effect=TransferConflict('Account is busy; please retry')):
+            self.assertEqual(self.post(self.data, 'key-1').status_code, 503)
+        self.assertEqual(self.post(self.data, 'key-1').status_code, 201)
+
+
+class TransactionHistoryTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.savings = Account.objects.create(owner=self.user, name='savings', asset='USDT')
+        for _ in range(25):
+            post_transfer(self.main, self.savings, Decimal('1'))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            body = self.client.get(url).json()
+            ids.extend(entry['id'] for entry in body['transactions'])
+            url = body['next_cursor'] and f'/api/v1/transactions/binance_main/?limit=10&cursor={body["next_cursor"]}'
+        return ids
+
+    def test_cursor_walks_every_entry_once(self):
+        ids = self.walk('/api/v1/transactions/binance_main/?limit=10')
+        expected = list(LedgerEntry.objects.filter(account=self.main).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 26)
+
+    def test_merges_assets_in_order(self):
+        btc = Account.objects.create(owner=self.user, name='binance_main', asset='BTC')
+        post_transfer(get_system_account('treasury', 'BTC'), btc, Decimal('1'))
+        history = self.client.get('/api/v1/transactions/binance_main/?limit=3').json()['transactions']
+        self.assertEqual([entry['coin'] for entry in history], ['BTC', 'USDT', 'USDT'])
+        self.assertEqual(len(self.walk('/api/v1/transactions/binance_main/?limit=10')), 27)
+        history = self.client.get('/api/v1/transactions/binance_main/?asset=BTC').json()['transactions']
+        self.assertEqual([entry['coin'] for entry in history], ['BTC'])
+
+    def test_deep_page_costs_the_same_as_the_first(self):
+        first = self.client.get('/api/v1/transactions/binance_main/?limit=5').json()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f'/api/v1/transactions/binance_main/?limit=5&cursor={first["next_cursor"]}')
+        # One query for the account rows, one bounded keyset query per asset
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertIn('LIMIT 6', context.captured_queries[1]['sql'])
+        self.assertNotIn('OFFSET', context.captured_queries[1]['sql'])
+
+    def test_rejects_offset_and_bad_input(self):
+        for query in ('offset=50', 'page=2', 'limit=0', 'limit=201', 'limit=x', 'cursor=nonsense'):
+            response = self.client.get(f'/api/v1/transactions/binance_main/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+
+class TransactionExportTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.savings = Account.objects.create(owner=self.user, name='savings', asset='USDT')
+        for _ in range(3):
+            post_transfer(self.main, self.savings, Decimal('1'))
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/v1/transactions/binance_main/export/?{query}')
+        self.assertEqual(response.status_code, 200, response)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response = self.client.get('/api/v1/transactions/binance_main/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('binance_main-transactions.csv', response['Content-Disposition'])
+        with self.assertNumQueries(0):
+            header = next(iter(response.streaming_content))
+        self.assertEqual(header, b'id,transfer_id,coin,amount,balance_after,created_at\r\n')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([Decimal(row[3]) for row in rows], [Decimal('100'), Decimal('-1'), Decimal('-1'), Decimal('-1')])
+        self.assertEqual(Decimal(rows[-1][4]), Decimal('97'))
+
+    def test_ndjson(self):
+        lines = self.export('output=ndjson').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0])['coin'], 'USDT')
+        self.assertEqual(Decimal(json.loads(lines[-1])['balance_after']), Decimal('97'))
+
+    def test_filters_are_applied_in_the_query(self):
+        btc = Account.objects.create(owner=self.user, name='binance_main', asset='BTC')
+        post_transfer(get_system_account('treasury', 'BTC'), btc, Decimal('1'))
+        self.assertEqual(len(self.export('output=ndjson').splitlines()), 5)
+        self.assertEqual(len(self.export('output=ndjson&asset=BTC').splitlines()), 1)
+
+        first = LedgerEntry.objects.filter(account=self.main).order_by('created_at', 'id')[1]
+        with CaptureQueriesContext(connection) as context:
+            body = self.export(f'output=ndjson&asset=USDT&since={first.created_at.isoformat().replace("+", "%2B")}')
+        self.assertEqual(len(body.splitlines()), 3)
+        [query] = [q['sql'] for q in context.captured_queries if 'ledger_entries' in q['sql']]
+        self.assertIn('created_at', query.split('WHERE')[1])
+        self.assertEqual(self.export('output=ndjson&until=2000-01-01'), '')
+        self.assertEqual(len(self.export(f'output=ndjson&until={timezone.localdate().isoformat()}').splitlines()), 5)
+
+    def test_rejects_bad_parameters(self):
+        for query in ('output=xml', 'since=yesterday', 'until=2024-13-01'):
+            response = self.client.get(f'/api/v1/transactions/binance_main/export/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_scoped_to_user(self):
+        self.client.force_authenticate(User.objects.create_user(clerk_id='user_456', email='other@example.com'))
+        self.assertEqual(self.export('output=ndjson'), '')
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    databases = {'default'}
+
+    def connect(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': f'{tmpdir.name}/db.sqlite3'}, alias='profile')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return lambda pragma: wrapper.connection.execute(f'PRAGMA {pragma}').fetchone()[0]
+
+    @override_settings(SQLITE_TUNED=True, SQLITE_BUSY_TIMEOUT=1234, SQLITE_MMAP_SIZE=1 << 20)
+    def test_tuned_connections(self):
+        pragma = self.connect()
+        self.assertEqual(pragma('journal_mode'), 'wal')
+        self.assertEqual(pragma('busy_timeout'), 1234)
+        self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(pragma('mmap_size'), 1 << 20)
+
+    @override_settings(SQLITE_TUNED=False)
+    def test_untouched_by_default(self):
+        self.assertEqual(self.connect()('journal_mode'), 'delete')
+
+    def begin_statement(self, block):
+        with CaptureQueriesContext(connection) as queries, block:
+            Account.objects.exists()
+        return queries.captured_queries[0]['sql']
+
+    @override_settings(SQLITE_TUNED=True)
+    def test_only_write_blocks_begin_immediate(self):
+        self.assertEqual(self.begin_statement(write_atomic()), 'BEGIN IMMEDIATE')
+        # Read-only transactions (e.g. streaming exports) must not take the write lock
+        self.assertEqual(self.begin_statement(transaction.atomic()), 'BEGIN')
+        self.assertIsNone(connection.transaction_mode)
+
+    @override_settings(SQLITE_TUNED=False)
+    def test_write_blocks_are_deferred_by_default(self):
+        self.assertEqual(self.begin_statement(write_atomic()), 'BEGIN')
+
+
+class StatementTimeoutTests(SimpleTestCase):
+    def connect(self):
+        """Send connection_created for a fake PostgreSQL connection; returns the statements run on it"""
+        wrapper = mock.MagicMock(vendor='postgresql')
+        connection_created.send(sender=type(wrapper), connection=wrapper)
+        cursor = wrapper.connection.cursor.return_value.__enter__.return_value
+        return [call.args[0] for call in cursor.execute.call_args_list]
+
+    @override_settings(DB_STATEMENT_TIMEOUT=1500)
+    def test_only_connections_opened_in_requests(self):
+        self.assertEqual(self.connect(), [])
+        statements = StatementTimeoutMiddleware(lambda request: self.connect())(RequestFactory().get('/'))
+        self.assertEqual(statements, ['SET statement_timeout = 1500'])
+        self.assertEqual(self.connect(), [])
+
+    @override_settings(DB_STATEMENT_TIMEOUT=1500)
+    async def test_async_requests(self):
+        async def view(request):
+            return self.connect()
+
+        self.assertEqual(await StatementTimeoutMiddleware(view)(RequestFactory().get('/')), ['SET statement_timeout = 1500'])
+
+    @override_settings(DB_STATEMENT_TIMEOUT=0)
+    def test_disabled(self):
+        self.assertEqual(StatementTimeoutMiddleware(lambda request: self.connect())(RequestFactory().get('/')), [])
+
+
+@override_settings(DATABASE_REPLICA_ALIAS='replica')
+class ReplicaRoutingTests(LedgerTestMixin, TransactionTestCase):
+    # The replica mirrors the test database on its own connection, so the
+    # rows it reads have to be committed
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+    def queries(self, path):
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, len(primary), len(replica)
+
+    def test_read_only_views_use_the_replica(self):
+        response, primary, replica = self.queries('/api/v1/balances/binance_main/')
+        self.assertEqual(Decimal(response.json()['balances'][0]['total']), Decimal('100'))
+        self.assertEqual((primary, replica), (0, 1))
+        self.assertEqual(self.queries('/api/v1/transactions/binance_main/')[1:], (0, 2))
+        response = self.client.get('/api/v1/transactions/binance_main/export/')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_writes_make_the_user_read_from_the_primary(self):
+        data = {'fromAccount': 'binance_main', 'toAccount': 'okx_sub1', 'coin': 'USDT', 'amount': '40'}
+        self.assertEqual(self.client.post('/api/v1/transfers/', data, format='json').status_code, 201)
+        self.assertEqual(self.queries('/api/v1/balances/binance_main/')[1:], (1, 0))
+
+        # Other users are unaffected, and the marker expires
+        self.client.force_authenticate(User.objects.create_user(clerk_id='user_456', email='other@example.com'))
+        self.assertEqual(self.queries('/api/v1/balances/binance_main/')[1:], (0, 1))
+        self.client.force_authenticate(self.user)
+        caches['default'].delete(f'replica:sticky:{self.user.pk}')
+        self.assertEqual(self.queries('/api/v1/balances/binance_main/')[1:], (0, 1))
+
+    @override_settings(DATABASE_REPLICA_ALIAS=None)
+    def test_primary_only_without_a_replica(self):
+        self.assertEqual(self.queries('/api/v1/balances/binance_main/')[1:], (1, 0))
+
+    def test_router_never_migrates_or_writes_the_replica(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'api'))
+        self.assertTrue(router.allow_migrate('default', 'api'))
+        self.assertEqual(router.db_for_write(Account), 'default')
+        self.assertIsNone(router.db_for_read(Account))
+
+
+class CheckLedgerCommandTests(LedgerTestMixin, TestCase):
+    def test_consistent_ledger(self):
+        out = StringIO()
+        call_command('check_ledger', stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+    def test_detects_and_rebuilds_drift(self):
+        Account.objects.filter(pk=self.main.pk).update(balance=Decimal('5'))
+        with self.assertRaises(CommandError):
+            call_command('check_ledger', stdout=StringIO(), stderr=StringIO())
+        call_command('check_ledger', '--rebuild', stdout=StringIO(), stderr=StringIO())
+        self.main.refresh_from_db()
+        self.assertEqual(self.main.balance, Decimal('100'))
+        call_command('check_ledger', stdout=StringIO())
@@ -1,6 +1,11 @@
 from django.urls import path, include
+from . import views
 
 urlpatterns = [
     path('auth/', include('authentication.urls')),
     path('webauthn/', include('webauthn_mfa.urls')),
-]
\ No newline at end of file
+    path('balances/<str:account>/', views.account_balances, name='account-balances'),
+    path('transfers/', views.create_transfer, name='transfers'),
+    path('transactions/<str:account>/', views.account_transactions, name='account-transactions'),
+    path('transactions/<str:account>/export/', views.export_transactions, name='account-transactions-export'),
+]
@@ -1,3 +1,157 @@
-from django.shortcuts import render
+from datetime import datetime, time, timedelta
 
-# Create your views here.
+from django.db import router
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from backend.replicas import use_replica
+from .export import FORMATS, export_rows
+from .idempotency import KeyReused, RequestInProgress, StoredResponse, get_idempotency_store, request_fingerprint
+from .ledger import LedgerError, TransferConflict, post_transfer
+from .models import Account
+from .pagination import InvalidCursor, history_page
+from .serializers import BalanceSerializer, LedgerEntrySerializer, TransferRequestSerializer, TransferSerializer
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@use_replica
+def account_balances(request, account):
+    """Balances of one of the user's accounts, one materialized row per asset"""
+    balances = Account.objects.filter(owner=request.user, name=account).order_by('asset')
+    
+    return Response({
+        'account': account,
+        'balances': BalanceSerializer(balances, many=True).data
+    })
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_transfer(request):
+    """Move funds between two of the user's accounts.
+    
+    With an ``Idempotency-Key`` header, repeats of the request return the first
+    response (marked ``Idempotent-Replayed: true``) without posting again.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        result, replayed = _post_transfer(request), False
+    elif not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return Response({'error': f'Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        try:
+            result, replayed = get_idempotency_store().run(
+                request.user.pk, key, request_fingerprint(request), lambda: _post_transfer(request)
+            )
+        except KeyReused as e:
+            return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except RequestInProgress as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+    
+    headers = dict(result.headers)
+    if replayed:
+        headers['Idempotent-Replayed'] = 'true'
+    return Response(result.data, status=result.status, headers=headers)
+
+def _post_transfer(request):
+    serializer = TransferRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return StoredResponse(status.HTTP_400_BAD_REQUEST, serializer.errors)
+    data = serializer.validated_data
+    
+    # The source must already hold the asset; the destination is opened on first use
+    source = Account.objects.filter(owner=request.user, name=data['fromAccount'], asset=data['coin']).first()
+    if source is None:
+        return StoredResponse(status.HTTP_400_BAD_REQUEST, {'error': 'Insufficient funds'})
+    destination, _ = Account.objects.get_or_create(owner=request.user, name=data['toAccount'], asset=data['coin'])
+    
+    try:
+        transfer = post_transfer(source, destination, data['amount'], initiated_by=request.user, memo=data['memo'])
+    except TransferConflict as e:
+        return StoredResponse(status.HTTP_503_SERVICE_UNAVAILABLE, {'error': str(e)}, {'Retry-After': '1'})
+    except LedgerError as e:
+        return StoredResponse(status.HTTP_400_BAD_REQUEST, {'error': str(e)})
+    
+    return StoredResponse(status.HTTP_201_CREATED, TransferSerializer(transfer).data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@use_replica
+def account_transactions(request, account):
+    """Ledger entries of one of the user's accounts, newest first.
+    
+    Paginated by cursor only: pass the ``next_cursor`` of one page as
+    ``?cursor=`` to get the next. ``?limit=`` sets the page size and
+    ``?asset=`` restricts the history to one asset.
+    """
+    if 'offset' in request.query_params or 'page' in request.query_params:
+        return Response({'error': 'Use cursor pagination'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = int(request.query_params.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        return Response({'error': f'limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    accounts = Account.objects.filter(owner=request.user, name=account).only('asset')
+    if 'asset' in request.query_params:
+        accounts = accounts.filter(asset=request.query_params['asset'])
+    try:
+        entries, next_cursor = history_page(accounts, request.query_params.get('cursor'), limit)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'account': account,
+        'transactions': LedgerEntrySerializer(entries, many=True).data,
+        'next_cursor': next_cursor,
+    })
+
+def _parse_bound(value, end=False):
+    """ISO date or datetime query parameter as an aware datetime; a bare ``end`` date includes the whole day"""
+    try:
+        day = parse_date(value)
+        if day is not None:
+            moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+        elif (moment := parse_datetime(value)) is None:
+            raise ValueError(value)
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@use_replica
+def export_transactions(request, account):
+    """Full history of one of the user's accounts as a streamed CSV or NDJSON download.
+    
+    ``?output=csv|ndjson`` picks the format, ``?asset=`` one asset and
+    ``?since=``/``?until=`` (ISO dates or datetimes, ``since`` inclusive) the
+    date range. Rows are read through a chunked cursor and written as they
+    arrive, so memory use does not grow with the history.
+    """
+    output = request.query_params.get('output', 'csv')
+    if output not in FORMATS:
+        return Response({'error': f'output must be one of {", ".join(FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since = _parse_bound(request.query_params['since']) if 'since' in request.query_params else None
+        until = _parse_bound(request.query_params['until'], end=True) if 'until' in request.query_params else None
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Rows are read after the view returns, so pin the database chosen for this request
+    accounts = Account.objects.using(router.db_for_read(Account)).filter(owner=request.user, name=account)
+    if 'asset' in request.query_params:
+        accounts = accounts.filter(asset=request.query_params['asset'])
+    
+    content_type, stream = FORMATS[output]
+    response = StreamingHttpResponse(stream(export_rows(accounts, since, until)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{account}-transactions.{output}"'
+    return response
@@ -9,11 +9,8 @@ from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.utils.decorators import method_decorator
-from clerk_backend_api import Clerk
-
-clerk = Clerk(
-    bearer_auth=settings.CLERK_SECRET_KEY,
-)
+from . import mfa
+from .backends import clerk_session_id
 
 User = get_user_model()
 
@@ -41,17 +38,21 @@ class WebAuthnAdminSite(admin.AdminSite):
     def logout(self, request, extra_context=None):
         """Custom logout that cleans up WebAuthn session"""
         # Clean up WebAuthn verification session
-        session_keys = ['webauthn_verified', 'webauthn_verified_at', 'admin_redirect_url']
-        for key in session_keys:
-            if key in request.session:
-                del request.session[key]
+        request.session.pop('admin_redirect_url', None)
         
-        # Logout from clerk
-        clerk.sessions.revoke(request.user)
+        # Read the Clerk session before logging out clears request.user
+        session_id = clerk_session_id(request) if request.user.is_authenticated else None
         
+        # Call parent logout, then revoke the WebAuthn verification (session flags or signed cookie)
+        response = super().logout(request, extra_context)
+        mfa.revoke(request, response)
         
-        # Call parent logout
-        return super().logout(request, extra_context)
+        # Ending the Clerk session is a slow API call, so it runs as a task
+        if session_id:
+            from .tasks import revoke_clerk_session
+            
+            revoke_clerk_session.delay(session_id)
+        return response
     
     def get_urls(self):
         urls = super().get_urls()
@@ -80,8 +81,8 @@ class WebAuthnAdminSite(admin.AdminSite):
                 })
             
             # Check if user has WebAuthn credentials
-            from webauthn_mfa.models import WebAuthnCredential
-            has_credentials = WebAuthnCredential.objects.filter(user=request.user.id).exists()
+            from webauthn_mfa.descriptors import get_credential_descriptors
+            has_credentials = bool(get_credential_descriptors(request.user))
             
             if not has_credentials:
                 return JsonResponse({
@@ -100,10 +101,10 @@ class WebAuthnAdminSite(admin.AdminSite):
     
     def webauthn_verify_view(self, request):
         """WebAuthn verification page for admin access"""
-        from webauthn_mfa.models import WebAuthnCredential
+        from webauthn_mfa.descriptors import get_credential_descriptors
         
         # Check if user has WebAuthn credentials
-        has_credentials = WebAuthnCredential.objects.filter(user=request.user.id).exists()
+        has_credentials = request.user.is_authenticated and bool(get_credential_descriptors(request.user))
         
         if not has_credentials:
             messages.error(request, "You need to set up a security key before accessing the admin panel. Please contact your administrator.")
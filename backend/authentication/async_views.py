@@ -0,0 +1,33 @@
+"""Async counterparts of ``views`` for ASGI deployments (``ASYNC_VIEWS=True``)"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.permissions import AllowAny
+
+from backend.replicas import use_replica
+
+from .async_api import async_api_view
+from .serializers import UserSerializer
+from .views import verify_webhook_signature
+from .webhooks import aenqueue_event, schedule_drain
+
+
+@async_api_view(['POST'], permission_classes=[AllowAny])
+async def clerk_webhook_sync_user(request):
+    signature = request.META.get('HTTP_SVIX_SIGNATURE')
+    if not verify_webhook_signature(request.body, signature):
+        return JsonResponse({'error': 'Invalid signature'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    svix_id = request.META.get('HTTP_SVIX_ID') or hashlib.sha256(request.body).hexdigest()
+    await aenqueue_event(svix_id, request.data, request.META.get('HTTP_SVIX_TIMESTAMP'))
+    # Publishing to the broker blocks
+    await sync_to_async(schedule_drain)()
+    return JsonResponse({'status': 'queued'})
+
+
+@async_api_view(['GET'])
+@use_replica
+async def current_user(request):
+    return JsonResponse(UserSerializer(request.user).data)
@@ -1,21 +1,77 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from jose import jwt, JWTError
-import requests
 from django.conf import settings
 from django.utils import timezone
-import json
+from .identity_cache import identity_cache
+from .jwks import get_jwks_cache, get_verified_token_cache
+from .touch import TouchBuffer
 
 User = get_user_model()
 
+# User field -> token claims it is synced from, in order of preference
+PROFILE_CLAIMS = {
+    'first_name': ('given_name', 'first_name'),
+    'last_name': ('family_name', 'last_name'),
+    'profile_image_url': ('picture', 'image_url'),
+    'phone_number': ('phone_number',),
+}
+
+# Request attribute holding the per-request authentication result
+REQUEST_AUTH_ATTR = '_clerk_auth_result'
+_NOT_AUTHENTICATED = object()
+
+last_synced_touches = TouchBuffer(User, 'last_synced_at', flush_interval=settings.CLERK_LAST_SYNCED_FLUSH_INTERVAL)
+
+def clerk_session_id(request):
+    """Clerk session id (``sid`` claim) of the token ``request`` authenticated with, if any"""
+    from jose import jwt
+
+    result = getattr(getattr(request, '_request', request), REQUEST_AUTH_ATTR, None)
+    if not isinstance(result, tuple):
+        return None
+    token = result[1]
+    # The token was verified when the request authenticated
+    claims = get_verified_token_cache().get(token) or jwt.get_unverified_claims(token)
+    return claims.get('sid')
+
 class ClerkAuthentication(BaseAuthentication):
     def authenticate(self, request):
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
+        # The middleware sees the Django HttpRequest and DRF wraps the same
+        # object, so the result is stored there and shared by both layers
+        http_request = getattr(request, '_request', request)
+        result = getattr(http_request, REQUEST_AUTH_ATTR, _NOT_AUTHENTICATED)
+        if result is _NOT_AUTHENTICATED:
+            try:
+                result = self._authenticate(http_request)
+            except AuthenticationFailed as e:
+                result = e
+            setattr(http_request, REQUEST_AUTH_ATTR, result)
+        
+        if isinstance(result, AuthenticationFailed):
+            raise result
+        return result
+    
+    async def aauthenticate(self, request):
+        """Async counterpart of authenticate(), sharing the same per-request result"""
+        http_request = getattr(request, '_request', request)
+        result = getattr(http_request, REQUEST_AUTH_ATTR, _NOT_AUTHENTICATED)
+        if result is _NOT_AUTHENTICATED:
+            try:
+                result = await self._aauthenticate(http_request)
+            except AuthenticationFailed as e:
+                result = e
+            setattr(http_request, REQUEST_AUTH_ATTR, result)
         
-        token = auth_header.split(' ')[1]
+        if isinstance(result, AuthenticationFailed):
+            raise result
+        return result
+    
+    def _authenticate(self, request):
+        token = self.get_bearer_token(request)
+        if token is None:
+            return None
         
         try:
             # Verify token with Clerk's JWKS
@@ -28,73 +84,197 @@ class ClerkAuthentication(BaseAuthentication):
         except Exception as e:
             raise AuthenticationFailed(f'Invalid token: {str(e)}')
     
+    async def _aauthenticate(self, request):
+        token = self.get_bearer_token(request)
+        if token is None:
+            return None
+        
+        try:
+            decoded_token = await self.averify_clerk_token(token)
+            user = await self.aget_or_create_user(decoded_token)
+            return (user, token)
+        except Exception as e:
+            raise AuthenticationFailed(f'Invalid token: {str(e)}')
+    
+    @staticmethod
+    def get_bearer_token(request):
+        auth_header = request.META.get('HTTP_AUTHORIZATION')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return None
+        return auth_header.split(' ')[1]
+    
     def verify_clerk_token(self, token):
-        """Verify Clerk JWT token"""
+        """Verify Clerk JWT token against Clerk's JWKS"""
+        token_cache = get_verified_token_cache()
+        payload = token_cache.get(token)
+        if payload is not None:
+            return payload
+        
+        # jose loads its crypto backends on import; cache hits never need it
+        from jose import jwt
+        
         try:
-            # For development, we'll use a simpler approach
-            # In production, you should verify with Clerk's JWKS endpoint
-            
-            # Decode without verification to get token claims
-            # This is for development only - in production use proper JWT verification
-            from jose import jwt
-            
-            # Get the header to check if it's a valid JWT
-            try:
-                unverified_header = jwt.get_unverified_header(token)
-                payload = jwt.get_unverified_claims(token)
-                
-                # Basic validation - check if token has required fields
-                if not payload.get('sub'):
-                    raise JWTError('No subject in token')
-                
-                return payload
-                
-            except Exception as e:
-                raise JWTError(f'Invalid token format: {str(e)}')
-                
+            unverified_header = jwt.get_unverified_header(token)
+            key = get_jwks_cache().get_key(unverified_header.get('kid'))
+            payload = jwt.decode(
+                token,
+                key,
+                algorithms=settings.CLERK_JWT_ALGORITHMS,
+                options={'verify_aud': False, 'leeway': settings.CLERK_JWT_LEEWAY},
+            )
         except Exception as e:
             raise AuthenticationFailed(f'Token verification failed: {str(e)}')
+        
+        if not payload.get('sub'):
+            raise AuthenticationFailed('Token verification failed: No subject in token')
+        
+        authorized_parties = settings.CLERK_AUTHORIZED_PARTIES
+        if authorized_parties and payload.get('azp') not in authorized_parties:
+            raise AuthenticationFailed('Token verification failed: Unauthorized party')
+        
+        token_cache.set(token, payload)
+        return payload
+    
+    async def averify_clerk_token(self, token):
+        payload = get_verified_token_cache().get(token)
+        if payload is not None:
+            return payload
+        from jose import JWTError, jwt
+
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except JWTError:
+            # Malformed; rejected without a key lookup
+            return self.verify_clerk_token(token)
+        if get_jwks_cache().needs_fetch(kid):
+            # The first load and unknown-kid refetches block on the network for up to the JWKS timeout
+            return await sync_to_async(self.verify_clerk_token)(token)
+        return self.verify_clerk_token(token)
     
     def get_or_create_user(self, token_data):
         clerk_id = token_data.get('sub')
         if not clerk_id:
             raise AuthenticationFailed('No user ID in token')
         
-        # Get email from token (Clerk puts email in different places)
-        email = token_data.get('email')
-        if not email:
-            # Try email_addresses array
-            email_addresses = token_data.get('email_addresses', [])
-            if email_addresses and isinstance(email_addresses, list):
-                email = email_addresses[0].get('email_address') if isinstance(email_addresses[0], dict) else email_addresses[0]
+        profile = self.profile_from_claims(token_data)
+        
+        try:
+            user = identity_cache.get(clerk_id)
+            from_cache = user is not None
+            created = False
+            if not from_cache:
+                # Taken before the read: an invalidation after it keeps this row out of the cache
+                version = identity_cache.version(clerk_id)
+                user, created = User.objects.get_or_create(
+                    clerk_id=clerk_id,
+                    defaults=self.user_defaults(clerk_id, profile)
+                )
             
-            # Fallback to a default email
-            if not email:
-                email = f"{clerk_id}@clerk.local"
+            if not created:
+                update_fields = self.apply_profile(user, profile)
+                if update_fields:
+                    user.save(update_fields=update_fields)
+                    from_cache = False
+            
+            if not from_cache:
+                if created or update_fields:
+                    # Our own write invalidated the entry; version what was written
+                    version = identity_cache.version(clerk_id)
+                identity_cache.set(user, version)
+            
+        except Exception as e:
+            raise AuthenticationFailed(f'User creation failed: {str(e)}')
+        
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive or deleted')
+        
+        return user
+    
+    async def aget_or_create_user(self, token_data):
+        clerk_id = token_data.get('sub')
+        if not clerk_id:
+            raise AuthenticationFailed('No user ID in token')
+        
+        profile = self.profile_from_claims(token_data)
         
         try:
-            user, created = User.objects.get_or_create(
-                clerk_id=clerk_id,
-                defaults={
-                    'email': email,
-                    'first_name': token_data.get('given_name', token_data.get('first_name', '')),
-                    'last_name': token_data.get('family_name', token_data.get('last_name', '')),
-                    'profile_image_url': token_data.get('picture', token_data.get('image_url', '')),
-                    'phone_number': token_data.get('phone_number', ''),
-                }
-            )
+            user = await identity_cache.aget(clerk_id)
+            from_cache = user is not None
+            created = False
+            if not from_cache:
+                version = await identity_cache.aversion(clerk_id)
+                user, created = await User.objects.aget_or_create(
+                    clerk_id=clerk_id,
+                    defaults=self.user_defaults(clerk_id, profile)
+                )
             
             if not created:
-                # Update user data if needed
-                user.email = email
-                user.first_name = token_data.get('given_name', token_data.get('first_name', user.first_name))
-                user.last_name = token_data.get('family_name', token_data.get('last_name', user.last_name))
-                user.profile_image_url = token_data.get('picture', token_data.get('image_url', user.profile_image_url))
-                user.phone_number = token_data.get('phone_number', user.phone_number)
-                user.last_synced_at = timezone.now()
-                user.save()
+                update_fields = self.apply_profile(user, profile)
+                if update_fields:
+                    await user.asave(update_fields=update_fields)
+                    from_cache = False
             
-            return user
+            if not from_cache:
+                if created or update_fields:
+                    version = await identity_cache.aversion(clerk_id)
+                await identity_cache.aset(user, version)
             
         except Exception as e:
-            raise AuthenticationFailed(f'User creation failed: {str(e)}')
\ No newline at end of file
+            raise AuthenticationFailed(f'User creation failed: {str(e)}')
+        
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive or deleted')
+        
+        return user
+    
+    @staticmethod
+    def user_defaults(clerk_id, profile):
+        return {
+            'first_name': '',
+            'last_name': '',
+            'profile_image_url': '',
+            'phone_number': '',
+            **profile,
+            # Fallback to a default email
+            'email': profile.get('email') or f"{clerk_id}@clerk.local",
+        }
+    
+    @staticmethod
+    def apply_profile(user, profile):
+        """Copy changed profile claims onto ``user`` and return the fields to save.
+        
+        Only writes when a profile claim actually changed; otherwise just queues
+        a last_synced_at touch for the next batched flush and returns [].
+        """
+        changed_fields = [field for field, value in profile.items() if getattr(user, field) != value]
+        if not changed_fields:
+            last_synced_touches.touch(user)
+            return []
+        
+        for field in changed_fields:
+            setattr(user, field, profile[field])
+        user.last_synced_at = timezone.now()
+        return changed_fields + ['last_synced_at', 'updated_at']
+    
+    @staticmethod
+    def profile_from_claims(token_data):
+        """Map the profile claims present in the token to User fields"""
+        profile = {}
+        
+        # Get email from token (Clerk puts email in different places)
+        email = token_data.get('email')
+        if not email:
+            # Try email_addresses array
+            email_addresses = token_data.get('email_addresses', [])
+            if email_addresses and isinstance(email_addresses, list):
+                email = email_addresses[0].get('email_address') if isinstance(email_addresses[0], dict) else email_addresses[0]
+        if email:
+            profile['email'] = email
+        
+        for field, claims in PROFILE_CLAIMS.items():
+            for claim in claims:
+                if claim in token_data:
+                    profile[field] = token_data[claim] or ''
+                    break
+        
+        return profile
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Backends whose entries live in one process only
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def identity_cache_is_shared():
+    """Whether CLERK_IDENTITY_CACHE_ALIAS names a cache every process sees"""
+    alias = settings.CLERK_IDENTITY_CACHE_ALIAS
+    return bool(alias) and settings.CACHES.get(alias, {}).get('BACKEND') not in LOCAL_CACHE_BACKENDS
+
+
+@register()
+def check_identity_cache_is_shared(app_configs, **kwargs):
+    """Webhooks applied by a Celery worker must invalidate the identities web processes cache"""
+    if settings.CELERY_TASK_ALWAYS_EAGER or settings.CELERY_BROKER_URL == 'memory://' or identity_cache_is_shared():
+        return []
+    return [Error(
+        'Celery workers process Clerk webhooks, but CLERK_IDENTITY_CACHE_ALIAS does not name a cache shared '
+        'between processes.',
+        hint='Web processes would keep authenticating deactivated or deleted users for up to '
+             'CLERK_IDENTITY_CACHE_TTL seconds. Point it at a cache in CACHES that every process uses, e.g. Redis.',
+        id='authentication.E001',
+    )]
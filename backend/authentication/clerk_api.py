@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class ClerkUnavailable(Exception):
+    """Raised without calling Clerk while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Clerk API circuit open, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def is_transient(exc):
+    """Whether a failed Clerk call is worth retrying (network error, timeout, 429 or 5xx)"""
+    from clerk_backend_api.models import ClerkBaseError
+
+    if isinstance(exc, httpx.TransportError):
+        return True
+    return isinstance(exc, ClerkBaseError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+class CircuitBreaker:
+    """Fails calls fast after ``failure_threshold`` consecutive transient failures.
+
+    The circuit then stays open for ``reset_timeout`` seconds, after which a
+    single trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self):
+        """Raise ``ClerkUnavailable`` unless a call may go out now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_running:
+                raise ClerkUnavailable(max(remaining, 0))
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ClerkClient:
+    """Shared Clerk Backend API client.
+
+    All calls go through one ``httpx.Client``, so connections to Clerk are
+    kept alive and reused (at most ``pool_size``), and every request is bounded
+    by ``connect_timeout``/``read_timeout`` seconds. The SDK's own retries
+    (exponential backoff for up to an hour) are turned off; ``call()`` instead
+    retries transient failures at most ``max_retries`` times and feeds the
+    outcome to a ``CircuitBreaker``. Latency and error counts are kept per
+    operation, see ``stats()``.
+    """
+
+    def __init__(self, secret_key, server_url=None, connect_timeout=2, read_timeout=5, pool_size=10,
+                 keepalive_expiry=30, max_retries=2, retry_backoff=0.2, failure_threshold=5, reset_timeout=30):
+        from clerk_backend_api import Clerk
+
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.http = httpx.Client(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self.sdk = Clerk(bearer_auth=secret_key, server_url=server_url, client=self.http, retry_config=None)
+        self._stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'rejected': 0,
+                                           'latency_ms_total': 0.0, 'latency_ms_max': 0.0})
+        self._stats_lock = threading.Lock()
+
+    def call(self, operation, **kwargs):
+        """Call an SDK operation by dotted name, e.g. ``call('sessions.revoke', session_id=...)``.
+
+        Raises ``ClerkUnavailable`` while the circuit is open, otherwise the
+        SDK's exception once retries are used up or for a non-transient error.
+        """
+        group, _, method = operation.partition('.')
+        func = getattr(getattr(self.sdk, group), method)
+        try:
+            self.breaker.before_call()
+        except ClerkUnavailable:
+            self._count(operation, rejected=1)
+            raise
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                result = func(**kwargs)
+            except Exception as e:
+                self._count(operation, latency=time.perf_counter() - start, errors=1)
+                if not is_transient(e):
+                    # The request reached Clerk and was answered; not an outage
+                    self.breaker.record_success()
+                    raise
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                self._count(operation, retries=1)
+                time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+                continue
+            self._count(operation, latency=time.perf_counter() - start)
+            self.breaker.record_success()
+            return result
+
+    def _count(self, operation, latency=None, **counters):
+        with self._stats_lock:
+            stats = self._stats[operation]
+            for name, value in counters.items():
+                stats[name] += value
+            if latency is not None:
+                latency_ms = latency * 1000
+                stats['calls'] += 1
+                stats['latency_ms_total'] += latency_ms
+                stats['latency_ms_max'] = max(stats['latency_ms_max'], latency_ms)
+
+    def stats(self):
+        """Snapshot of the circuit state and per-operation counters.
+
+        ``calls`` counts HTTP attempts (retries included) and ``errors`` the
+        failed ones; ``rejected`` counts calls refused by the open circuit.
+        """
+        with self._stats_lock:
+            operations = {}
+            for operation, stats in self._stats.items():
+                operations[operation] = {
+                    **stats,
+                    'latency_ms_mean': stats['latency_ms_total'] / stats['calls'] if stats['calls'] else 0.0,
+                }
+        return {'circuit': self.breaker.state, 'operations': operations}
+
+    def close(self):
+        self.http.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_clerk_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ClerkClient(
+                settings.CLERK_SECRET_KEY,
+                server_url=settings.CLERK_API_URL,
+                connect_timeout=settings.CLERK_API_CONNECT_TIMEOUT,
+                read_timeout=settings.CLERK_API_READ_TIMEOUT,
+                pool_size=settings.CLERK_API_POOL_SIZE,
+                max_retries=settings.CLERK_API_MAX_RETRIES,
+                failure_threshold=settings.CLERK_API_BREAKER_THRESHOLD,
+                reset_timeout=settings.CLERK_API_BREAKER_RESET_TIMEOUT,
+            )
+        return _client
+
+
+@receiver(setting_changed)
+def reset_client(*, setting, **kwargs):
+    global _client
+    if setting.startswith('CLERK_'):
+        with _client_lock:
+            if _client is not None:
+                _client.close()
+            _client = None
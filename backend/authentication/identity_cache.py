@@ -0,0 +1,173 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+User = get_user_model()
+
+
+class IdentityCache:
+    """Caches the ``clerk_id -> User`` rows ClerkAuthentication resolves.
+
+    Rows are stored as plain field values and rebuilt with ``Model.from_db``,
+    so every hit returns a fresh instance that callers may mutate. By default
+    entries live in a per-process LRU bounded by ``max_size``; set
+    ``cache_alias`` to a Django cache to share entries (and invalidations)
+    between processes. In local mode another process may serve a row for up to
+    ``ttl`` seconds after it changed, so keep the TTL short there.
+
+    Shared entries are stamped with the cache's generation, which ``clear()``
+    replaces; entries from an older generation read as misses, so clearing
+    never touches the other keys of the shared cache.
+
+    ``delete()`` also replaces the user's version. A miss takes ``version()``
+    before it reads the row and hands it to ``set()``, so a row read before an
+    invalidation is never served after it: shared entries stamped with an old
+    version read as misses, and local writes with one are dropped.
+    """
+
+    key_prefix = 'clerk:identity:'
+    version_prefix = 'clerk:identity-version:'
+    generation_key = 'clerk:identity-generation'
+    # Shared versions outlive the entries by the longest a miss may spend
+    # between version() and set()
+    version_grace = 300
+
+    def __init__(self, ttl=60, max_size=10000, cache_alias=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self.field_names = [field.attname for field in User._meta.concrete_fields]
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._counter = itertools.count(1)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, clerk_id):
+        if self.cache_alias:
+            found = caches[self.cache_alias].get_many(self._keys(clerk_id))
+            values = self._current(found, clerk_id)
+        else:
+            values = self._local_get(clerk_id)
+        if values is None:
+            return None
+        return User.from_db(None, self.field_names, values)
+
+    async def aget(self, clerk_id):
+        if not self.cache_alias:
+            return self.get(clerk_id)
+        found = await caches[self.cache_alias].aget_many(self._keys(clerk_id))
+        values = self._current(found, clerk_id)
+        if values is None:
+            return None
+        return User.from_db(None, self.field_names, values)
+
+    def version(self, clerk_id):
+        """Token to pass to ``set()`` for a row read after this call"""
+        if self.cache_alias:
+            found = caches[self.cache_alias].get_many(self._keys(clerk_id)[:2])
+            return self._stamp(found, clerk_id)
+        with self._lock:
+            return self._local_version(clerk_id)
+
+    async def aversion(self, clerk_id):
+        if not self.cache_alias:
+            return self.version(clerk_id)
+        found = await caches[self.cache_alias].aget_many(self._keys(clerk_id)[:2])
+        return self._stamp(found, clerk_id)
+
+    def set(self, user, version=None):
+        if version is None:
+            version = self.version(user.clerk_id)
+        values = tuple(getattr(user, name) for name in self.field_names)
+        if self.cache_alias:
+            caches[self.cache_alias].set(self.key_prefix + user.clerk_id, (version, values), self.ttl)
+            return
+        with self._lock:
+            if self._local_version(user.clerk_id) != version:
+                return
+            self._entries[user.clerk_id] = (values, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.clerk_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def aset(self, user, version=None):
+        if not self.cache_alias:
+            return self.set(user, version)
+        if version is None:
+            version = await self.aversion(user.clerk_id)
+        values = tuple(getattr(user, name) for name in self.field_names)
+        await caches[self.cache_alias].aset(self.key_prefix + user.clerk_id, (version, values), self.ttl)
+
+    def delete(self, clerk_id):
+        if self.cache_alias:
+            caches[self.cache_alias].set(
+                self.version_prefix + clerk_id, uuid.uuid4().hex, self.ttl + self.version_grace
+            )
+            return
+        with self._lock:
+            self._entries.pop(clerk_id, None)
+            # Versions come from one counter, so an evicted one is never handed out again
+            self._versions[clerk_id] = next(self._counter)
+            self._versions.move_to_end(clerk_id)
+            while len(self._versions) > self.max_size:
+                self._versions.popitem(last=False)
+
+    def clear(self):
+        if self.cache_alias:
+            caches[self.cache_alias].set(self.generation_key, uuid.uuid4().hex, None)
+            return
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._generation += 1
+
+    def _keys(self, clerk_id):
+        return [self.generation_key, self.version_prefix + clerk_id, self.key_prefix + clerk_id]
+
+    def _stamp(self, found, clerk_id):
+        return found.get(self.generation_key), found.get(self.version_prefix + clerk_id)
+
+    def _current(self, found, clerk_id):
+        """The shared entry's values, unless it was stored before the last ``clear()`` or ``delete()``"""
+        entry = found.get(self.key_prefix + clerk_id)
+        if entry is None or entry[0] != self._stamp(found, clerk_id):
+            return None
+        return entry[1]
+
+    def _local_version(self, clerk_id):
+        return self._generation, self._versions.get(clerk_id, 0)
+
+    def _local_get(self, clerk_id):
+        with self._lock:
+            entry = self._entries.get(clerk_id)
+            if entry is None:
+                return None
+            values, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[clerk_id]
+                return None
+            self._entries.move_to_end(clerk_id)
+            return values
+
+
+identity_cache = IdentityCache(
+    ttl=settings.CLERK_IDENTITY_CACHE_TTL,
+    max_size=settings.CLERK_IDENTITY_CACHE_SIZE,
+    cache_alias=settings.CLERK_IDENTITY_CACHE_ALIAS,
+)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_identity(sender, instance, **kwargs):
+    """Drop cached rows whenever a user is saved elsewhere (admin, webhooks)"""
+    identity_cache.delete(instance.clerk_id)
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from jose import JWTError
+
+
+class JWKSCache:
+    """In-process cache of Clerk's JSON Web Key Set, indexed by ``kid``.
+
+    Keys are fetched once and then refreshed in a background thread when they
+    get older than ``refresh_interval``, so the request path never waits on the
+    network after the first load. A token signed with an unknown ``kid`` (key
+    rotation) triggers a synchronous refetch, rate limited by
+    ``min_refetch_interval``.
+    """
+
+    def __init__(self, url, refresh_interval=3600, min_refetch_interval=30, timeout=5):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get_key(self, kid):
+        """Return the constructed public key for ``kid``, fetching if needed"""
+        if self._fetched_at is None:
+            self.refresh()
+        elif time.monotonic() - self._fetched_at > self.refresh_interval:
+            self._refresh_in_background()
+
+        key = self._lookup(kid)
+        if key is None and self._can_refetch():
+            # Unknown kid usually means Clerk rotated its signing keys
+            self.refresh()
+            key = self._lookup(kid)
+
+        if key is None:
+            raise JWTError(f'Unknown signing key: {kid}')
+        return key
+
+    def needs_fetch(self, kid):
+        """Whether ``get_key(kid)`` would wait on the network: first load or an unknown, refetchable kid"""
+        if self._fetched_at is None:
+            return True
+        return self._lookup(kid) is None and self._can_refetch()
+
+    def refresh(self):
+        from jose import jwk
+
+        with self._lock:
+            keys = {}
+            for key_data in self._fetch().get('keys', []):
+                if key_data.get('use', 'sig') != 'sig':
+                    continue
+                try:
+                    keys[key_data.get('kid')] = jwk.construct(key_data, key_data.get('alg', 'RS256'))
+                except Exception:
+                    continue
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _lookup(self, kid):
+        keys = self._keys
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        return keys.get(kid)
+
+    def _can_refetch(self):
+        return time.monotonic() - self._fetched_at >= self.min_refetch_interval
+
+    def _refresh_in_background(self):
+        if self._refreshing:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the current keys; the next request retries
+                pass
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='clerk-jwks-refresh', daemon=True).start()
+
+    def _fetch(self):
+        """Load the key set from an http(s) URL, a ``file://`` URL or a local path"""
+        parsed = urlparse(self.url)
+        if parsed.scheme in ('http', 'https'):
+            import requests
+
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+        path = parsed.path if parsed.scheme == 'file' else self.url
+        return json.loads(Path(path).read_text())
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of already-verified token claims, keyed by token hash.
+
+    Entries are dropped once the token's ``exp`` has passed, so a cache hit is
+    always a token that would still pass signature and expiry checks.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def set(self, token, claims):
+        exp = claims.get('exp')
+        if not exp or self.max_size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (claims, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_jwks_cache = None
+_token_cache = None
+
+
+def get_jwks_cache():
+    global _jwks_cache
+    if _jwks_cache is None:
+        _jwks_cache = JWKSCache(
+            settings.CLERK_JWKS_URL,
+            refresh_interval=settings.CLERK_JWKS_REFRESH_INTERVAL,
+            min_refetch_interval=settings.CLERK_JWKS_MIN_REFETCH_INTERVAL,
+        )
+    return _jwks_cache
+
+
+def get_verified_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = VerifiedTokenCache(settings.CLERK_VERIFIED_TOKEN_CACHE_SIZE)
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reset_caches(*, setting, **kwargs):
+    global _jwks_cache, _token_cache
+    if setting.startswith('CLERK_'):
+        _jwks_cache = None
+        _token_cache = None
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+
+from backend.benchmarking import benchmark_database, clerk_signing_key, summarize, write_report
+
+User = get_user_model()
+
+ENDPOINTS = {
+    'me': ('get', '/api/v1/auth/me/'),
+    'authenticate-begin': ('post', '/api/v1/webauthn/authenticate/begin'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare WSGI (sync views, thread pool) and ASGI (async views, one event loop) request throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), action='append',
+                            help='Endpoint to load (repeatable; default: all)')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='WSGI worker threads / concurrent ASGI requests')
+        parser.add_argument('--users', type=int, default=100, help='Distinct users (and tokens) to spread load over')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        # Each mode runs in its own process so ASYNC_VIEWS is read at import time
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], help='Run a single mode in this process')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoint'] or sorted(ENDPOINTS)
+        if options['mode']:
+            results = self.run_mode(options['mode'], endpoints, options)
+            self.stdout.write(json.dumps(results))
+            return
+
+        results = []
+        for mode in ('wsgi', 'asgi'):
+            results += self.spawn(mode, endpoints, options)
+        write_report(self, results, options['json'])
+
+    def spawn(self, mode, endpoints, options):
+        command = [
+            sys.executable, sys.argv[0], 'bench_asgi', '--mode', mode,
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+            '--users', str(options['users']),
+        ]
+        for endpoint in endpoints:
+            command += ['--endpoint', endpoint]
+        env = {**os.environ, 'ASYNC_VIEWS': 'True' if mode == 'asgi' else 'False'}
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{mode} benchmark failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_mode(self, mode, endpoints, options):
+        with benchmark_database(), clerk_signing_key() as mint:
+            headers = self.prepare(mint, options['users'])
+            results = []
+            for endpoint in endpoints:
+                method, path = ENDPOINTS[endpoint]
+                requests = [(method, path, headers[i % len(headers)]) for i in range(options['requests'])]
+                if mode == 'wsgi':
+                    latencies, elapsed = self.run_wsgi(requests, options['concurrency'])
+                else:
+                    latencies, elapsed = asyncio.run(self.run_asgi(requests, options['concurrency']))
+                results.append(summarize(latencies, elapsed, name=f'{mode} {endpoint}', mode=mode, endpoint=endpoint))
+            return results
+
+    def prepare(self, mint, count):
+        """Create users with one credential each and return their auth headers, warmed once"""
+        from webauthn_mfa.models import WebAuthnCredential
+
+        users = User.objects.bulk_create([
+            User(clerk_id=f'bench_{i}', email=f'bench_{i}@example.com')
+            for i in range(count)
+        ])
+        WebAuthnCredential.objects.bulk_create([
+            WebAuthnCredential(user=user, credential_id=f'cred_{user.pk}', raw_id=os.urandom(32), public_key='', name='Bench')
+            for user in users
+        ])
+        headers = [{'Authorization': f'Bearer {mint(user.clerk_id)}'} for user in users]
+        # Load the JWKS and per-process caches outside the measured window
+        client = Client()
+        for header in headers:
+            client.get('/api/v1/auth/me/', headers=header)
+        return headers
+
+    def run_wsgi(self, requests, concurrency):
+        def call(request):
+            method, path, header = request
+            start = time.perf_counter()
+            response = getattr(Client(), method)(path, content_type='application/json', headers=header)
+            if response.status_code != 200:
+                raise CommandError(f'{path} returned {response.status_code}: {response.content[:200]}')
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(call, requests))
+        return latencies, time.perf_counter() - start
+
+    async def run_asgi(self, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def call(request):
+            method, path, header = request
+            async with semaphore:
+                start = time.perf_counter()
+                response = await getattr(client, method)(path, content_type='application/json', headers=header)
+                if response.status_code != 200:
+                    raise CommandError(f'{path} returned {response.status_code}: {response.content[:200]}')
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(call(request) for request in requests))
+        return latencies, time.perf_counter() - start
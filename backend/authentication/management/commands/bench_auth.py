@@ -0,0 +1,177 @@
+import contextlib
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import HttpResponse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from authentication import mfa
+from authentication.identity_cache import identity_cache
+from authentication.jwks import get_verified_token_cache
+from backend.benchmarking import benchmark_database, clerk_signing_key, summarize, write_report
+
+User = get_user_model()
+
+API_PATH = '/api/v1/auth/me/'
+# Cheap admin view, so the admin rows measure the middleware rather than page rendering
+ADMIN_PATH = '/admin/jsi18n/'
+
+# name -> what the scenario measures; see Command.scenarios()
+SCENARIOS = {
+    'api-cached': 'Bearer token and identity already cached (steady state)',
+    'api-new-token': 'A token not seen before: JWT signature check, identity cached',
+    'api-cold': 'Token and identity caches empty: signature check and user lookup',
+    'api-anonymous': 'No Authorization header',
+    'api-bad-signature': 'Token with the right kid signed by the wrong key',
+    'admin-mfa-required': 'Staff user without WebAuthn verification, redirected',
+    'admin-session': 'Staff user verified through session flags',
+    'admin-cookie': 'Staff user verified through the signed MFA cookie',
+}
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the authentication hot path (ClerkAuthentication, ClerkAuthenticationMiddleware and '
+            'AdminWebAuthnMiddleware) through the test client with locally signed JWTs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                            help='Scenario to run (repeatable; default: all)')
+        parser.add_argument('--requests', type=int, default=1000, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests before each scenario')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        parser.add_argument('--output', help='Also save the results as JSON to this file')
+        parser.add_argument('--compare', help='Show the change against results saved earlier with --output')
+
+    def handle(self, *args, **options):
+        baseline = self.load_baseline(options['compare']) if options['compare'] else None
+        names = options['scenario'] or list(SCENARIOS)
+
+        with benchmark_database(), clerk_signing_key() as mint:
+            scenarios = self.scenarios(mint, options['requests'] + options['warmup'])
+            results = [self.run_scenario(name, *scenarios[name], options) for name in names]
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(self.report(results), f, indent=2)
+        columns = ['rps', 'p50_ms', 'p99_ms', 'queries', 'status']
+        if baseline is not None:
+            self.add_changes(results, baseline)
+            columns += ['p50_change', 'p99_change', 'rps_change']
+        write_report(self, results, options['json'], columns=columns)
+
+    def scenarios(self, mint, count):
+        """name -> (make_client, per-request setup, path) for each scenario"""
+        user = User.objects.create_user(clerk_id='bench_user', email='bench_user@example.com')
+        staff = User.objects.create_user(clerk_id='bench_staff', email='bench_staff@example.com', is_staff=True)
+        token = mint(user.clerk_id)
+        staff_token = mint(staff.clerk_id)
+        # Tokens minted in the same second differ only by jti
+        fresh_tokens = iter([mint(user.clerk_id, jti=str(i)) for i in range(count)])
+        with clerk_signing_key() as other_key:
+            bad_token = other_key(user.clerk_id)
+
+        def client(token=None):
+            return lambda: Client(headers={'Authorization': f'Bearer {token}'} if token else {})
+
+        def new_token(client):
+            client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {next(fresh_tokens)}'
+
+        def cold(client):
+            get_verified_token_cache().clear()
+            identity_cache.clear()
+
+        def session_verified():
+            verified = Client(headers={'Authorization': f'Bearer {staff_token}'})
+            session = verified.session
+            session.update({'webauthn_verified': True, 'webauthn_verified_at': timezone.now().isoformat()})
+            session.save()
+            return verified
+
+        def cookie_verified():
+            verified = Client(headers={'Authorization': f'Bearer {staff_token}'})
+            response = HttpResponse()
+            with override_settings(ADMIN_MFA_STORAGE='cookie'):
+                mfa.mark_verified(None, response, staff)
+            verified.cookies[settings.ADMIN_MFA_COOKIE_NAME] = response.cookies[settings.ADMIN_MFA_COOKIE_NAME].value
+            return verified
+
+        return {
+            'api-cached': (client(token), None, API_PATH),
+            'api-new-token': (client(), new_token, API_PATH),
+            'api-cold': (client(token), cold, API_PATH),
+            'api-anonymous': (client(), None, API_PATH),
+            'api-bad-signature': (client(bad_token), None, API_PATH),
+            'admin-mfa-required': (client(staff_token), None, ADMIN_PATH),
+            'admin-session': (session_verified, None, ADMIN_PATH),
+            'admin-cookie': (cookie_verified, None, ADMIN_PATH),
+        }
+
+    def run_scenario(self, name, make_client, before_request, path, options):
+        """Run the scenario's requests one after another and summarize the measured ones.
+
+        ``before_request`` runs outside the timed window. Queries are counted
+        on every database alias over the measured requests.
+        """
+        storage = 'cookie' if name == 'admin-cookie' else 'session'
+        with override_settings(ADMIN_MFA_STORAGE=storage):
+            client = make_client()
+            latencies = []
+            statuses = set()
+            with contextlib.ExitStack() as stack:
+                captures = None
+                for n in range(options['warmup'] + options['requests']):
+                    if n == options['warmup']:
+                        captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                    if before_request:
+                        before_request(client)
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    elapsed = time.perf_counter() - start
+                    if response.status_code >= 500:
+                        raise CommandError(f'{name}: {path} returned {response.status_code}: {response.content[:200]}')
+                    statuses.add(response.status_code)
+                    if captures is not None:
+                        latencies.append(elapsed)
+            queries = sum(len(capture.captured_queries) for capture in captures)
+
+        return summarize(
+            latencies, sum(latencies),
+            name=name,
+            queries=round(queries / len(latencies), 2),
+            status='/'.join(map(str, sorted(statuses))),
+        )
+
+    def report(self, results):
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connections['default'].vendor,
+            'results': results,
+        }
+
+    def load_baseline(self, path):
+        try:
+            with open(path) as f:
+                return {result['name']: result for result in json.load(f)['results']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Cannot read baseline {path}: {e}')
+
+    def add_changes(self, results, baseline):
+        """Add the relative change of p50, p99 and rps against ``baseline`` to each result"""
+        for result in results:
+            before = baseline.get(result['name'])
+            for metric in ('p50_ms', 'p99_ms', 'rps'):
+                column = f'{metric.split("_")[0]}_change'
+                if before is None or not before[metric]:
+                    result[column] = '-'
+                else:
+                    result[column] = f'{(result[metric] - before[metric]) / before[metric]:+.1%}'
@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from authentication.checks import identity_cache_is_shared
+from authentication.models import ClerkWebhookEvent
+from authentication.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Drain the Clerk webhook inbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Events applied per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the inbox instead of exiting when empty')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait between polls in --loop mode')
+        parser.add_argument('--purge-after-days', type=int, default=7, help='Delete processed events older than this')
+
+    def handle(self, *args, **options):
+        if not identity_cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                'CLERK_IDENTITY_CACHE_ALIAS does not name a cache shared between processes, so web processes '
+                'keep serving the identities of users changed by these events until CLERK_IDENTITY_CACHE_TTL expires'
+            ))
+        cutoff = timezone.now() - timedelta(days=options['purge_after_days'])
+        purged, _ = ClerkWebhookEvent.objects.filter(processed_at__lt=cutoff).delete()
+
+        batch_size = options['batch_size']
+        total = 0
+
+        while True:
+            processed = process_pending_events(batch_size)
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {total} webhook events, purged {purged} old events')
+        )
@@ -0,0 +1,186 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from authentication.clerk_api import ClerkClient, get_clerk_client
+from authentication.identity_cache import identity_cache
+from authentication.models import ClerkSyncRun
+from authentication.webhooks import user_fields_from_data
+
+User = get_user_model()
+
+UPSERT_FIELDS = ['email', 'first_name', 'last_name', 'profile_image_url', 'clerk_updated_at', 'last_synced_at', 'updated_at']
+# Users deactivated per UPDATE, well under SQLite's bound-parameter limit
+DEACTIVATE_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Backfill or reconcile users from the Clerk user directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=500, help='Users fetched and upserted per page (Clerk max 500)')
+        parser.add_argument('--delta', action='store_true',
+                            help='Only sync users updated in Clerk since the last run that synced every user')
+        parser.add_argument('--since', type=str, help='ISO timestamp to use as the --delta cutoff')
+        parser.add_argument('--overlap', type=int, default=300,
+                            help='Seconds the --delta cutoff reaches back before the last run started')
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help='After a full run, deactivate local users that were not seen in Clerk')
+        parser.add_argument('--server-url', type=str, help='Override the Clerk Backend API URL (e.g. a local fake)')
+
+    def handle(self, *args, **options):
+        if options['server_url']:
+            clerk = ClerkClient(settings.CLERK_SECRET_KEY, server_url=options['server_url'])
+        else:
+            clerk = get_clerk_client()
+        page_size = min(options['page_size'], 500)
+        since = self.get_delta_cutoff(options) if options['delta'] else None
+        # Delta runs walk newest updates first and stop at the first stale user;
+        # full runs page by creation date, which is stable while users change
+        order_by = '-updated_at' if since is not None else '+created_at'
+
+        started_at = timezone.now()
+        start = time.perf_counter()
+        synced = failed = offset = 0
+
+        while True:
+            page = clerk.call('users.list', request={'limit': page_size, 'offset': offset, 'order_by': order_by})
+            if not page:
+                break
+            offset += len(page)
+
+            users = [self.build_user(clerk_user, started_at) for clerk_user in page]
+            if since is not None:
+                users = [user for user in users if user.clerk_updated_at >= since]
+            ok, errors = self.upsert(users)
+            synced += ok
+            failed += errors
+
+            if options['verbosity'] > 1:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'{offset} fetched, {synced} synced ({synced / elapsed:.0f} users/s)')
+
+            if len(page) < page_size or len(users) < len(page):
+                break
+
+        deactivated = 0
+        if options['deactivate_missing'] and since is None:
+            deactivated = self.deactivate_missing(started_at)
+        # A --since run covers only the range it was given, so it is no watermark
+        if not options['since']:
+            ClerkSyncRun.objects.create(started_at=started_at, delta=since is not None, synced=synced, failed=failed)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {synced} users in {elapsed:.1f}s ({synced / elapsed if elapsed else 0:.0f} users/s), '
+            f'{failed} failed, {deactivated} deactivated'
+        ))
+        if options['verbosity'] > 1:
+            for operation, stats in clerk.stats()['operations'].items():
+                self.stdout.write(
+                    f"{operation}: {stats['calls']} requests, {stats['errors']} errors, {stats['retries']} retries, "
+                    f"{stats['latency_ms_mean']:.0f} ms mean, {stats['latency_ms_max']:.0f} ms max"
+                )
+
+    def get_delta_cutoff(self, options):
+        if options['since']:
+            return datetime.fromisoformat(options['since'])
+        # Not the newest clerk_updated_at: webhooks advance it too, so changes
+        # whose webhook was lost would never be picked up. A run with failed
+        # upserts does not count, so the next delta retries those users. The
+        # overlap covers clock skew with Clerk and users changed mid-run.
+        last_run = ClerkSyncRun.objects.filter(failed=0).order_by('-started_at').first()
+        if last_run is None:
+            return datetime.min.replace(tzinfo=dt_timezone.utc)
+        return last_run.started_at - timedelta(seconds=options['overlap'])
+
+    def deactivate_missing(self, started_at):
+        """Deactivate active users Clerk did not list in this run; returns the count.
+
+        Every listed user, failed upserts included, has ``last_synced_at`` of at
+        least ``started_at``, so the rest are found in SQL and memory stays flat.
+        """
+        missing = User.objects.filter(Q(last_synced_at__lt=started_at) | Q(last_synced_at__isnull=True), is_active=True)
+        deactivated = 0
+        while batch := list(missing.values_list('clerk_id', flat=True)[:DEACTIVATE_BATCH_SIZE]):
+            deactivated += User.objects.filter(clerk_id__in=batch, is_active=True).update(
+                is_active=False, updated_at=timezone.now(),
+            )
+            # update() sends no post_save either
+            for clerk_id in batch:
+                identity_cache.delete(clerk_id)
+        return deactivated
+
+    def build_user(self, clerk_user, synced_at):
+        data = {
+            'id': clerk_user.id,
+            'email_addresses': [{'id': e.id, 'email_address': e.email_address} for e in clerk_user.email_addresses],
+            'primary_email_address_id': clerk_user.primary_email_address_id,
+            'first_name': clerk_user.first_name,
+            'last_name': clerk_user.last_name,
+            'image_url': clerk_user.image_url,
+        }
+        return User(
+            clerk_id=clerk_user.id,
+            clerk_updated_at=datetime.fromtimestamp(clerk_user.updated_at / 1000, tz=dt_timezone.utc),
+            last_synced_at=synced_at,
+            **user_fields_from_data(data),
+        )
+
+    def upsert(self, users):
+        """Upsert one page; returns (synced, failed) counts"""
+        if not users:
+            return 0, 0
+        failed = 0
+        try:
+            with transaction.atomic():
+                self.bulk_upsert(users)
+        except IntegrityError:
+            # A conflicting email elsewhere in the page; retry row by row
+            for user in users:
+                try:
+                    with transaction.atomic():
+                        self.bulk_upsert([user])
+                except IntegrityError as e:
+                    failed += 1
+                    self.stderr.write(f'Failed to sync {user.clerk_id}: {e}')
+                    # Still listed by Clerk, so --deactivate-missing must spare it
+                    User.objects.filter(clerk_id=user.clerk_id).update(last_synced_at=user.last_synced_at)
+
+        # bulk_create sends no post_save, so invalidate cached identities here
+        for user in users:
+            identity_cache.delete(user.clerk_id)
+        return len(users) - failed, failed
+
+    def bulk_upsert(self, users):
+        """Upsert ``users``, skipping rows that already hold a newer Clerk change.
+
+        A webhook may have applied a newer change since the page was fetched.
+        The stored rows are locked first, as the webhook drain does.
+        """
+        stored = (
+            User.objects.select_for_update()
+            .order_by('clerk_id')
+            .only('clerk_id', 'clerk_updated_at')
+            .in_bulk([user.clerk_id for user in users], field_name='clerk_id')
+        )
+        newer = set()
+        for user in users:
+            current = stored.get(user.clerk_id)
+            if current is not None and current.clerk_updated_at and current.clerk_updated_at > user.clerk_updated_at:
+                newer.add(user.clerk_id)
+        if newer:
+            # Listed all the same, so --deactivate-missing must spare them
+            User.objects.filter(clerk_id__in=newer).update(last_synced_at=users[0].last_synced_at)
+        User.objects.bulk_create(
+            [user for user in users if user.clerk_id not in newer],
+            update_conflicts=True,
+            unique_fields=['clerk_id'],
+            update_fields=UPSERT_FIELDS,
+        )
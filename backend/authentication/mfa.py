@@ -0,0 +1,126 @@
+"""Remembers that a staff user passed WebAuthn verification for the admin.
+
+With ``ADMIN_MFA_STORAGE = 'session'`` the flags live in the session as
+before. With ``'cookie'`` they live in a signed cookie (HMAC with
+SECRET_KEY via ``django.core.signing``) that carries the user's pk, a random
+nonce and its issue time, so the admin middleware can check it without
+loading the session. Logging out puts the nonce on a denylist in the
+``ADMIN_MFA_REVOCATION_CACHE_ALIAS`` cache until the cookie would have
+expired anyway; use a shared cache when running several processes.
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils import timezone
+
+SALT = 'authentication.mfa'
+REVOKED_KEY_PREFIX = 'admin-mfa:revoked:'
+SESSION_KEYS = ['webauthn_verified', 'webauthn_verified_at']
+
+
+def uses_cookie():
+    return settings.ADMIN_MFA_STORAGE == 'cookie'
+
+
+def mark_verified(request, response, user):
+    if uses_cookie():
+        _set_cookie(response, user)
+        return
+    request.session['webauthn_verified'] = True
+    request.session['webauthn_verified_at'] = timezone.now().isoformat()
+
+
+async def amark_verified(request, response, user):
+    if uses_cookie():
+        _set_cookie(response, user)
+        return
+    await request.session.aset('webauthn_verified', True)
+    await request.session.aset('webauthn_verified_at', timezone.now().isoformat())
+
+
+def is_verified(request, user):
+    if uses_cookie():
+        nonce = _cookie_nonce(request, user)
+        return nonce is not None and not _revocations().get(REVOKED_KEY_PREFIX + nonce)
+    return _session_flags_valid(request.session.get('webauthn_verified', False), request.session.get('webauthn_verified_at'))
+
+
+async def ais_verified(request, user):
+    if uses_cookie():
+        nonce = _cookie_nonce(request, user)
+        return nonce is not None and not await _revocations().aget(REVOKED_KEY_PREFIX + nonce)
+    return _session_flags_valid(
+        await request.session.aget('webauthn_verified', False),
+        await request.session.aget('webauthn_verified_at'),
+    )
+
+
+def clear(request):
+    """Forget an expired or invalid verification before asking for a new one"""
+    if not uses_cookie():
+        for key in SESSION_KEYS:
+            request.session.pop(key, None)
+
+
+async def aclear(request):
+    if not uses_cookie():
+        for key in SESSION_KEYS:
+            await request.session.apop(key, None)
+
+
+def revoke(request, response):
+    """Invalidate the current verification on logout, whichever storage issued it"""
+    if settings.ADMIN_MFA_COOKIE_NAME in request.COOKIES:
+        payload = _cookie_payload(request)
+        if payload:
+            _revocations().set(REVOKED_KEY_PREFIX + payload['n'], 1, settings.ADMIN_MFA_MAX_AGE)
+        response.delete_cookie(settings.ADMIN_MFA_COOKIE_NAME, samesite='Lax')
+    for key in SESSION_KEYS:
+        request.session.pop(key, None)
+
+
+def _set_cookie(response, user):
+    value = signing.dumps({'u': user.pk, 'n': secrets.token_urlsafe(16)}, salt=SALT)
+    response.set_cookie(
+        settings.ADMIN_MFA_COOKIE_NAME,
+        value,
+        max_age=settings.ADMIN_MFA_MAX_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite='Lax',
+    )
+
+
+def _cookie_payload(request):
+    """The payload of an authentic, unexpired cookie, else None"""
+    value = request.COOKIES.get(settings.ADMIN_MFA_COOKIE_NAME)
+    if not value:
+        return None
+    try:
+        return signing.loads(value, salt=SALT, max_age=settings.ADMIN_MFA_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def _cookie_nonce(request, user):
+    payload = _cookie_payload(request)
+    if payload is None or payload.get('u') != user.pk:
+        return None
+    return payload.get('n')
+
+
+def _session_flags_valid(webauthn_verified, webauthn_verified_at):
+    if webauthn_verified and webauthn_verified_at:
+        try:
+            verified_time = timezone.datetime.fromisoformat(webauthn_verified_at)
+        except (ValueError, TypeError):
+            return False
+        return timezone.now() - verified_time < timedelta(seconds=settings.ADMIN_MFA_MAX_AGE)
+    return False
+
+
+def _revocations():
+    return caches[settings.ADMIN_MFA_REVOCATION_CACHE_ALIAS]
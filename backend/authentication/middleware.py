@@ -1,25 +1,39 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.utils.functional import SimpleLazyObject
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
 from django.shortcuts import redirect
 from django.urls import reverse
-from django.utils import timezone
 from django.contrib import messages
-from datetime import timedelta
-import re
+from functools import partial
+from . import mfa
 from .backends import ClerkAuthentication
 
 User = get_user_model()
 
 class ClerkAuthenticationMiddleware:
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
         self.auth_backend = ClerkAuthentication()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         request.user = SimpleLazyObject(lambda: self.get_user(request))
         response = self.get_response(request)
         return response
     
+    async def __acall__(self, request):
+        # Sync views still get the lazy user; async code awaits request.auser()
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+        request.auser = partial(self.aget_user, request)
+        return await self.get_response(request)
+    
     def get_user(self, request):
         try:
             user_auth_tuple = self.auth_backend.authenticate(request)
@@ -28,22 +42,37 @@ class ClerkAuthenticationMiddleware:
         except:
             pass
         
-        from django.contrib.auth.models import AnonymousUser
+        return AnonymousUser()
+    
+    async def aget_user(self, request):
+        try:
+            user_auth_tuple = await self.auth_backend.aauthenticate(request)
+            if user_auth_tuple:
+                return user_auth_tuple[0]
+        except:
+            pass
+        
         return AnonymousUser()
 
 
 class AdminWebAuthnMiddleware:
     """Middleware to handle admin authentication with Clerk + WebAuthn"""
+    sync_capable = True
+    async_capable = True
+    
+    # Admin URLs require authentication, except the auth endpoints themselves
+    admin_prefix = '/admin/'
+    exempt_prefixes = ('/admin/login', '/admin/clerk-auth-complete', '/admin/webauthn-verify')
     
     def __init__(self, get_response):
         self.get_response = get_response
-        # Define admin URL patterns that require authentication
-        self.admin_patterns = [
-            r'^/admin/$',  # Admin index
-            r'^/admin/(?!login|clerk-auth-complete|webauthn-verify).*',  # All admin URLs except auth endpoints
-        ]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
         
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
         # Check if this is an admin request that needs authentication
         if self._is_admin_request(request):
             auth_response = self._check_admin_authentication(request)
@@ -53,49 +82,66 @@ class AdminWebAuthnMiddleware:
         response = self.get_response(request)
         return response
     
+    async def __acall__(self, request):
+        if self._is_admin_request(request):
+            auth_response = await self._acheck_admin_authentication(request)
+            if auth_response:
+                return auth_response
+        
+        return await self.get_response(request)
+    
     def _is_admin_request(self, request):
         """Check if this request is for an admin page that requires auth"""
-        for pattern in self.admin_patterns:
-            if re.match(pattern, request.path):
-                return True
-        return False
+        path = request.path
+        # Plain prefix checks so non-admin traffic exits after one comparison
+        return path.startswith(self.admin_prefix) and not path.startswith(self.exempt_prefixes)
     
     def _check_admin_authentication(self, request):
         """Check authentication and return redirect response if needed"""
         
-        # Step 1: Check if user is authenticated via Clerk
-        if not request.user.is_authenticated:
-            return redirect('admin:login')
+        # Step 1 and 2: Check if user is authenticated via Clerk and is staff
+        denied = self._check_staff(request, request.user)
+        if denied:
+            return denied
         
-        # Step 2: Check if user is staff
-        if not request.user.is_staff:
-            messages.error(request, "You do not have permission to access the admin panel.")
-            return redirect('admin:login')
-        
-        # Step 3: Check WebAuthn verification
-        webauthn_verified = request.session.get('webauthn_verified', False)
-        webauthn_verified_at = request.session.get('webauthn_verified_at')
-        
-        # Check if WebAuthn verification is valid and not expired (30 minutes)
-        if webauthn_verified and webauthn_verified_at:
-            try:
-                verified_time = timezone.datetime.fromisoformat(webauthn_verified_at)
-                if timezone.now() - verified_time < timedelta(minutes=30):
-                    # Valid verification, allow access
-                    return None
-            except (ValueError, TypeError):
-                # Invalid timestamp, clear session
-                pass
+        # Step 3: Check WebAuthn verification (session flags or signed cookie)
+        if mfa.is_verified(request, request.user):
+            # Valid verification, allow access
+            return None
         
         # WebAuthn verification needed or expired
-        # Clear expired verification
-        if 'webauthn_verified' in request.session:
-            del request.session['webauthn_verified']
-        if 'webauthn_verified_at' in request.session:
-            del request.session['webauthn_verified_at']
+        mfa.clear(request)
         
         # Store the intended URL for redirect after verification
         request.session['admin_redirect_url'] = request.get_full_path()
         
         # Redirect to WebAuthn verification
-        return redirect('admin:webauthn_verify')
\ No newline at end of file
+        return redirect('admin:webauthn_verify')
+    
+    async def _acheck_admin_authentication(self, request):
+        """Async variant of _check_admin_authentication using the async session API"""
+        user = await request.auser()
+        # Sync admin views read request.user; hand them the resolved user
+        request.user = user
+        denied = self._check_staff(request, user)
+        if denied:
+            return denied
+        
+        if await mfa.ais_verified(request, user):
+            return None
+        
+        await mfa.aclear(request)
+        await request.session.aset('admin_redirect_url', request.get_full_path())
+        return redirect('admin:webauthn_verify')
+    
+    def _check_staff(self, request, user):
+        # Step 1: Check if user is authenticated via Clerk
+        if not user.is_authenticated:
+            return redirect('admin:login')
+        
+        # Step 2: Check if user is staff
+        if not user.is_staff:
+            messages.error(request, "You do not have permission to access the admin panel.")
+            return redirect('admin:login')
+        
+        return None
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_clerk_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClerkSyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+                ('delta', models.BooleanField(default=False)),
+                ('synced', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'clerk_sync_runs',
+                'indexes': [models.Index(fields=['failed', '-started_at'], name='clerk_sync__failed_90384e_idx')],
+            },
+        ),
+    ]
@@ -26,6 +26,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     last_synced_at = models.DateTimeField(null=True, blank=True)
+    # Timestamp of the newest Clerk webhook event applied to this row
+    clerk_updated_at = models.DateTimeField(null=True, blank=True)
     
     # Additional fields from Clerk
     profile_image_url = models.URLField(blank=True)
@@ -41,4 +43,34 @@ class User(AbstractBaseUser, PermissionsMixin):
         indexes = [
             models.Index(fields=['email']),
             models.Index(fields=['created_at']),
-        ]
\ No newline at end of file
+        ]
+
+class ClerkWebhookEvent(models.Model):
+    """Inbox of verified Clerk webhook deliveries awaiting batch processing"""
+    svix_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    occurred_at = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        db_table = 'clerk_webhook_events'
+        indexes = [
+            models.Index(fields=['processed_at', 'occurred_at']),
+        ]
+
+class ClerkSyncRun(models.Model):
+    """A finished sync_clerk_users run; its start bounds the next ``--delta`` run"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+    delta = models.BooleanField(default=False)
+    synced = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'clerk_sync_runs'
+        indexes = [
+            models.Index(fields=['failed', '-started_at']),
+        ]
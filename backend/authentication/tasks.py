@@ -0,0 +1,54 @@
+"""Background work moved off the request path.
+
+Tasks are registered on the app in backend/celery.py, which this module imports;
+web code imports it lazily so processes that never queue work skip loading Celery.
+"""
+from datetime import datetime
+
+from django.apps import apps
+from django.db import DatabaseError
+from django.db.models import Q
+
+from backend.celery import app
+
+from .webhooks import process_pending_events
+
+RETRY = {'autoretry_for': (DatabaseError,), 'retry_backoff': True, 'retry_backoff_max': 60, 'max_retries': 5}
+
+
+@app.task(**RETRY)
+def process_clerk_webhooks(batch_size=500):
+    """Drain the webhook inbox; queued after each stored delivery.
+
+    Runs may overlap: each batch claims its events with SKIP LOCKED, see
+    ``process_pending_events``.
+    """
+    total = 0
+    while processed := process_pending_events(batch_size):
+        total += processed
+    return total
+
+
+@app.task(**RETRY)
+def touch_rows(model_label, field, pks, touched_at):
+    """Set ``field`` to ``touched_at`` on the given rows, never moving it backwards"""
+    model = apps.get_model(model_label)
+    touched_at = datetime.fromisoformat(touched_at)
+    stale = Q(**{f'{field}__lt': touched_at}) | Q(**{f'{field}__isnull': True})
+    return model._default_manager.filter(stale, pk__in=pks).update(**{field: touched_at})
+
+
+@app.task(bind=True, max_retries=5)
+def revoke_clerk_session(self, session_id):
+    """End a Clerk session (admin logout), retrying later while Clerk is unavailable"""
+    from .clerk_api import ClerkUnavailable, get_clerk_client, is_transient
+
+    try:
+        get_clerk_client().call('sessions.revoke', session_id=session_id)
+    except ClerkUnavailable as e:
+        raise self.retry(exc=e, countdown=max(1, e.retry_after))
+    except Exception as e:
+        # The client already retried briefly; back off for longer here
+        if not is_transient(e):
+            raise
+        raise self.retry(exc=e, countdown=min(60, 2 ** self.request.retries))
@@ -1,3 +1,899 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from datetime import timedelta
+from pathlib import Path
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from clerk_backend_api.models import ClerkBaseError, ClerkErrors
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth import get_user_model
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from jose import jwk, jwt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+
+from . import async_views
+from .checks import check_identity_cache_is_shared
+from .clerk_api import CircuitBreaker, ClerkClient, ClerkUnavailable
+from .backends import ClerkAuthentication, last_synced_touches
+from .identity_cache import IdentityCache, identity_cache
+from .jwks import JWKSCache, VerifiedTokenCache
+from . import mfa
+from .admin import admin_site
+from .middleware import AdminWebAuthnMiddleware, ClerkAuthenticationMiddleware
+from .models import ClerkSyncRun, ClerkWebhookEvent
+from .tasks import process_clerk_webhooks, revoke_clerk_session, touch_rows
+from .webhooks import enqueue_event, process_pending_events
+
+User = get_user_model()
+
+# URLconf for the async view tests; ASYNC_VIEWS is read once at import time
+urlpatterns = [
+    path('api/v1/auth/clerk/sync-user/', async_views.clerk_webhook_sync_user),
+    path('api/v1/auth/me/', async_views.current_user),
+]
+
+
+def make_signing_key(kid):
+    """Return (private PEM, public JWK dict) for a fresh RSA key"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    public_jwk = jwk.construct(pem, 'RS256').public_key().to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return pem, public_jwk
+
+
+def clerk_user_payload(clerk_id, updated_at=1_700_000_000_000, first_name='Jane'):
+    """A Clerk Backend API user object with the fields the SDK requires"""
+    email = {
+        'id': f'idn_{clerk_id}', 'object': 'email_address', 'email_address': f'{clerk_id}@example.com',
+        'reserved': False, 'verification': None, 'linked_to': [], 'created_at': updated_at, 'updated_at': updated_at,
+    }
+    return {
+        'id': clerk_id, 'object': 'user', 'external_id': None, 'primary_email_address_id': email['id'],
+        'primary_phone_number_id': None, 'primary_web3_wallet_id': None, 'username': None,
+        'first_name': first_name, 'last_name': 'Doe', 'has_image': False, 'image_url': '',
+        'public_metadata': {}, 'private_metadata': {}, 'unsafe_metadata': {},
+        'email_addresses': [email], 'phone_numbers': [], 'web3_wallets': [], 'passkeys': [],
+        'password_enabled': False, 'two_factor_enabled': False, 'totp_enabled': False, 'backup_code_enabled': False,
+        'mfa_enabled_at': None, 'mfa_disabled_at': None, 'external_accounts': [], 'saml_accounts': [],
+        'enterprise_accounts': [], 'last_sign_in_at': None, 'banned': False, 'locked': False,
+        'lockout_expires_in_seconds': None, 'verification_attempts_remaining': None,
+        'updated_at': updated_at, 'created_at': updated_at, 'delete_self_enabled': True,
+        'create_organization_enabled': True, 'last_active_at': None, 'legal_accepted_at': None,
+    }
+
+
+def clerk_session_payload(session_id, status='active'):
+    """A Clerk Backend API session object"""
+    return {
+        'object': 'session', 'id': session_id, 'user_id': 'user_123', 'client_id': 'client_1', 'status': status,
+        'last_active_at': 1_700_000_000_000, 'expire_at': 1_700_000_000_000, 'abandon_at': 1_700_000_000_000,
+        'updated_at': 1_700_000_000_000, 'created_at': 1_700_000_000_000,
+    }
+
+
+class FakeClerkAPI:
+    """Local stand-in for the Clerk Backend API, served from a background thread"""
+
+    def __init__(self):
+        self.users = []
+        self.requests = []
+        # Client ports seen; keep-alive requests share one
+        self.connections = set()
+        # Statuses to answer the next requests with, and a delay before each answer
+        self.failures = []
+        self.delay = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if self.fail():
+                    return
+                path, _, query = self.path.partition('?')
+                params = dict(p.split('=', 1) for p in query.split('&') if p)
+                if path != '/users':
+                    return self.respond(404, {'errors': []})
+                users = sorted(api.users, key=lambda u: u['updated_at'], reverse=params.get('order_by') == '-updated_at')
+                offset, limit = int(params.get('offset', 0)), int(params.get('limit', 10))
+                self.respond(200, users[offset:offset + limit])
+
+            def do_POST(self):
+                if self.fail():
+                    return
+                match = re.fullmatch(r'/sessions/([^/]+)/revoke', self.path)
+                if not match:
+                    return self.respond(404, {'errors': []})
+                self.respond(200, clerk_session_payload(match[1], status='revoked'))
+
+            def fail(self):
+                """Record the request and answer it with the next scripted failure, if any"""
+                api.requests.append(self.path)
+                api.connections.add(self.client_address[1])
+                time.sleep(api.delay)
+                if api.failures:
+                    self.respond(api.failures.pop(0), {'errors': []})
+                    return True
+                return False
+
+            def respond(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out and hung up
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JWKSTestMixin:
+    """Serves a local stand-in JWKS file and signs Clerk-like tokens"""
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.jwks_path = Path(self.tmpdir.name) / 'jwks.json'
+        self.private_pem, public_jwk = make_signing_key('kid-1')
+        self.write_jwks([public_jwk])
+        settings_override = override_settings(CLERK_JWKS_URL=self.jwks_path.as_uri())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write_jwks(self, keys):
+        self.jwks_path.write_text(json.dumps({'keys': keys}))
+
+    def make_token(self, sub='user_123', kid='kid-1', pem=None, expires_in=300, **claims):
+        now = int(time.time())
+        payload = {'sub': sub, 'iat': now, 'nbf': now, 'exp': now + expires_in, **claims}
+        return jwt.encode(payload, pem or self.private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+class JWKSCacheTests(JWKSTestMixin, TestCase):
+    def test_fetches_once_and_looks_up_by_kid(self):
+        cache = JWKSCache(self.jwks_path.as_uri())
+        key = cache.get_key('kid-1')
+        self.jwks_path.unlink()
+        self.assertIs(cache.get_key('kid-1'), key)
+
+    def test_unknown_kid_triggers_refetch(self):
+        cache = JWKSCache(str(self.jwks_path), min_refetch_interval=0)
+        cache.get_key('kid-1')
+        _, rotated_jwk = make_signing_key('kid-2')
+        self.write_jwks([rotated_jwk])
+        self.assertIsNotNone(cache.get_key('kid-2'))
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        cache = JWKSCache(str(self.jwks_path), min_refetch_interval=60)
+        cache.get_key('kid-1')
+        _, rotated_jwk = make_signing_key('kid-2')
+        self.write_jwks([rotated_jwk])
+        with self.assertRaises(Exception):
+            cache.get_key('kid-2')
+
+
+class VerifiedTokenCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = VerifiedTokenCache(max_size=2)
+        exp = time.time() + 60
+        cache.set('a', {'sub': 'a', 'exp': exp})
+        cache.set('b', {'sub': 'b', 'exp': exp})
+        cache.get('a')
+        cache.set('c', {'sub': 'c', 'exp': exp})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_entries_are_dropped(self):
+        cache = VerifiedTokenCache()
+        cache.set('a', {'sub': 'a', 'exp': time.time() - 1})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class VerifyClerkTokenTests(JWKSTestMixin, TestCase):
+    def test_valid_token_is_verified(self):
+        claims = ClerkAuthentication().verify_clerk_token(self.make_token())
+        self.assertEqual(claims['sub'], 'user_123')
+
+    def test_forged_signature_is_rejected(self):
+        forged_pem, _ = make_signing_key('kid-1')
+        with self.assertRaises(AuthenticationFailed):
+            ClerkAuthentication().verify_clerk_token(self.make_token(pem=forged_pem))
+
+    def test_expired_token_is_rejected(self):
+        with self.assertRaises(AuthenticationFailed):
+            ClerkAuthentication().verify_clerk_token(self.make_token(expires_in=-60))
+
+    def test_repeat_token_skips_verification(self):
+        token = self.make_token()
+        backend = ClerkAuthentication()
+        backend.verify_clerk_token(token)
+        self.jwks_path.unlink()
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.verify_clerk_token(token)['sub'], 'user_123')
+
+    @override_settings(CLERK_JWKS_MIN_REFETCH_INTERVAL=0)
+    async def test_key_fetches_run_off_the_event_loop(self):
+        backend = ClerkAuthentication()
+        with mock.patch('authentication.backends.sync_to_async', wraps=sync_to_async) as thread_hop:
+            await backend.averify_clerk_token(self.make_token())
+            self.assertEqual(thread_hop.call_count, 1)
+            await backend.averify_clerk_token(self.make_token(jti='known-kid'))
+            self.assertEqual(thread_hop.call_count, 1)
+            # Rotated signing key: the unknown kid makes the cache refetch
+            rotated_pem, rotated_jwk = make_signing_key('kid-2')
+            self.write_jwks([rotated_jwk])
+            claims = await backend.averify_clerk_token(self.make_token(kid='kid-2', pem=rotated_pem))
+            self.assertEqual(claims['sub'], 'user_123')
+            self.assertEqual(thread_hop.call_count, 2)
+
+
+class GetOrCreateUserTests(TestCase):
+    claims = {'sub': 'user_123', 'email': 'jane@example.com', 'given_name': 'Jane'}
+
+    def setUp(self):
+        identity_cache.clear()
+        last_synced_touches.flush()
+        self.backend = ClerkAuthentication()
+        self.user = self.backend.get_or_create_user(self.claims)
+
+    def test_unchanged_claims_do_not_write(self):
+        identity_cache.clear()
+        with self.assertNumQueries(1):
+            self.backend.get_or_create_user(self.claims)
+        self.assertEqual(len(last_synced_touches), 1)
+
+    def test_changed_claims_update_only_changed_fields(self):
+        user = self.backend.get_or_create_user({**self.claims, 'given_name': 'Janet'})
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Janet')
+        self.assertEqual(user.email, 'jane@example.com')
+        self.assertIsNotNone(user.last_synced_at)
+
+    def test_missing_email_claim_keeps_stored_email(self):
+        self.backend.get_or_create_user({'sub': 'user_123'})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'jane@example.com')
+
+    def test_touches_are_flushed_in_one_update(self):
+        other = User.objects.create_user(clerk_id='user_456', email='other@example.com')
+        self.backend.get_or_create_user(self.claims)
+        self.backend.get_or_create_user({'sub': 'user_456'})
+        with self.assertNumQueries(1):
+            self.assertEqual(last_synced_touches.flush(), 2)
+        other.refresh_from_db()
+        self.assertIsNotNone(other.last_synced_at)
+
+    def test_recently_synced_users_are_not_touched(self):
+        User.objects.filter(pk=self.user.pk).update(last_synced_at=timezone.now())
+        identity_cache.clear()
+        self.backend.get_or_create_user(self.claims)
+        self.assertEqual(len(last_synced_touches), 0)
+
+
+class RequestScopedAuthenticationTests(JWKSTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        identity_cache.clear()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+        self.token = self.make_token()
+        ClerkAuthentication().verify_clerk_token(self.token)
+
+    def test_middleware_and_drf_share_one_authentication(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        ClerkAuthenticationMiddleware(lambda r: None)(request)
+        with mock.patch.object(
+            ClerkAuthentication, 'verify_clerk_token', wraps=ClerkAuthentication().verify_clerk_token
+        ) as verify, self.assertNumQueries(1):
+            self.assertEqual(request.user.pk, self.user.pk)
+            self.assertEqual(Request(request, authenticators=[ClerkAuthentication()]).user.pk, self.user.pk)
+        self.assertEqual(verify.call_count, 1)
+
+    def test_failed_authentication_is_shared(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer not-a-jwt')
+        ClerkAuthenticationMiddleware(lambda r: None)(request)
+        self.assertFalse(request.user.is_authenticated)
+        with self.assertRaises(AuthenticationFailed):
+            ClerkAuthentication().authenticate(request)
+
+    def test_query_count_per_api_request(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/auth/me/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['clerk_id'], 'user_123')
+
+
+# The webhook tests must not depend on CLERK_WEBHOOK_SECRET in the environment
+WEBHOOK_SECRET = 'whsec_test'
+
+
+class WebhookTestMixin:
+    def post_webhook(self, event_type, data, svix_id='msg_1', timestamp=None):
+        event = {'type': event_type, 'data': data, 'object': 'event'}
+        if timestamp is not None:
+            event['timestamp'] = timestamp
+        body = json.dumps(event).encode()
+        signature = hmac.new(settings.CLERK_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/api/v1/auth/clerk/sync-user/', body, content_type='application/json',
+            HTTP_SVIX_ID=svix_id, HTTP_SVIX_SIGNATURE=signature,
+        )
+
+
+@override_settings(CLERK_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class IdentityCacheTests(WebhookTestMixin, TestCase):
+    def setUp(self):
+        identity_cache.clear()
+        self.backend = ClerkAuthentication()
+        self.user = self.backend.get_or_create_user({'sub': 'user_123', 'email': 'jane@example.com'})
+
+    def test_cached_identity_needs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_or_create_user({'sub': 'user_123'}).pk, self.user.pk)
+
+    def test_hits_return_independent_instances(self):
+        cached = identity_cache.get('user_123')
+        cached.first_name = 'Changed'
+        self.assertEqual(identity_cache.get('user_123').first_name, '')
+
+    def test_entries_expire_and_are_bounded(self):
+        cache = IdentityCache(ttl=0, max_size=1)
+        cache.set(self.user)
+        self.assertIsNone(cache.get('user_123'))
+        cache = IdentityCache(ttl=60, max_size=1)
+        cache.set(self.user)
+        cache.set(User(clerk_id='user_456', email='other@example.com'))
+        self.assertIsNone(cache.get('user_123'))
+        self.assertIsNotNone(cache.get('user_456'))
+
+    def test_saving_user_invalidates_entry(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIsNone(identity_cache.get('user_123'))
+
+    def test_user_updated_webhook_refreshes_entry(self):
+        self.post_webhook('user.updated', {
+            'id': 'user_123',
+            'email_addresses': [{'email_address': 'jane@example.com'}],
+            'first_name': 'Jane',
+        })
+        process_pending_events()
+        self.assertIsNone(identity_cache.get('user_123'))
+        self.assertEqual(self.backend.get_or_create_user({'sub': 'user_123'}).first_name, 'Jane')
+
+    def test_user_deleted_webhook_stops_serving_identity(self):
+        self.post_webhook('user.deleted', {'id': 'user_123'})
+        process_pending_events()
+        with self.assertRaises(AuthenticationFailed):
+            self.backend.get_or_create_user({'sub': 'user_123'})
+
+    @override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache_backend(self):
+        cache = IdentityCache(cache_alias='shared')
+        cache.set(self.user)
+        self.assertEqual(cache.get('user_123').pk, self.user.pk)
+        cache.delete('user_123')
+        self.assertIsNone(cache.get('user_123'))
+
+    @override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_rows_read_before_an_invalidation_are_not_cached(self):
+        for cache in (IdentityCache(), IdentityCache(cache_alias='shared')):
+            version = cache.version('user_123')
+            stale = User.objects.get(clerk_id='user_123')
+            cache.delete('user_123')
+            cache.set(stale, version)
+            self.assertIsNone(cache.get('user_123'))
+            cache.set(stale, cache.version('user_123'))
+            self.assertIsNotNone(cache.get('user_123'))
+
+    def test_deactivation_during_a_miss_is_not_overwritten(self):
+        identity_cache.clear()
+        get_or_create = User.objects.get_or_create
+
+        def read_then_deactivate(**kwargs):
+            found = get_or_create(**kwargs)
+            # A user.deleted webhook lands between the read and the cache write
+            User.objects.filter(clerk_id='user_123').update(is_active=False)
+            identity_cache.delete('user_123')
+            return found
+
+        with mock.patch.object(User.objects, 'get_or_create', side_effect=read_then_deactivate):
+            self.backend.get_or_create_user({'sub': 'user_123'})
+        self.assertIsNone(identity_cache.get('user_123'))
+        with self.assertRaises(AuthenticationFailed):
+            self.backend.get_or_create_user({'sub': 'user_123'})
+
+    @override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    async def test_clear_leaves_the_rest_of_a_shared_cache(self):
+        cache = IdentityCache(cache_alias='shared')
+        caches['shared'].set('other', 'kept')
+        await cache.aset(self.user)
+        cache.clear()
+        self.assertIsNone(cache.get('user_123'))
+        self.assertIsNone(await cache.aget('user_123'))
+        self.assertEqual(caches['shared'].get('other'), 'kept')
+        await cache.aset(self.user)
+        self.assertEqual((await cache.aget('user_123')).pk, self.user.pk)
+
+
+@override_settings(CLERK_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class WebhookInboxTests(WebhookTestMixin, TestCase):
+    def user_data(self, clerk_id='user_123', first_name='Jane', updated_at=1_700_000_000_000):
+        return {
+            'id': clerk_id,
+            'email_addresses': [{'id': 'idn_1', 'email_address': f'{clerk_id}@example.com'}],
+            'primary_email_address_id': 'idn_1',
+            'first_name': first_name,
+            'updated_at': updated_at,
+        }
+
+    def test_endpoint_only_persists_event(self):
+        with self.assertNumQueries(1):
+            response = self.post_webhook('user.created', self.user_data())
+        self.assertEqual(response.json(), {'status': 'queued'})
+        self.assertFalse(User.objects.exists())
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.client.post(
+            '/api/v1/auth/clerk/sync-user/', {'type': 'user.created'}, content_type='application/json',
+            HTTP_SVIX_SIGNATURE='bogus',
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(ClerkWebhookEvent.objects.exists())
+
+    def test_redelivered_message_is_stored_once(self):
+        self.post_webhook('user.created', self.user_data())
+        self.post_webhook('user.created', self.user_data())
+        self.assertEqual(ClerkWebhookEvent.objects.count(), 1)
+
+    def test_batch_is_applied_with_bulk_writes(self):
+        for i in range(5):
+            self.post_webhook('user.created', self.user_data(f'user_{i}'), svix_id=f'msg_{i}')
+        self.post_webhook('user.updated', self.user_data('user_0', 'Janet', 1_700_000_000_001), svix_id='msg_5')
+        # Claim, savepoint, user lookup, insert, release, mark processed (in the test's transaction)
+        with self.assertNumQueries(6 + 2):
+            self.assertEqual(process_pending_events(), 6)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(User.objects.get(clerk_id='user_0').first_name, 'Janet')
+        self.assertFalse(ClerkWebhookEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_out_of_order_retry_does_not_overwrite_newer_data(self):
+        self.post_webhook('user.updated', self.user_data(first_name='Newer', updated_at=2_000), svix_id='msg_new')
+        process_pending_events()
+        self.post_webhook('user.updated', self.user_data(first_name='Older', updated_at=1_000), svix_id='msg_old')
+        process_pending_events()
+        self.assertEqual(User.objects.get(clerk_id='user_123').first_name, 'Newer')
+
+    def test_bad_event_does_not_block_the_batch(self):
+        User.objects.create_user(clerk_id='user_existing', email='user_1@example.com')
+        self.post_webhook('user.created', self.user_data('user_1'), svix_id='msg_1')
+        self.post_webhook('user.created', self.user_data('user_2'), svix_id='msg_2')
+        self.assertEqual(process_pending_events(), 2)
+        self.assertTrue(User.objects.filter(clerk_id='user_2').exists())
+        self.assertTrue(ClerkWebhookEvent.objects.get(svix_id='msg_1').error)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'row locks need PostgreSQL')
+class ConcurrentDrainTests(TransactionTestCase):
+    def test_events_claimed_by_another_drain_are_skipped(self):
+        enqueue_event('msg_1', {'type': 'user.created', 'data': clerk_user_payload('user_123')})
+        claimed, release = threading.Event(), threading.Event()
+
+        def other_drain():
+            try:
+                with transaction.atomic():
+                    list(ClerkWebhookEvent.objects.select_for_update())
+                    claimed.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_drain)
+        thread.start()
+        claimed.wait(5)
+        try:
+            self.assertEqual(process_pending_events(), 0)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(process_pending_events(), 1)
+        self.assertTrue(User.objects.filter(clerk_id='user_123').exists())
+
+
+class SyncClerkUsersCommandTests(TestCase):
+    def setUp(self):
+        identity_cache.clear()
+        self.api = FakeClerkAPI()
+        self.addCleanup(self.api.close)
+        self.api.users = [clerk_user_payload(f'user_{i}', 1_700_000_000_000 + i) for i in range(7)]
+
+    def sync(self, **options):
+        out = StringIO()
+        self.errors = StringIO()
+        call_command('sync_clerk_users', server_url=self.api.url, page_size=3, stdout=out, stderr=self.errors, **options)
+        return out.getvalue()
+
+    def test_full_sync_pages_through_directory(self):
+        output = self.sync()
+        self.assertEqual(User.objects.count(), 7)
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertIn('Synced 7 users', output)
+        self.assertIn('users/s', output)
+        user = User.objects.get(clerk_id='user_3')
+        self.assertEqual((user.email, user.first_name), ('user_3@example.com', 'Jane'))
+
+    def test_full_sync_updates_existing_users(self):
+        User.objects.create_user(clerk_id='user_0', email='old@example.com')
+        self.sync()
+        self.assertEqual(User.objects.get(clerk_id='user_0').email, 'user_0@example.com')
+
+    def test_sync_keeps_newer_webhook_changes(self):
+        webhook_time = timezone.now()
+        User.objects.create_user(clerk_id='user_2', email='user_2@example.com', first_name='Webhook',
+                                 clerk_updated_at=webhook_time)
+        self.sync(deactivate_missing=True)
+        user = User.objects.get(clerk_id='user_2')
+        self.assertEqual((user.first_name, user.clerk_updated_at, user.is_active), ('Webhook', webhook_time, True))
+        self.assertEqual(User.objects.get(clerk_id='user_3').first_name, 'Jane')
+
+    def test_delta_sync_only_fetches_changed_users(self):
+        self.sync()
+        self.api.requests.clear()
+        self.api.users[2] = clerk_user_payload('user_2', 1_800_000_000_000, first_name='Changed')
+        output = self.sync(delta=True)
+        self.assertEqual(User.objects.get(clerk_id='user_2').first_name, 'Changed')
+        self.assertEqual(len(self.api.requests), 1)
+        self.assertIn('Synced 1 users', output)
+
+    def test_delta_cutoff_is_the_last_clean_run_not_the_newest_webhook(self):
+        self.sync()
+        # A webhook applied a change stamped later than anything below...
+        User.objects.filter(clerk_id='user_6').update(clerk_updated_at=timezone.now() + timedelta(days=1))
+        # ...and a run with failed upserts never moves the cutoff
+        ClerkSyncRun.objects.create(started_at=timezone.now() + timedelta(hours=1), failed=1)
+        # user_3's own webhook was lost
+        self.api.users[3] = clerk_user_payload('user_3', int(time.time() * 1000), first_name='Changed')
+        self.sync(delta=True)
+        self.assertEqual(User.objects.get(clerk_id='user_3').first_name, 'Changed')
+        self.assertEqual(ClerkSyncRun.objects.filter(failed=0, delta=True).count(), 1)
+
+    def test_deactivate_missing(self):
+        User.objects.create_user(clerk_id='user_gone', email='gone@example.com')
+        self.sync(deactivate_missing=True)
+        self.assertFalse(User.objects.get(clerk_id='user_gone').is_active)
+        self.assertTrue(User.objects.get(clerk_id='user_0').is_active)
+
+    def test_deactivate_missing_spares_failed_upserts_and_invalidates_the_cache(self):
+        gone = User.objects.create_user(clerk_id='user_gone', email='gone@example.com')
+        # user_1's new email is still held by another Clerk user locally, so its upsert fails
+        User.objects.create_user(clerk_id='user_1', email='old@example.com')
+        User.objects.create_user(clerk_id='user_squatter', email='user_1@example.com')
+        self.api.users.append(clerk_user_payload('user_squatter', 1_700_000_000_100))
+        identity_cache.set(gone)
+        output = self.sync(deactivate_missing=True)
+        self.assertIn('1 failed, 1 deactivated', output)
+        self.assertIn('Failed to sync user_1: ', self.errors.getvalue())
+        self.assertTrue(User.objects.get(clerk_id='user_1').is_active)
+        self.assertFalse(User.objects.get(clerk_id='user_gone').is_active)
+        self.assertIsNone(identity_cache.get('user_gone'))
+
+
+@override_settings(ROOT_URLCONF=__name__, CLERK_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class AsyncViewTests(JWKSTestMixin, WebhookTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        identity_cache.clear()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+        self.token = self.make_token()
+
+    async def test_current_user(self):
+        response = await self.async_client.get('/api/v1/auth/me/', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['clerk_id'], 'user_123')
+
+    async def test_unauthenticated_and_invalid_tokens_are_rejected(self):
+        response = await self.async_client.get('/api/v1/auth/me/')
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get('/api/v1/auth/me/', headers={'Authorization': 'Bearer not-a-jwt'})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('Invalid token', response.json()['detail'])
+
+    async def test_warm_authentication_runs_no_thread_hop(self):
+        await self.async_client.get('/api/v1/auth/me/', headers={'Authorization': f'Bearer {self.token}'})
+        with mock.patch('authentication.backends.sync_to_async') as sync_to_async:
+            response = await self.async_client.get('/api/v1/auth/me/', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        sync_to_async.assert_not_called()
+
+    async def test_webhook_is_queued(self):
+        response = await self.async_client.post(
+            '/api/v1/auth/clerk/sync-user/', b'{}', content_type='application/json',
+            headers={'Svix-Signature': 'bad'},
+        )
+        self.assertEqual(response.status_code, 401)
+        body = json.dumps({'type': 'user.created', 'data': clerk_user_payload('user_456')}).encode()
+        signature = hmac.new(settings.CLERK_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        response = await self.async_client.post(
+            '/api/v1/auth/clerk/sync-user/', body, content_type='application/json',
+            headers={'Svix-Id': 'msg_async', 'Svix-Signature': signature},
+        )
+        self.assertEqual(response.json(), {'status': 'queued'})
+        self.assertTrue(await ClerkWebhookEvent.objects.filter(svix_id='msg_async').aexists())
+
+
+class AdminWebAuthnMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com', is_staff=True)
+        self.middleware = AdminWebAuthnMiddleware(lambda request: HttpResponse('ok'))
+
+    def admin_request(self, cookies=None, user=None):
+        request = RequestFactory().get('/admin/authentication/user/')
+        request.user = user or self.user
+        request.COOKIES.update(cookies or {})
+        return request
+
+    def issue_cookie(self, user=None):
+        response = HttpResponse()
+        mfa.mark_verified(self.admin_request(), response, user or self.user)
+        return {settings.ADMIN_MFA_COOKIE_NAME: response.cookies[settings.ADMIN_MFA_COOKIE_NAME].value}
+
+    def test_only_protected_admin_paths_are_checked(self):
+        for path in ['/admin/', '/admin/authentication/user/', '/admin/logout/']:
+            self.assertTrue(self.middleware._is_admin_request(RequestFactory().get(path)), path)
+        for path in ['/api/v1/auth/me/', '/admin', '/admin/login/', '/admin/webauthn-verify/', '/admin/clerk-auth-complete/']:
+            self.assertFalse(self.middleware._is_admin_request(RequestFactory().get(path)), path)
+
+    def test_session_storage(self):
+        request = self.admin_request()
+        request.session = SessionStore()
+        self.assertEqual(self.middleware(request).status_code, 302)
+        mfa.mark_verified(request, HttpResponse(), self.user)
+        self.assertEqual(self.middleware(request).content, b'ok')
+
+    @override_settings(ADMIN_MFA_STORAGE='cookie')
+    def test_signed_cookie_needs_no_session(self):
+        # No request.session at all: any session access would raise
+        response = self.middleware(self.admin_request(self.issue_cookie()))
+        self.assertEqual(response.content, b'ok')
+
+    @override_settings(ADMIN_MFA_STORAGE='cookie')
+    def test_cookie_is_bound_to_user_and_signed(self):
+        other = User.objects.create_user(clerk_id='user_456', email='other@example.com', is_staff=True)
+        cookies = self.issue_cookie()
+        self.assertFalse(mfa.is_verified(self.admin_request(cookies, user=other), other))
+        name = settings.ADMIN_MFA_COOKIE_NAME
+        self.assertFalse(mfa.is_verified(self.admin_request({name: cookies[name] + 'x'}), self.user))
+
+    @override_settings(ADMIN_MFA_STORAGE='cookie', ADMIN_MFA_MAX_AGE=60)
+    def test_cookie_expires(self):
+        cookies = self.issue_cookie()
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 61):
+            self.assertFalse(mfa.is_verified(self.admin_request(cookies), self.user))
+
+    @override_settings(ADMIN_MFA_STORAGE='cookie')
+    def test_logout_revokes_cookie(self):
+        cookies = self.issue_cookie()
+        request = self.admin_request(cookies)
+        request.session = SessionStore()
+        response = HttpResponse()
+        mfa.revoke(request, response)
+        self.assertEqual(response.cookies[settings.ADMIN_MFA_COOKIE_NAME]['max-age'], 0)
+        # A copy of the cookie replayed after logout is rejected
+        self.assertFalse(mfa.is_verified(self.admin_request(cookies), self.user))
+        self.assertTrue(mfa.is_verified(self.admin_request(self.issue_cookie()), self.user))
+
+
+@override_settings(CLERK_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class BackgroundTaskTests(JWKSTestMixin, WebhookTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        identity_cache.clear()
+        last_synced_touches.flush()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_webhook_queues_a_drain_after_commit(self):
+        data = {'id': 'user_123', 'email_addresses': [], 'first_name': 'Jane', 'updated_at': 1_700_000_000_000}
+        with mock.patch.object(process_clerk_webhooks, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = self.post_webhook('user.created', data)
+        self.assertEqual(response.json(), {'status': 'queued'})
+        self.assertEqual(len(callbacks), 1)
+        delay.assert_called_once_with()
+        self.assertEqual(process_clerk_webhooks.apply().result, 1)
+        self.assertEqual(User.objects.get(clerk_id='user_123').first_name, 'Jane')
+        self.assertIsNotNone(ClerkWebhookEvent.objects.get().processed_at)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_tasks_leave_the_inbox_to_the_command(self):
+        data = {'id': 'user_123', 'email_addresses': [], 'first_name': 'Jane', 'updated_at': 1_700_000_000_000}
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.post_webhook('user.created', data)
+        self.assertEqual(callbacks, [])
+        self.assertIsNone(ClerkWebhookEvent.objects.get().processed_at)
+        call_command('process_clerk_webhooks', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(User.objects.get(clerk_id='user_123').first_name, 'Jane')
+
+    def test_touch_rows_never_moves_backwards(self):
+        now = timezone.now()
+        fresh = User.objects.create_user(clerk_id='user_123', email='jane@example.com', last_synced_at=now)
+        stale = User.objects.create_user(clerk_id='user_456', email='other@example.com')
+        earlier = (now - timedelta(minutes=1)).isoformat()
+        self.assertEqual(touch_rows('authentication.User', 'last_synced_at', [fresh.pk, stale.pk], earlier), 1)
+        fresh.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual(fresh.last_synced_at, now)
+        self.assertEqual(stale.last_synced_at.isoformat(), earlier)
+
+    def test_request_finished_hands_touches_to_task(self):
+        user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+        last_synced_touches.touch(user)
+        with mock.patch('authentication.tasks.touch_rows.delay') as delay:
+            last_synced_touches._last_flush = 0
+            last_synced_touches._on_request_finished()
+        model_label, field, pks, _ = delay.call_args.args
+        self.assertEqual((model_label, field, pks), ('authentication.User', 'last_synced_at', [user.pk]))
+        self.assertEqual(len(last_synced_touches), 0)
+
+    def fake_clerk_api(self):
+        api = FakeClerkAPI()
+        self.addCleanup(api.close)
+        settings_override = override_settings(CLERK_API_URL=api.url, CLERK_API_MAX_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return api
+
+    def test_revoke_session_retries_transient_errors(self):
+        api = self.fake_clerk_api()
+        api.failures = [503, 429]
+        result = revoke_clerk_session.apply(args=('sess_1',))
+        self.assertTrue(result.successful())
+        self.assertEqual(api.requests, ['/sessions/sess_1/revoke'] * 3)
+
+    def test_revoke_session_does_not_retry_client_errors(self):
+        api = self.fake_clerk_api()
+        api.failures = [404]
+        result = revoke_clerk_session.apply(args=('sess_1',))
+        self.assertTrue(result.failed())
+        self.assertEqual(len(api.requests), 1)
+
+    def test_admin_logout_revokes_clerk_session(self):
+        user = User.objects.create_user(clerk_id='user_123', email='jane@example.com', is_staff=True)
+        token = self.make_token(sid='sess_1')
+        request = RequestFactory().post('/admin/logout/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        request.session = SessionStore()
+        ClerkAuthenticationMiddleware(lambda r: None)(request)
+        self.assertEqual(request.user.pk, user.pk)
+        with mock.patch.object(revoke_clerk_session, 'delay') as delay:
+            admin_site.logout(request)
+        delay.assert_called_once_with('sess_1')
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False, CELERY_BROKER_URL='redis://localhost:6379/0')
+class IdentityCacheCheckTests(SimpleTestCase):
+    def errors(self):
+        return [error.id for error in check_identity_cache_is_shared(None)]
+
+    def test_workers_need_a_shared_identity_cache(self):
+        with override_settings(CLERK_IDENTITY_CACHE_ALIAS=None):
+            self.assertEqual(self.errors(), ['authentication.E001'])
+        local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CLERK_IDENTITY_CACHE_ALIAS='identity', CACHES={'default': local, 'identity': local}):
+            self.assertEqual(self.errors(), ['authentication.E001'])
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1'}
+        with override_settings(CLERK_IDENTITY_CACHE_ALIAS='identity', CACHES={'default': local, 'identity': redis}):
+            self.assertEqual(self.errors(), [])
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CLERK_IDENTITY_CACHE_ALIAS=None)
+    def test_eager_tasks_run_in_the_web_process(self):
+        self.assertEqual(self.errors(), [])
+
+
+class ClerkClientTests(TestCase):
+    def setUp(self):
+        self.api = FakeClerkAPI()
+        self.addCleanup(self.api.close)
+
+    def clerk_client(self, **options):
+        client = ClerkClient('sk_test', server_url=self.api.url, retry_backoff=0, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_connections_are_reused(self):
+        client = self.clerk_client()
+        for _ in range(3):
+            client.call('sessions.revoke', session_id='sess_1')
+        self.assertEqual(len(self.api.connections), 1)
+        self.assertEqual(client.stats()['operations']['sessions.revoke']['calls'], 3)
+
+    def test_transient_errors_are_retried_a_bounded_number_of_times(self):
+        client = self.clerk_client(max_retries=2)
+        self.api.failures = [502, 503, 504, 500]
+        with self.assertRaises(ClerkBaseError):
+            client.call('sessions.revoke', session_id='sess_1')
+        self.assertEqual(len(self.api.requests), 3)
+        stats = client.stats()['operations']['sessions.revoke']
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (3, 3, 2))
+
+    def test_client_errors_are_not_retried(self):
+        client = self.clerk_client(failure_threshold=1)
+        self.api.failures = [404]
+        with self.assertRaises(ClerkErrors):
+            client.call('sessions.revoke', session_id='sess_1')
+        self.assertEqual(len(self.api.requests), 1)
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.CLOSED)
+
+    def test_read_timeout(self):
+        client = self.clerk_client(read_timeout=0.1, max_retries=0)
+        self.api.delay = 0.5
+        start = time.monotonic()
+        with self.assertRaises(httpx.ReadTimeout):
+            client.call('sessions.revoke', session_id='sess_1')
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_circuit_opens_and_recovers(self):
+        client = self.clerk_client(max_retries=0, failure_threshold=2, reset_timeout=30)
+        self.api.failures = [503, 503]
+        for _ in range(2):
+            with self.assertRaises(ClerkBaseError):
+                client.call('sessions.revoke', session_id='sess_1')
+        with self.assertRaises(ClerkUnavailable):
+            client.call('sessions.revoke', session_id='sess_1')
+        self.assertEqual(len(self.api.requests), 2)
+        self.assertEqual(client.stats()['operations']['sessions.revoke']['rejected'], 1)
+
+        # After the reset timeout one trial call is let through and closes the circuit
+        client.breaker._opened_at -= 30
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.HALF_OPEN)
+        client.call('sessions.revoke', session_id='sess_1')
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        breaker._opened_at -= 30
+        breaker.before_call()
+        # Only one trial at a time
+        with self.assertRaises(ClerkUnavailable):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
@@ -0,0 +1,63 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.core.signals import request_finished
+from django.utils import timezone
+
+
+class TouchBuffer:
+    """Coalesces "last seen" timestamp writes into batched UPDATEs.
+
+    ``touch()`` only records the primary key in memory. Once ``flush_interval``
+    has passed, the ``request_finished`` signal hands the pending ids to the
+    ``touch_rows`` task, which writes them with a single
+    ``UPDATE ... SET <field> = now WHERE id IN (...)`` off the request path. Touches still pending
+    when the process exits are lost, which is acceptable for advisory
+    timestamps.
+    """
+
+    def __init__(self, model, field, flush_interval=60):
+        self.model = model
+        self.field = field
+        self.flush_interval = flush_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        request_finished.connect(self._on_request_finished, weak=False)
+
+    def touch(self, obj):
+        """Record that ``obj`` was seen, unless its timestamp is already fresh"""
+        current = getattr(obj, self.field)
+        if current and timezone.now() - current < timedelta(seconds=self.flush_interval):
+            return
+        with self._lock:
+            self._pending.add(obj.pk)
+
+    def flush(self):
+        """Write all pending touches in one UPDATE and return how many rows changed"""
+        pending = self._take()
+        if not pending:
+            return 0
+        return self.model._default_manager.filter(pk__in=pending).update(**{self.field: timezone.now()})
+
+    def flush_later(self):
+        """Hand the pending touches to a background task instead of writing them here"""
+        from .tasks import touch_rows
+
+        pending = self._take()
+        if pending:
+            touch_rows.delay(self.model._meta.label, self.field, sorted(pending), timezone.now().isoformat())
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._last_flush = time.monotonic()
+        return pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _on_request_finished(self, **kwargs):
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush_later()
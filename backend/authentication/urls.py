@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+if settings.ASYNC_VIEWS:
+    views = async_views
 
 urlpatterns = [
     path('clerk/sync-user/', views.clerk_webhook_sync_user, name='clerk-sync-user'),
     path('me/', views.current_user, name='current-user'),
-]
\ No newline at end of file
+]
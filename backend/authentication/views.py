@@ -7,7 +7,9 @@ import hmac
 import hashlib
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from backend.replicas import use_replica
 from .serializers import UserSerializer
+from .webhooks import enqueue_event, schedule_drain
 
 User = get_user_model()
 
@@ -21,37 +23,18 @@ def clerk_webhook_sync_user(request):
     if not verify_webhook_signature(request.body, signature):
         return Response({'error': 'Invalid signature'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    event_type = request.data.get('type')
-    data = request.data.get('data')
+    # Persist to the inbox and acknowledge; a Celery task applies events in batches
+    svix_id = request.META.get('HTTP_SVIX_ID') or hashlib.sha256(request.body).hexdigest()
+    enqueue_event(svix_id, request.data, request.META.get('HTTP_SVIX_TIMESTAMP'))
+    schedule_drain()
     
-    if event_type == 'user.created' or event_type == 'user.updated':
-        clerk_id = data.get('id')
-        email = data.get('email_addresses', [{}])[0].get('email_address', '')
-        
-        user_data = {
-            'clerk_id': clerk_id,
-            'email': email,
-            'first_name': data.get('first_name', ''),
-            'last_name': data.get('last_name', ''),
-            'profile_image_url': data.get('profile_image_url', ''),
-        }
-        
-        user, created = User.objects.update_or_create(
-            clerk_id=clerk_id,
-            defaults=user_data
-        )
-        
-        return Response({'status': 'success', 'created': created})
-    
-    elif event_type == 'user.deleted':
-        clerk_id = data.get('id')
-        User.objects.filter(clerk_id=clerk_id).update(is_active=False)
-        return Response({'status': 'success'})
-    
-    return Response({'status': 'ignored'})
+    return Response({'status': 'queued'})
 
 def verify_webhook_signature(payload, signature):
     """Verify Clerk webhook signature"""
+    if not signature:
+        return False
+    
     expected_signature = hmac.new(
         settings.CLERK_WEBHOOK_SECRET.encode(),
         payload,
@@ -62,6 +45,7 @@ def verify_webhook_signature(payload, signature):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@use_replica
 def current_user(request):
     """Get current authenticated user"""
     serializer = UserSerializer(request.user)
@@ -0,0 +1,158 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from backend.sqlite import write_atomic
+
+from .identity_cache import identity_cache
+from .models import ClerkWebhookEvent
+
+User = get_user_model()
+
+USER_EVENTS = ('user.created', 'user.updated', 'user.deleted')
+SYNCED_FIELDS = ['email', 'first_name', 'last_name', 'profile_image_url', 'is_active', 'clerk_updated_at', 'updated_at']
+
+
+def enqueue_event(svix_id, payload, svix_timestamp=None):
+    """Persist a verified webhook delivery; redeliveries of a message are no-ops"""
+    ClerkWebhookEvent.objects.bulk_create([_inbox_event(svix_id, payload, svix_timestamp)], ignore_conflicts=True)
+
+
+async def aenqueue_event(svix_id, payload, svix_timestamp=None):
+    await ClerkWebhookEvent.objects.abulk_create([_inbox_event(svix_id, payload, svix_timestamp)], ignore_conflicts=True)
+
+
+def _inbox_event(svix_id, payload, svix_timestamp):
+    return ClerkWebhookEvent(
+        svix_id=svix_id,
+        event_type=payload.get('type', ''),
+        payload=payload,
+        occurred_at=event_timestamp(payload, svix_timestamp),
+    )
+
+
+def event_timestamp(payload, svix_timestamp=None):
+    """When the event's data was current: data.updated_at, else the event or delivery time"""
+    data = payload.get('data') or {}
+    millis = data.get('updated_at') or payload.get('timestamp')
+    if millis:
+        return datetime.fromtimestamp(int(millis) / 1000, tz=dt_timezone.utc)
+    if svix_timestamp:
+        return datetime.fromtimestamp(int(svix_timestamp), tz=dt_timezone.utc)
+    return timezone.now()
+
+
+def user_fields_from_data(data):
+    email_addresses = data.get('email_addresses') or [{}]
+    primary = next(
+        (e for e in email_addresses if e.get('id') == data.get('primary_email_address_id')),
+        email_addresses[0],
+    )
+    return {
+        'email': primary.get('email_address', ''),
+        'first_name': data.get('first_name') or '',
+        'last_name': data.get('last_name') or '',
+        'profile_image_url': data.get('profile_image_url') or data.get('image_url') or '',
+    }
+
+
+def process_pending_events(batch_size=500):
+    """Apply one batch of unprocessed inbox events and return how many were consumed.
+
+    Events are read in timestamp order and collapsed to the newest per user, then
+    written with one bulk_create and one bulk_update. An event older than the
+    user's ``clerk_updated_at`` is skipped, so late retries never overwrite
+    newer data.
+
+    Overlapping drains stay apart: each claims its batch with ``FOR UPDATE
+    SKIP LOCKED`` and locks the users before comparing ``clerk_updated_at``,
+    so a drain holding an older event waits for one applying a newer event
+    and then skips it. SQLite has a single writer, so there the second drain
+    waits or fails with "database is locked" before it can write.
+    """
+    with write_atomic():
+        events = list(
+            ClerkWebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('occurred_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        latest = {}
+        for event in events:
+            clerk_id = (event.payload.get('data') or {}).get('id')
+            if event.event_type in USER_EVENTS and clerk_id:
+                latest[clerk_id] = event
+
+        try:
+            with transaction.atomic():
+                _apply_events(latest)
+        except IntegrityError:
+            # One bad row (e.g. a duplicate email) must not block the inbox; fall
+            # back to applying events one at a time and record the failures
+            for clerk_id, event in latest.items():
+                try:
+                    with transaction.atomic():
+                        _apply_events({clerk_id: event})
+                except IntegrityError as e:
+                    event.error = str(e)
+                    event.save(update_fields=['error'])
+        _mark_processed(events)
+
+    for clerk_id in latest:
+        identity_cache.delete(clerk_id)
+    return len(events)
+
+
+def schedule_drain():
+    """Queue a ``process_clerk_webhooks`` task once the current transaction commits.
+
+    With eager tasks (no broker) the drain would run inside the webhook request,
+    so nothing is queued; run ``manage.py process_clerk_webhooks --loop`` instead.
+    """
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        return
+    from .tasks import process_clerk_webhooks
+
+    transaction.on_commit(process_clerk_webhooks.delay)
+
+
+def _apply_events(latest):
+    now = timezone.now()
+    # Locked in a fixed order, so concurrent drains cannot deadlock on them
+    users = User.objects.select_for_update().order_by('clerk_id').in_bulk(list(latest), field_name='clerk_id')
+    to_create, to_update = [], []
+
+    for clerk_id, event in latest.items():
+        user = users.get(clerk_id)
+        if user is not None and user.clerk_updated_at and user.clerk_updated_at >= event.occurred_at:
+            continue
+
+        if event.event_type == 'user.deleted':
+            if user is None:
+                continue
+            user.is_active = False
+        else:
+            fields = user_fields_from_data(event.payload['data'])
+            if user is None:
+                to_create.append(User(clerk_id=clerk_id, clerk_updated_at=event.occurred_at, **fields))
+                continue
+            for field, value in fields.items():
+                setattr(user, field, value)
+
+        user.clerk_updated_at = event.occurred_at
+        user.updated_at = now
+        to_update.append(user)
+
+    if to_create:
+        User.objects.bulk_create(to_create)
+    if to_update:
+        User.objects.bulk_update(to_update, SYNCED_FIELDS)
+
+
+def _mark_processed(events):
+    ClerkWebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
@@ -0,0 +1,2 @@
+# Connect the SQLite connection_created hook before the first connection opens
+from . import sqlite  # noqa: F401
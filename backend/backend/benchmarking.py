@@ -0,0 +1,98 @@
+"""Shared setup and reporting for the ``bench_*`` management commands.
+
+Benchmarks run against a throwaway test database and a locally generated
+Clerk signing key, so they never touch real data or the network.
+"""
+import contextlib
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+@contextlib.contextmanager
+def benchmark_database(verbosity=0):
+    """Create the test databases (plus test settings such as ALLOWED_HOSTS) for the block.
+
+    SQLite test databases are kept on disk rather than in memory so that
+    concurrent threads see one database and lock it like a real deployment.
+    """
+    from django.db import connections
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if settings_dict['ENGINE'] == 'django.db.backends.sqlite3' and not settings_dict['TEST'].get('NAME'):
+                settings_dict['TEST']['NAME'] = str(Path(tmpdir) / f'bench_{alias}.sqlite3')
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity, interactive=False)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity)
+            teardown_test_environment()
+
+
+@contextlib.contextmanager
+def clerk_signing_key(kid='bench'):
+    """Point CLERK_JWKS_URL at a temporary key and yield a ``mint(sub, **claims)`` function"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jose import jwk, jwt
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    public_jwk = jwk.construct(pem, 'RS256').public_key().to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+
+    def mint(sub, expires_in=3600, **claims):
+        now = int(time.time())
+        payload = {'sub': sub, 'iat': now, 'nbf': now, 'exp': now + expires_in, **claims}
+        return jwt.encode(payload, pem, algorithm='RS256', headers={'kid': kid})
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jwks_path = Path(tmpdir) / 'jwks.json'
+        jwks_path.write_text(json.dumps({'keys': [public_jwk]}))
+        with override_settings(CLERK_JWKS_URL=jwks_path.as_uri()):
+            yield mint
+
+
+def summarize(latencies, elapsed, **extra):
+    """Throughput and latency percentiles (milliseconds) for one benchmark run"""
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        **extra,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentiles[49] * 1000, 3),
+        'p99_ms': round(percentiles[98] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def write_report(command, results, as_json=False, columns=('rps', 'p50_ms', 'p99_ms')):
+    """Print ``results`` (a list of summarize() dicts with a 'name') as JSON or a table"""
+    if as_json:
+        command.stdout.write(json.dumps(results, indent=2))
+        return
+    width = max(len(result['name']) for result in results)
+    command.stdout.write('  '.join([f'{"benchmark":<{width}}', *(f'{column:>10}' for column in columns)]))
+    for result in results:
+        command.stdout.write('  '.join([f'{result["name"]:<{width}}', *(f'{result[column]:>10}' for column in columns)]))
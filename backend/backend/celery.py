@@ -0,0 +1,15 @@
+"""Celery application; tasks live in each app's ``tasks.py``.
+
+Run a worker with ``celery -A backend worker``. Without a broker configured
+tasks run inline (``CELERY_TASK_ALWAYS_EAGER``), so development and tests need
+no Redis.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+app = Celery('backend')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,139 @@
+"""Read-replica routing for read-only views.
+
+Views decorated with ``use_replica`` send their ORM reads to
+``DATABASE_REPLICA_ALIAS``; everything else, and every write, uses
+``default``. So that users always see their own writes, a request that wrote
+leaves a short-lived marker for its user (``DATABASE_REPLICA_STICKINESS``
+seconds, in the ``DATABASE_REPLICA_CACHE_ALIAS`` cache) and that user's reads
+stay on the primary until it expires.
+"""
+import contextvars
+import functools
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import LazyObject, empty
+
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+# {'wrote': bool} for the request being handled; mutated in place so writes
+# made in sync_to_async threads are seen by the async middleware
+_request_state = contextvars.ContextVar('replica_request_state', default=None)
+
+STICKY_KEY_PREFIX = 'replica:sticky:'
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == 'default'
+
+
+def _sticky_key(user):
+    return f'{STICKY_KEY_PREFIX}{user.pk}'
+
+
+def _resolved_user(request):
+    """``request.user`` if authentication already ran, without running it now"""
+    user = getattr(request, 'user', None)
+    if isinstance(user, LazyObject) and user._wrapped is empty:
+        return None
+    return user
+
+
+def _replica_for(request):
+    """The replica alias to read from for ``request``, or None for the primary"""
+    state = _request_state.get()
+    if state and state['wrote']:
+        return None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and caches[settings.DATABASE_REPLICA_CACHE_ALIAS].get(_sticky_key(user)):
+        return None
+    return settings.DATABASE_REPLICA_ALIAS
+
+
+async def _areplica_for(request):
+    state = _request_state.get()
+    if state and state['wrote']:
+        return None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and await caches[settings.DATABASE_REPLICA_CACHE_ALIAS].aget(_sticky_key(user)):
+        return None
+    return settings.DATABASE_REPLICA_ALIAS
+
+
+def use_replica(view):
+    """Route the ORM reads of a read-only view to the replica (apply below ``api_view``)"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not settings.DATABASE_REPLICA_ALIAS:
+                return await view(request, *args, **kwargs)
+            token = _read_alias.set(await _areplica_for(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICA_ALIAS:
+            return view(request, *args, **kwargs)
+        token = _read_alias.set(_replica_for(request))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+class ReplicaStickinessMiddleware:
+    """Marks users whose request wrote so their next reads use the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote'] and settings.DATABASE_REPLICA_ALIAS:
+            user = _resolved_user(request)
+            if user is not None and user.is_authenticated:
+                caches[settings.DATABASE_REPLICA_CACHE_ALIAS].set(_sticky_key(user), 1, settings.DATABASE_REPLICA_STICKINESS)
+        return response
+
+    async def __acall__(self, request):
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote'] and settings.DATABASE_REPLICA_ALIAS:
+            user = _resolved_user(request)
+            if user is not None and user.is_authenticated:
+                await caches[settings.DATABASE_REPLICA_CACHE_ALIAS].aset(_sticky_key(user), 1, settings.DATABASE_REPLICA_STICKINESS)
+        return response
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,11 +20,85 @@ CLERK_WEBHOOK_SECRET = os.getenv('CLERK_WEBHOOK_SECRET')
 CLERK_FRONTEND_API_URL = os.getenv('CLERK_FRONTEND_API_URL', 'clerk.dev')
 CLERK_FRONTEND_API_KEY = os.getenv('CLERK_FRONTEND_API_KEY')
 
+# Clerk JWT verification. The JWKS URL may also be a file:// URL or local path.
+CLERK_JWKS_URL = os.getenv('CLERK_JWKS_URL') or (
+    CLERK_FRONTEND_API_URL if CLERK_FRONTEND_API_URL.startswith('http') else f'https://{CLERK_FRONTEND_API_URL}'
+).rstrip('/') + '/.well-known/jwks.json'
+CLERK_JWKS_REFRESH_INTERVAL = int(os.getenv('CLERK_JWKS_REFRESH_INTERVAL', '3600'))  # seconds
+CLERK_JWKS_MIN_REFETCH_INTERVAL = int(os.getenv('CLERK_JWKS_MIN_REFETCH_INTERVAL', '30'))  # seconds
+CLERK_JWT_ALGORITHMS = ['RS256']
+CLERK_JWT_LEEWAY = int(os.getenv('CLERK_JWT_LEEWAY', '5'))  # seconds
+CLERK_AUTHORIZED_PARTIES = [p for p in os.getenv('CLERK_AUTHORIZED_PARTIES', '').split(',') if p]
+CLERK_VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('CLERK_VERIFIED_TOKEN_CACHE_SIZE', '1024'))
+# How often coalesced users.last_synced_at touches are flushed, in seconds
+CLERK_LAST_SYNCED_FLUSH_INTERVAL = int(os.getenv('CLERK_LAST_SYNCED_FLUSH_INTERVAL', '60'))
+# clerk_id -> user cache. Without an alias it is a per-process LRU; name a
+# shared cache in CACHES to share entries and webhook invalidations. A shared
+# cache is required once Celery workers run out of process (check
+# authentication.E001), and whenever process_clerk_webhooks or
+# sync_clerk_users run as separate commands, since they invalidate entries too.
+CLERK_IDENTITY_CACHE_TTL = int(os.getenv('CLERK_IDENTITY_CACHE_TTL', '60'))  # seconds
+CLERK_IDENTITY_CACHE_SIZE = int(os.getenv('CLERK_IDENTITY_CACHE_SIZE', '10000'))
+CLERK_IDENTITY_CACHE_ALIAS = os.getenv('CLERK_IDENTITY_CACHE_ALIAS') or None
+# Clerk Backend API client (authentication/clerk_api.py): pooled keep-alive
+# connections, per-request timeouts in seconds and up to MAX_RETRIES retries of
+# transient failures. After BREAKER_THRESHOLD consecutive failed calls it fails
+# fast for BREAKER_RESET_TIMEOUT seconds. CLERK_API_URL overrides the API base URL.
+CLERK_API_URL = os.getenv('CLERK_API_URL') or None
+CLERK_API_CONNECT_TIMEOUT = float(os.getenv('CLERK_API_CONNECT_TIMEOUT', '2'))
+CLERK_API_READ_TIMEOUT = float(os.getenv('CLERK_API_READ_TIMEOUT', '5'))
+CLERK_API_POOL_SIZE = int(os.getenv('CLERK_API_POOL_SIZE', '10'))
+CLERK_API_MAX_RETRIES = int(os.getenv('CLERK_API_MAX_RETRIES', '2'))
+CLERK_API_BREAKER_THRESHOLD = int(os.getenv('CLERK_API_BREAKER_THRESHOLD', '5'))
+CLERK_API_BREAKER_RESET_TIMEOUT = int(os.getenv('CLERK_API_BREAKER_RESET_TIMEOUT', '30'))
+
 
 # WebAuthn Configuration
 WEBAUTHN_RP_ID = os.getenv('WEBAUTHN_RP_ID', 'localhost')
 WEBAUTHN_RP_NAME = os.getenv('WEBAUTHN_RP_NAME', 'My App')
 WEBAUTHN_ORIGIN = os.getenv('WEBAUTHN_ORIGIN', 'http://localhost:3000')
+# Challenge store: DatabaseChallengeStore, LocalMemoryChallengeStore (single
+# process only) or CacheChallengeStore (uses WEBAUTHN_CHALLENGE_CACHE_ALIAS)
+WEBAUTHN_CHALLENGE_STORE = os.getenv('WEBAUTHN_CHALLENGE_STORE', 'webauthn_mfa.challenges.DatabaseChallengeStore')
+WEBAUTHN_CHALLENGE_CACHE_ALIAS = os.getenv('WEBAUTHN_CHALLENGE_CACHE_ALIAS', 'default')
+WEBAUTHN_CHALLENGE_TIMEOUT = int(os.getenv('WEBAUTHN_CHALLENGE_TIMEOUT', '300'))  # seconds
+# How often batched webauthn_credentials.last_used_at touches are flushed, in seconds
+WEBAUTHN_LAST_USED_FLUSH_INTERVAL = int(os.getenv('WEBAUTHN_LAST_USED_FLUSH_INTERVAL', '60'))
+# Cached per-user allowCredentials/excludeCredentials lists
+WEBAUTHN_DESCRIPTOR_CACHE_ALIAS = os.getenv('WEBAUTHN_DESCRIPTOR_CACHE_ALIAS', 'default')
+WEBAUTHN_DESCRIPTOR_CACHE_TIMEOUT = int(os.getenv('WEBAUTHN_DESCRIPTOR_CACHE_TIMEOUT', '300'))  # seconds
+# Where registration/assertion verification runs: 'inline', 'thread' or 'process'.
+# Pooled modes run at most POOL_SIZE at once, queue QUEUE_DEPTH more and
+# reject the rest with 503.
+WEBAUTHN_VERIFY_MODE = os.getenv('WEBAUTHN_VERIFY_MODE', 'inline')
+WEBAUTHN_VERIFY_POOL_SIZE = int(os.getenv('WEBAUTHN_VERIFY_POOL_SIZE', '4'))
+WEBAUTHN_VERIFY_QUEUE_DEPTH = int(os.getenv('WEBAUTHN_VERIFY_QUEUE_DEPTH', '16'))
+WEBAUTHN_VERIFY_TIMEOUT = int(os.getenv('WEBAUTHN_VERIFY_TIMEOUT', '10'))  # seconds
+
+# Where admin WebAuthn verification is remembered: 'session', or 'cookie' for a
+# signed, user-bound cookie that admin page views check without a session read.
+# Cookies revoked at logout are tracked in the REVOCATION_CACHE_ALIAS cache.
+ADMIN_MFA_STORAGE = os.getenv('ADMIN_MFA_STORAGE', 'session')
+ADMIN_MFA_MAX_AGE = int(os.getenv('ADMIN_MFA_MAX_AGE', '1800'))  # seconds
+ADMIN_MFA_COOKIE_NAME = os.getenv('ADMIN_MFA_COOKIE_NAME', 'admin_mfa')
+ADMIN_MFA_REVOCATION_CACHE_ALIAS = os.getenv('ADMIN_MFA_REVOCATION_CACHE_ALIAS', 'default')
+
+# Transfers retry serialization failures/deadlocks this many times, sleeping a
+# random share of BACKOFF * 2**attempt (capped at MAX_BACKOFF) seconds between tries
+LEDGER_TRANSFER_MAX_RETRIES = int(os.getenv('LEDGER_TRANSFER_MAX_RETRIES', '5'))
+LEDGER_TRANSFER_BACKOFF = float(os.getenv('LEDGER_TRANSFER_BACKOFF', '0.005'))  # seconds
+LEDGER_TRANSFER_MAX_BACKOFF = float(os.getenv('LEDGER_TRANSFER_MAX_BACKOFF', '0.2'))  # seconds
+# Idempotency-Key responses of POST /transfers/. Without an alias they live in a
+# per-process LRU of MAX_KEYS; name a shared cache in CACHES when several
+# processes serve the API. Duplicates of a running request wait up to WAIT_TIMEOUT.
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_CACHE_ALIAS = os.getenv('IDEMPOTENCY_CACHE_ALIAS') or None
+IDEMPOTENCY_WAIT_TIMEOUT = int(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', '10'))  # seconds
+
+# Route the auth and WebAuthn endpoints to their native async views; enable
+# when serving backend.asgi with uvicorn/daphne
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -38,11 +113,14 @@ INSTALLED_APPS = [
     
     'authentication',
     'webauthn_mfa',
+    'api',
 ]
 
 MIDDLEWARE = [
+    'backend.statement_timeout.StatementTimeoutMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'backend.replicas.ReplicaStickinessMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,25 +144,76 @@ ROOT_URLCONF = 'backend.urls'
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
-# Database
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': os.getenv('DB_NAME'),
-#         'USER': os.getenv('DB_USER'),
-#         'PASSWORD': os.getenv('DB_PASSWORD'),
-#         'HOST': os.getenv('DB_HOST', 'localhost'),
-#         'PORT': os.getenv('DB_PORT', '5432'),
-#     }
-# }
-
-# Database (sqlite for simplicity in development)
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database: SQLite for development, DB_ENGINE=postgresql for production.
+# Postgres connections are kept for DB_CONN_MAX_AGE seconds and checked before
+# reuse, or with DB_POOL=True borrowed from a psycopg 3 pool instead (the two
+# are mutually exclusive). Streaming queries (.iterator()) use server-side
+# cursors unless DB_DISABLE_SERVER_SIDE_CURSORS=True, which PgBouncer in
+# transaction pooling mode requires.
+if os.getenv('DB_ENGINE', 'sqlite') == 'postgresql':
+    DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '60')),  # seconds
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', 'False') == 'True',
+            'OPTIONS': {},
+        }
     }
-}
+    if DB_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),  # seconds to wait for a free connection
+        }
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv('DB_REPLICA_HOST'),
+            'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),  # seconds
+        }
+    }
+    # A second connection to the same file, so replica routing can be exercised locally and in tests
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    # The INCLUDE columns of api's ledger_entry_history index only matter on
+    # PostgreSQL (index-only history pages); SQLite builds the index without them
+    SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Web requests only: PostgreSQL connections opened while handling a request
+# cancel statements running longer than this (0 disables). Management
+# commands and workers keep the server default; see backend.statement_timeout.
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', '5000'))  # milliseconds
+
+# Read replica: views decorated with backend.replicas.use_replica read from
+# DATABASE_REPLICA_ALIAS when it is set (DB_REPLICA_HOST defines the 'replica'
+# alias on PostgreSQL). A user who wrote reads from the primary for the next
+# STICKINESS seconds, tracked in CACHE_ALIAS; use a shared cache with several processes.
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+DATABASE_REPLICA_ALIAS = os.getenv('DB_REPLICA_ALIAS') or None
+DATABASE_REPLICA_STICKINESS = int(os.getenv('DB_REPLICA_STICKINESS', '5'))  # seconds
+DATABASE_REPLICA_CACHE_ALIAS = os.getenv('DB_REPLICA_CACHE_ALIAS', 'default')
+
+# Opt-in SQLite profile for small deployments (DB_SQLITE_TUNED=True): every new
+# connection gets WAL (readers and the writer stop blocking each other),
+# synchronous=NORMAL, a busy timeout and memory-mapped reads. Write paths use
+# backend.sqlite.write_atomic, which begins with BEGIN IMMEDIATE on this profile.
+SQLITE_TUNED = os.getenv('DB_SQLITE_TUNED', 'False') == 'True'
+SQLITE_BUSY_TIMEOUT = int(os.getenv('DB_SQLITE_BUSY_TIMEOUT', '5000'))  # milliseconds
+SQLITE_MMAP_SIZE = int(os.getenv('DB_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
 
 # Templates
 TEMPLATES = [
@@ -123,10 +252,20 @@ REST_FRAMEWORK = {
 # CORS
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000').split(',')
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
-# Celery Configuration
-CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Celery Configuration (backend/celery.py). Without CELERY_BROKER_URL or REDIS_URL
+# tasks run eagerly in the calling process on the in-memory transport, so
+# development and tests need no Redis. Webhook deliveries then queue no drain
+# (it would run inside the request): run manage.py process_clerk_webhooks --loop. CELERY_TASK_ALWAYS_EAGER=False with
+# CELERY_BROKER_URL=memory:// queues them for a worker in the same process
+# (e.g. celery.contrib.testing.worker.start_worker).
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL') or os.getenv('REDIS_URL') or 'memory://'
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND') or os.getenv('REDIS_URL') or 'cache+memory://'
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', str(CELERY_BROKER_URL == 'memory://')) == 'True'
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_IGNORE_RESULT = True
 
 
 # Internationalization
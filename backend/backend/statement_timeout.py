@@ -0,0 +1,52 @@
+"""PostgreSQL statement timeout for web requests only (``DB_STATEMENT_TIMEOUT``).
+
+Connections opened while ``StatementTimeoutMiddleware`` handles a request
+get ``SET statement_timeout``; connections opened anywhere else (migrate,
+check_ledger, sync_clerk_users, Celery workers) keep the server default, so
+long maintenance statements are not cancelled. A persistent connection keeps
+the setting for the requests that reuse it.
+"""
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_in_request = contextvars.ContextVar('statement_timeout_in_request', default=False)
+
+
+class StatementTimeoutMiddleware:
+    """Marks the request so the connections it opens get the statement timeout"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _in_request.set(True)
+        try:
+            return self.get_response(request)
+        finally:
+            _in_request.reset(token)
+
+    async def __acall__(self, request):
+        token = _in_request.set(True)
+        try:
+            return await self.get_response(request)
+        finally:
+            _in_request.reset(token)
+
+
+@receiver(connection_created)
+def set_statement_timeout(sender, connection, **kwargs):
+    if connection.vendor != 'postgresql' or not settings.DB_STATEMENT_TIMEOUT or not _in_request.get():
+        return
+    # Straight on the psycopg connection so the SET stays out of query logs and counts
+    with connection.connection.cursor() as cursor:
+        cursor.execute(f'SET statement_timeout = {int(settings.DB_STATEMENT_TIMEOUT)}')
@@ -0,0 +1,206 @@
+"""Async counterparts of ``views`` for ASGI deployments (``ASYNC_VIEWS=True``).
+
+Request and response shapes match the sync views. Database access goes
+through the async ORM, challenges and descriptors through the async cache
+API, and signature verification is awaited on the verification pool, so a
+single event loop can keep many ceremonies in flight.
+"""
+import asyncio
+import base64
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+
+from authentication import mfa
+from authentication.async_api import async_api_view
+from backend.replicas import use_replica
+from .challenges import challenge_from_client_data, get_challenge_store
+from .descriptors import aget_credential_descriptors
+from .executor import VerificationPoolSaturated, get_verification_pool
+from .models import WebAuthnCredential
+from .serializers import WebAuthnCredentialSerializer
+from .views import (
+    authentication_credential,
+    is_verified,
+    last_used_touches,
+    registration_credential,
+    registration_options,
+)
+
+
+def error(message, status_code=status.HTTP_400_BAD_REQUEST, **kwargs):
+    return JsonResponse({'error': message}, status=status_code, **kwargs)
+
+
+def pool_saturated(exc):
+    return error(str(exc), status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
+
+@async_api_view(['GET'])
+@use_replica
+async def user_devices(request, user_id):
+    devices = [device async for device in WebAuthnCredential.objects.filter(user=request.user)]
+    return JsonResponse({
+        'devices': WebAuthnCredentialSerializer(devices, many=True).data,
+        'count': len(devices),
+    })
+
+
+@async_api_view(['DELETE'])
+async def delete_device(request, device_id):
+    try:
+        device = await aget_object_or_404(WebAuthnCredential, id=device_id, user=request.user)
+    except Http404:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    await device.adelete()
+    return JsonResponse({'message': 'Device deleted successfully'})
+
+
+@async_api_view(['POST'])
+async def register_begin(request):
+    user = request.user
+    username = request.data.get('username', user.email)
+    display_name = request.data.get('displayName', f"{user.first_name} {user.last_name}".strip() or user.email)
+
+    challenge = await get_challenge_store().aissue(user, 'register')
+    exclude_credentials = await aget_credential_descriptors(user)
+    return JsonResponse(registration_options(user, challenge, username, display_name, exclude_credentials))
+
+
+@async_api_view(['POST'])
+async def register_complete(request):
+    from webauthn import verify_registration_response
+
+    user = request.user
+    credential_data = request.data.get('credential')
+    key_name = request.data.get('keyName', 'Security Key')
+
+    if not credential_data:
+        return error('Missing credential data')
+
+    try:
+        client_data_json = bytes(credential_data['response']['clientDataJSON'])
+        challenge = challenge_from_client_data(client_data_json)
+    except Exception:
+        return error('Invalid client data')
+
+    if not await get_challenge_store().aconsume(user, 'register', challenge):
+        return error('No valid challenge found')
+
+    try:
+        verification = await get_verification_pool().arun(
+            verify_registration_response,
+            credential=registration_credential(credential_data, client_data_json),
+            expected_challenge=challenge.encode(),
+            expected_origin=settings.WEBAUTHN_ORIGIN,
+            expected_rp_id=settings.WEBAUTHN_RP_ID,
+        )
+        webauthn_credential = await WebAuthnCredential.objects.acreate(
+            user=user,
+            credential_id=base64.b64encode(verification.credential_id).decode('utf-8'),
+            raw_id=verification.credential_id,
+            public_key=base64.b64encode(verification.credential_public_key).decode('utf-8'),
+            sign_count=verification.sign_count,
+            name=key_name,
+        )
+    except VerificationPoolSaturated as e:
+        return pool_saturated(e)
+    except (TimeoutError, asyncio.TimeoutError):
+        return pool_saturated('WebAuthn verification timed out')
+    except Exception as e:
+        return error(f'Registration failed: {str(e)}')
+
+    return JsonResponse({
+        'verified': True,
+        'credential': WebAuthnCredentialSerializer(webauthn_credential).data,
+    })
+
+
+@async_api_view(['POST'])
+async def authenticate_begin(request):
+    user = request.user
+    allow_credentials = await aget_credential_descriptors(user)
+    if not allow_credentials:
+        return error('No WebAuthn credentials registered')
+
+    challenge = await get_challenge_store().aissue(user, 'verify')
+    return JsonResponse({
+        'challenge': list(challenge.encode()),
+        'timeout': 60000,
+        'rpId': settings.WEBAUTHN_RP_ID,
+        'allowCredentials': allow_credentials,
+        'userVerification': 'preferred',
+    })
+
+
+@async_api_view(['POST'])
+async def authenticate_complete(request):
+    from webauthn import verify_authentication_response
+
+    user = request.user
+    assertion_data = request.data.get('assertion')
+
+    if not assertion_data:
+        return error('Missing assertion data')
+    if not assertion_data.get('id'):
+        return error('Missing credential ID')
+
+    try:
+        client_data_json = bytes(assertion_data['response']['clientDataJSON'])
+        challenge = challenge_from_client_data(client_data_json)
+    except Exception:
+        return error('Invalid client data')
+
+    if not await get_challenge_store().aconsume(user, 'verify', challenge):
+        return error('No valid challenge found')
+
+    try:
+        raw_id = bytes(assertion_data['rawId'])
+        credential = await WebAuthnCredential.objects.only('public_key', 'sign_count', 'last_used_at').aget(user=user, raw_id=raw_id)
+    except (KeyError, TypeError, ValueError):
+        return error('Missing credential ID')
+    except WebAuthnCredential.DoesNotExist:
+        return error('Credential not found', status.HTTP_404_NOT_FOUND)
+
+    try:
+        verification = await get_verification_pool().arun(
+            verify_authentication_response,
+            credential=authentication_credential(assertion_data, raw_id, client_data_json),
+            expected_challenge=challenge.encode(),
+            expected_origin=settings.WEBAUTHN_ORIGIN,
+            expected_rp_id=settings.WEBAUTHN_RP_ID,
+            credential_public_key=base64.b64decode(credential.public_key),
+            credential_current_sign_count=credential.sign_count,
+        )
+        if not is_verified(verification):
+            return error('Authentication verification failed')
+        if not await credential.aadvance_sign_count(verification.new_sign_count):
+            return error('Sign count did not increase; possible cloned authenticator')
+    except VerificationPoolSaturated as e:
+        return pool_saturated(e)
+    except (TimeoutError, asyncio.TimeoutError):
+        return pool_saturated('WebAuthn verification timed out')
+    except Exception as e:
+        return error(f'Authentication failed: {str(e)}')
+
+    # Only queues the pk in memory; the batched UPDATE runs after the response
+    last_used_touches.touch(credential)
+
+    response_data = {
+        'verified': True,
+        'message': 'Authentication successful',
+    }
+    redirect_url = await request.session.apop('admin_redirect_url', None)
+    if redirect_url:
+        response_data['redirect_url'] = redirect_url
+    response = JsonResponse(response_data)
+    await mfa.amark_verified(request, response, user)
+    return response
+
+
+@async_api_view(['GET'], permission_classes=[IsAdminUser])
+async def verification_pool_stats(request):
+    return JsonResponse(get_verification_pool().stats())
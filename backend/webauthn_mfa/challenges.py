@@ -0,0 +1,191 @@
+import base64
+import json
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import WebAuthnChallenge
+
+
+def generate_challenge():
+    return base64.urlsafe_b64encode(secrets.token_bytes(32)).decode('utf-8').rstrip('=')
+
+
+def challenge_from_client_data(client_data_json):
+    """Extract the challenge string the browser signed from clientDataJSON bytes"""
+    encoded = json.loads(client_data_json)['challenge']
+    return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+
+
+class BaseChallengeStore:
+    """Issues WebAuthn challenges and consumes each one at most once.
+
+    Challenges are keyed by their value together with the user and ceremony
+    type, so a user may have several ceremonies in flight (e.g. multiple tabs).
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def issue(self, user, challenge_type):
+        challenge = generate_challenge()
+        self.save(user.pk, challenge_type, challenge)
+        return challenge
+
+    async def aissue(self, user, challenge_type):
+        challenge = generate_challenge()
+        await self.asave(user.pk, challenge_type, challenge)
+        return challenge
+
+    def save(self, user_id, challenge_type, challenge):
+        raise NotImplementedError
+
+    async def asave(self, user_id, challenge_type, challenge):
+        return self.save(user_id, challenge_type, challenge)
+
+    def consume(self, user, challenge_type, challenge):
+        """Atomically delete an unexpired challenge; True if it was valid"""
+        raise NotImplementedError
+
+    async def aconsume(self, user, challenge_type, challenge):
+        return self.consume(user, challenge_type, challenge)
+
+
+class DatabaseChallengeStore(BaseChallengeStore):
+    """Stores challenges in WebAuthnChallenge rows; works across processes without a shared cache"""
+
+    purge_interval = 60
+
+    def __init__(self, timeout):
+        super().__init__(timeout)
+        self._last_purge = 0
+
+    def save(self, user_id, challenge_type, challenge):
+        now = timezone.now()
+        WebAuthnChallenge.objects.create(
+            user_id=user_id,
+            challenge=challenge,
+            challenge_type=challenge_type,
+            expires_at=now + timedelta(seconds=self.timeout),
+        )
+        if self._purge_due():
+            WebAuthnChallenge.objects.filter(expires_at__lte=now).delete()
+
+    async def asave(self, user_id, challenge_type, challenge):
+        now = timezone.now()
+        await WebAuthnChallenge.objects.acreate(
+            user_id=user_id,
+            challenge=challenge,
+            challenge_type=challenge_type,
+            expires_at=now + timedelta(seconds=self.timeout),
+        )
+        if self._purge_due():
+            await WebAuthnChallenge.objects.filter(expires_at__lte=now).adelete()
+
+    def _purge_due(self):
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self._last_purge = time.monotonic()
+            return True
+        return False
+
+    def _unexpired(self, user, challenge_type, challenge):
+        return WebAuthnChallenge.objects.filter(
+            user=user,
+            challenge=challenge,
+            challenge_type=challenge_type,
+            expires_at__gt=timezone.now(),
+        )
+
+    def consume(self, user, challenge_type, challenge):
+        deleted, _ = self._unexpired(user, challenge_type, challenge).delete()
+        return deleted > 0
+
+    async def aconsume(self, user, challenge_type, challenge):
+        deleted, _ = await self._unexpired(user, challenge_type, challenge).adelete()
+        return deleted > 0
+
+
+class LocalMemoryChallengeStore(BaseChallengeStore):
+    """Per-process store; only suitable for a single worker process"""
+
+    purge_interval = 60
+
+    def __init__(self, timeout):
+        super().__init__(timeout)
+        self._challenges = {}
+        self._last_purge = 0
+        self._lock = threading.Lock()
+
+    def save(self, user_id, challenge_type, challenge):
+        now = time.monotonic()
+        with self._lock:
+            self._challenges[(user_id, challenge_type, challenge)] = now + self.timeout
+            # Expired entries are rejected by consume() anyway; sweep them at most once per interval
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                for key in [key for key, expires_at in self._challenges.items() if expires_at <= now]:
+                    del self._challenges[key]
+
+    def consume(self, user, challenge_type, challenge):
+        with self._lock:
+            expires_at = self._challenges.pop((user.pk, challenge_type, challenge), None)
+        return expires_at is not None and expires_at > time.monotonic()
+
+
+class CacheChallengeStore(BaseChallengeStore):
+    """Stores challenges in a Django cache, relying on its TTL for expiry"""
+
+    key_prefix = 'webauthn:challenge:'
+
+    @property
+    def cache(self):
+        return caches[settings.WEBAUTHN_CHALLENGE_CACHE_ALIAS]
+
+    def key(self, user_id, challenge_type, challenge):
+        return f'{self.key_prefix}{challenge_type}:{user_id}:{challenge}'
+
+    def save(self, user_id, challenge_type, challenge):
+        self.cache.set(self.key(user_id, challenge_type, challenge), 1, self.timeout)
+
+    def consume(self, user, challenge_type, challenge):
+        key = self.key(user.pk, challenge_type, challenge)
+        # get() honours expiry on every backend; delete() reports whether this
+        # caller removed the key, so only one concurrent consumer can win
+        if self.cache.get(key) is None:
+            return False
+        return self.cache.delete(key)
+
+    async def asave(self, user_id, challenge_type, challenge):
+        await self.cache.aset(self.key(user_id, challenge_type, challenge), 1, self.timeout)
+
+    async def aconsume(self, user, challenge_type, challenge):
+        key = self.key(user.pk, challenge_type, challenge)
+        if await self.cache.aget(key) is None:
+            return False
+        return await self.cache.adelete(key)
+
+
+_store = None
+
+
+def get_challenge_store():
+    global _store
+    if _store is None:
+        store_class = import_string(settings.WEBAUTHN_CHALLENGE_STORE)
+        _store = store_class(settings.WEBAUTHN_CHALLENGE_TIMEOUT)
+    return _store
+
+
+@receiver(setting_changed)
+def reset_challenge_store(*, setting, **kwargs):
+    global _store
+    if setting.startswith('WEBAUTHN_CHALLENGE_'):
+        _store = None
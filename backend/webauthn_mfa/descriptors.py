@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import WebAuthnCredential
+
+KEY_PREFIX = 'webauthn:descriptors:'
+
+
+def get_credential_descriptors(user):
+    """Return the user's credentials as ready-to-serve ``{'id', 'type'}`` descriptors.
+
+    The list is built once and cached until a credential of the user is saved
+    or deleted, so the begin endpoints normally run no credential query. With
+    the default per-process cache another worker may serve a stale list for up
+    to WEBAUTHN_DESCRIPTOR_CACHE_TIMEOUT seconds; use a shared cache in
+    production.
+    """
+    cache = caches[settings.WEBAUTHN_DESCRIPTOR_CACHE_ALIAS]
+    key = f'{KEY_PREFIX}{user.pk}'
+    descriptors = cache.get(key)
+    if descriptors is None:
+        descriptors = [
+            {'id': list(bytes(raw_id)), 'type': 'public-key'}
+            for raw_id in WebAuthnCredential.objects.filter(user=user).values_list('raw_id', flat=True)
+        ]
+        cache.set(key, descriptors, settings.WEBAUTHN_DESCRIPTOR_CACHE_TIMEOUT)
+    return descriptors
+
+
+async def aget_credential_descriptors(user):
+    cache = caches[settings.WEBAUTHN_DESCRIPTOR_CACHE_ALIAS]
+    key = f'{KEY_PREFIX}{user.pk}'
+    descriptors = await cache.aget(key)
+    if descriptors is None:
+        descriptors = [
+            {'id': list(bytes(raw_id)), 'type': 'public-key'}
+            async for raw_id in WebAuthnCredential.objects.filter(user=user).values_list('raw_id', flat=True)
+        ]
+        await cache.aset(key, descriptors, settings.WEBAUTHN_DESCRIPTOR_CACHE_TIMEOUT)
+    return descriptors
+
+
+def invalidate_credential_descriptors(user_id):
+    caches[settings.WEBAUTHN_DESCRIPTOR_CACHE_ALIAS].delete(f'{KEY_PREFIX}{user_id}')
+
+
+@receiver(post_save, sender=WebAuthnCredential)
+@receiver(post_delete, sender=WebAuthnCredential)
+def credential_changed(sender, instance, **kwargs):
+    """Covers register_complete, delete_device, the admin and cascading user deletes"""
+    invalidate_credential_descriptors(instance.user_id)
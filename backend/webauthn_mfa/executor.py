@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class VerificationPoolSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+class VerificationPool:
+    """Runs WebAuthn verification on a bounded thread or process pool.
+
+    At most ``max_workers`` verifications run at once and ``queue_depth`` more
+    may wait; anything beyond that is rejected immediately, so a burst of MFA
+    ceremonies fails fast instead of tying up every request worker. In
+    ``inline`` mode the function runs in the calling thread as before.
+    """
+
+    def __init__(self, mode='inline', max_workers=4, queue_depth=16, timeout=10):
+        if mode not in ('inline', 'thread', 'process'):
+            raise ValueError(f'Unknown verification mode: {mode}')
+        self.mode = mode
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            executor_class = ProcessPoolExecutor if self.mode == 'process' else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=self.max_workers)
+        return self._executor
+
+    def run(self, fn, **kwargs):
+        if self.mode == 'inline':
+            return fn(**kwargs)
+
+        future = self.submit(fn, **kwargs)
+        return future.result(timeout=self.timeout)
+
+    async def arun(self, fn, **kwargs):
+        """Await ``fn`` on the pool without blocking the event loop"""
+        if self.mode == 'inline':
+            return fn(**kwargs)
+
+        future = self.submit(fn, **kwargs)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def submit(self, fn, **kwargs):
+        """Queue ``fn`` on the pool and return its future, or raise if saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise VerificationPoolSaturated('Too many WebAuthn verifications in progress')
+
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            future = self.executor.submit(fn, **kwargs)
+        except Exception:
+            self._release(failed=True)
+            raise
+        # arun() cancels futures that are still queued when it times out
+        future.add_done_callback(lambda f: self._release(failed=f.cancelled() or f.exception() is not None))
+        return future
+
+    def _release(self, failed):
+        with self._lock:
+            self._in_flight -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+            return {
+                'mode': self.mode,
+                'max_workers': self.max_workers,
+                'queue_depth': self.queue_depth,
+                'in_flight': in_flight,
+                'running': min(in_flight, self.max_workers),
+                'queued': max(in_flight - self.max_workers, 0),
+                'peak_in_flight': self._peak_in_flight,
+                'saturation': in_flight / (self.max_workers + self.queue_depth),
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_pool = None
+
+
+def get_verification_pool():
+    global _pool
+    if _pool is None:
+        _pool = VerificationPool(
+            mode=settings.WEBAUTHN_VERIFY_MODE,
+            max_workers=settings.WEBAUTHN_VERIFY_POOL_SIZE,
+            queue_depth=settings.WEBAUTHN_VERIFY_QUEUE_DEPTH,
+            timeout=settings.WEBAUTHN_VERIFY_TIMEOUT,
+        )
+    return _pool
+
+
+@receiver(setting_changed)
+def reset_verification_pool(*, setting, **kwargs):
+    global _pool
+    if setting.startswith('WEBAUTHN_VERIFY_') and _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:10
+
+import base64
+
+from django.db import migrations, models
+
+
+def backfill_raw_id(apps, schema_editor):
+    WebAuthnCredential = apps.get_model('webauthn_mfa', 'WebAuthnCredential')
+    batch = []
+    for credential in WebAuthnCredential.objects.only('id', 'credential_id').iterator(chunk_size=1000):
+        credential_id = credential.credential_id
+        credential.raw_id = base64.b64decode(credential_id + '=' * (-len(credential_id) % 4))
+        batch.append(credential)
+        if len(batch) >= 1000:
+            WebAuthnCredential.objects.bulk_update(batch, ['raw_id'])
+            batch = []
+    if batch:
+        WebAuthnCredential.objects.bulk_update(batch, ['raw_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webauthn_mfa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webauthncredential',
+            name='raw_id',
+            field=models.BinaryField(max_length=1023, null=True),
+        ),
+        migrations.RunPython(backfill_raw_id, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='webauthncredential',
+            name='raw_id',
+            field=models.BinaryField(max_length=1023, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='webauthncredential',
+            name='credential_id',
+            field=models.CharField(max_length=255),
+        ),
+    ]
@@ -4,7 +4,9 @@ import json
 
 class WebAuthnCredential(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='webauthn_credentials')
-    credential_id = models.CharField(max_length=255, unique=True, db_index=True)
+    # Base64 form kept for display; lookups use the indexed raw bytes
+    credential_id = models.CharField(max_length=255)
+    raw_id = models.BinaryField(max_length=1023, unique=True)
     public_key = models.TextField()
     sign_count = models.IntegerField(default=0)
     device_type = models.CharField(max_length=50, blank=True)
@@ -15,6 +17,36 @@ class WebAuthnCredential(models.Model):
     class Meta:
         db_table = 'webauthn_credentials'
         ordering = ['-created_at']
+    
+    def advance_sign_count(self, new_sign_count):
+        """Compare-and-set the signature counter in a single UPDATE.
+        
+        Returns False when the stored counter is already at or past
+        ``new_sign_count``, which means a concurrent or replayed assertion from
+        a possibly cloned authenticator. Authenticators that always report 0
+        have no counter to advance.
+        """
+        if new_sign_count == 0 and self.sign_count == 0:
+            return True
+        updated = WebAuthnCredential.objects.filter(
+            pk=self.pk,
+            sign_count__lt=new_sign_count,
+        ).update(sign_count=new_sign_count)
+        if updated:
+            self.sign_count = new_sign_count
+        return bool(updated)
+    
+    async def aadvance_sign_count(self, new_sign_count):
+        """Async counterpart of advance_sign_count()"""
+        if new_sign_count == 0 and self.sign_count == 0:
+            return True
+        updated = await WebAuthnCredential.objects.filter(
+            pk=self.pk,
+            sign_count__lt=new_sign_count,
+        ).aupdate(sign_count=new_sign_count)
+        if updated:
+            self.sign_count = new_sign_count
+        return bool(updated)
 
 class WebAuthnChallenge(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
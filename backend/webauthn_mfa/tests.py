@@ -1,3 +1,512 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import os
+import struct
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.identity_cache import identity_cache
+from authentication.tests import JWKSTestMixin
+from . import async_views
+from .challenges import (
+    CacheChallengeStore,
+    DatabaseChallengeStore,
+    LocalMemoryChallengeStore,
+    get_challenge_store,
+)
+from .executor import VerificationPool, VerificationPoolSaturated
+from .models import WebAuthnChallenge, WebAuthnCredential
+from .views import last_used_touches
+
+User = get_user_model()
+
+# URLconf for the async view tests; ASYNC_VIEWS is read once at import time
+urlpatterns = [
+    path('api/v1/webauthn/register/begin', async_views.register_begin),
+    path('api/v1/webauthn/register/complete', async_views.register_complete),
+    path('api/v1/webauthn/authenticate/begin', async_views.authenticate_begin),
+    path('api/v1/webauthn/authenticate/complete', async_views.authenticate_complete),
+    path('api/v1/webauthn/user/<str:user_id>/devices', async_views.user_devices),
+    path('api/v1/webauthn/device/<int:device_id>', async_views.delete_device),
+]
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+class SoftAuthenticator:
+    """Minimal ES256 authenticator producing 'none' attestations and assertions"""
+
+    def __init__(self):
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.credential_id = os.urandom(32)
+        self.sign_count = 0
+
+    def client_data(self, ceremony, challenge):
+        return json.dumps({
+            'type': ceremony,
+            'challenge': b64url(bytes(challenge)),
+            'origin': settings.WEBAUTHN_ORIGIN,
+            'crossOrigin': False,
+        }).encode()
+
+    def auth_data(self, flags, attested=b''):
+        rp_id_hash = hashlib.sha256(settings.WEBAUTHN_RP_ID.encode()).digest()
+        return rp_id_hash + bytes([flags]) + struct.pack('>I', self.sign_count) + attested
+
+    def register(self, options):
+        numbers = self.private_key.public_key().public_numbers()
+        cose_key = cbor2.dumps({1: 2, 3: -7, -1: 1, -2: numbers.x.to_bytes(32, 'big'), -3: numbers.y.to_bytes(32, 'big')})
+        attested = bytes(16) + struct.pack('>H', len(self.credential_id)) + self.credential_id + cose_key
+        attestation = cbor2.dumps({'fmt': 'none', 'attStmt': {}, 'authData': self.auth_data(0x41, attested)})
+        return {
+            'id': b64url(self.credential_id),
+            'rawId': list(self.credential_id),
+            'type': 'public-key',
+            'response': {
+                'attestationObject': list(attestation),
+                'clientDataJSON': list(self.client_data('webauthn.create', options['challenge'])),
+            },
+        }
+
+    def assert_(self, options):
+        self.sign_count += 1
+        auth_data = self.auth_data(0x01)
+        client_data = self.client_data('webauthn.get', options['challenge'])
+        signature = self.private_key.sign(auth_data + hashlib.sha256(client_data).digest(), ec.ECDSA(hashes.SHA256()))
+        return {
+            'id': b64url(self.credential_id),
+            'rawId': list(self.credential_id),
+            'type': 'public-key',
+            'response': {
+                'authenticatorData': list(auth_data),
+                'clientDataJSON': list(client_data),
+                'signature': list(signature),
+                'userHandle': None,
+            },
+        }
+
+
+class WebAuthnTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.authenticator = SoftAuthenticator()
+
+    def register(self, authenticator=None):
+        authenticator = authenticator or self.authenticator
+        options = self.client.post('/api/v1/webauthn/register/begin', format='json').json()
+        return self.client.post(
+            '/api/v1/webauthn/register/complete',
+            {'credential': authenticator.register(options), 'keyName': 'YubiKey'},
+            format='json',
+        )
+
+    def authenticate(self, authenticator=None, options=None):
+        authenticator = authenticator or self.authenticator
+        options = options or self.client.post('/api/v1/webauthn/authenticate/begin', format='json').json()
+        return self.client.post(
+            '/api/v1/webauthn/authenticate/complete',
+            {'assertion': authenticator.assert_(options)},
+            format='json',
+        )
+
+
+class ChallengeStoreTestMixin:
+    def make_store(self, timeout=300):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com')
+
+    def test_challenge_is_single_use(self):
+        store = self.make_store()
+        challenge = store.issue(self.user, 'verify')
+        self.assertTrue(store.consume(self.user, 'verify', challenge))
+        self.assertFalse(store.consume(self.user, 'verify', challenge))
+
+    def test_challenge_is_bound_to_user_and_type(self):
+        store = self.make_store()
+        other = User.objects.create_user(clerk_id='user_456', email='other@example.com')
+        challenge = store.issue(self.user, 'verify')
+        self.assertFalse(store.consume(other, 'verify', challenge))
+        self.assertFalse(store.consume(self.user, 'register', challenge))
+        self.assertTrue(store.consume(self.user, 'verify', challenge))
+
+    def test_concurrent_ceremonies(self):
+        store = self.make_store()
+        first = store.issue(self.user, 'verify')
+        second = store.issue(self.user, 'verify')
+        self.assertTrue(store.consume(self.user, 'verify', first))
+        self.assertTrue(store.consume(self.user, 'verify', second))
+
+    def test_expired_challenge_is_rejected(self):
+        store = self.make_store(timeout=0)
+        challenge = store.issue(self.user, 'verify')
+        self.assertFalse(store.consume(self.user, 'verify', challenge))
+
+
+class DatabaseChallengeStoreTests(ChallengeStoreTestMixin, TestCase):
+    def make_store(self, timeout=300):
+        return DatabaseChallengeStore(timeout)
+
+    def test_consume_is_one_query(self):
+        store = self.make_store()
+        challenge = store.issue(self.user, 'verify')
+        with self.assertNumQueries(1):
+            self.assertTrue(store.consume(self.user, 'verify', challenge))
+
+    def test_expired_rows_are_purged(self):
+        WebAuthnChallenge.objects.create(
+            user=self.user, challenge='stale', challenge_type='verify',
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        self.make_store().issue(self.user, 'verify')
+        self.assertFalse(WebAuthnChallenge.objects.filter(challenge='stale').exists())
+
+
+class LocalMemoryChallengeStoreTests(ChallengeStoreTestMixin, TestCase):
+    def make_store(self, timeout=300):
+        return LocalMemoryChallengeStore(timeout)
+
+    def test_expired_challenges_are_purged_once_per_interval(self):
+        store = self.make_store()
+        with mock.patch('webauthn_mfa.challenges.time.monotonic', return_value=1000):
+            store.issue(self.user, 'verify')
+        with mock.patch('webauthn_mfa.challenges.time.monotonic', return_value=1030):
+            store.issue(self.user, 'verify')
+        self.assertEqual(len(store._challenges), 2)
+        with mock.patch('webauthn_mfa.challenges.time.monotonic', return_value=1400):
+            challenge = store.issue(self.user, 'verify')
+        self.assertEqual(list(store._challenges), [(self.user.pk, 'verify', challenge)])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheChallengeStoreTests(ChallengeStoreTestMixin, TestCase):
+    def make_store(self, timeout=300):
+        return CacheChallengeStore(timeout)
+
+
+class CeremonyTests(WebAuthnTestMixin, TestCase):
+    def test_register_and_authenticate(self):
+        response = self.register()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['verified'])
+
+        response = self.authenticate()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['verified'])
+        self.assertFalse(WebAuthnChallenge.objects.exists())
+
+    def test_challenge_cannot_be_replayed(self):
+        self.register()
+        options = self.client.post('/api/v1/webauthn/authenticate/begin', format='json').json()
+        self.assertEqual(self.authenticate(options=options).status_code, 200)
+        response = self.authenticate(options=options)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'No valid challenge found')
+
+    def test_ceremonies_from_multiple_tabs(self):
+        self.register()
+        first = self.client.post('/api/v1/webauthn/authenticate/begin', format='json').json()
+        second = self.client.post('/api/v1/webauthn/authenticate/begin', format='json').json()
+        self.assertEqual(self.authenticate(options=first).status_code, 200)
+        self.assertEqual(self.authenticate(options=second).status_code, 200)
+
+    @override_settings(ADMIN_MFA_STORAGE='cookie')
+    def test_verification_can_be_remembered_in_signed_cookie(self):
+        self.register()
+        response = self.authenticate()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.ADMIN_MFA_COOKIE_NAME, response.cookies)
+        self.assertNotIn('webauthn_verified', self.client.session)
+
+    @override_settings(WEBAUTHN_CHALLENGE_STORE='webauthn_mfa.challenges.LocalMemoryChallengeStore')
+    def test_pluggable_store(self):
+        self.assertIsInstance(get_challenge_store(), LocalMemoryChallengeStore)
+        self.register()
+        self.assertEqual(self.authenticate().status_code, 200)
+        self.assertFalse(WebAuthnChallenge.objects.exists())
+
+
+class CredentialRawIdTests(WebAuthnTestMixin, TestCase):
+    def test_registration_stores_raw_id(self):
+        self.register()
+        credential = WebAuthnCredential.objects.get()
+        self.assertEqual(bytes(credential.raw_id), self.authenticator.credential_id)
+
+    def test_begin_endpoints_return_raw_ids(self):
+        self.register()
+        options = self.client.post('/api/v1/webauthn/authenticate/begin', format='json').json()
+        self.assertEqual(options['allowCredentials'], [{'id': list(self.authenticator.credential_id), 'type': 'public-key'}])
+        options = self.client.post('/api/v1/webauthn/register/begin', format='json').json()
+        self.assertEqual(options['excludeCredentials'][0]['id'], list(self.authenticator.credential_id))
+
+    def test_unknown_credential_is_not_found(self):
+        self.register()
+        response = self.authenticate(authenticator=SoftAuthenticator())
+        self.assertEqual(response.status_code, 404)
+
+    def test_migration_backfills_raw_id(self):
+        migration = importlib.import_module('webauthn_mfa.migrations.0002_credential_raw_id')
+        raw_ids = [os.urandom(16), os.urandom(64)]
+        for i, raw_id in enumerate(raw_ids):
+            WebAuthnCredential.objects.create(
+                user=self.user, raw_id=bytes([i]), public_key='',
+                credential_id=base64.b64encode(raw_id).decode(),
+            )
+        migration.backfill_raw_id(apps, None)
+        stored = [bytes(c.raw_id) for c in WebAuthnCredential.objects.order_by('id')]
+        self.assertEqual(stored, raw_ids)
+
+
+class SignCountTests(WebAuthnTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        last_used_touches.flush()
+        self.register()
+        self.credential = WebAuthnCredential.objects.get()
+
+    def test_advance_is_compare_and_set(self):
+        stale = WebAuthnCredential.objects.get(pk=self.credential.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.credential.advance_sign_count(3))
+        # A concurrent assertion that loaded the old counter loses the race
+        self.assertFalse(stale.advance_sign_count(3))
+        self.assertFalse(stale.advance_sign_count(2))
+        self.assertEqual(WebAuthnCredential.objects.get().sign_count, 3)
+
+    def test_zero_counter_authenticators_are_accepted(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(self.credential.advance_sign_count(0))
+
+    def test_authentication_updates_counter_and_defers_last_used(self):
+        self.assertEqual(self.authenticate().status_code, 200)
+        credential = WebAuthnCredential.objects.get()
+        self.assertEqual(credential.sign_count, 1)
+        self.assertIsNone(credential.last_used_at)
+        self.assertEqual(last_used_touches.flush(), 1)
+        self.assertIsNotNone(WebAuthnCredential.objects.get().last_used_at)
+
+    def test_cloned_authenticator_is_rejected(self):
+        WebAuthnCredential.objects.update(sign_count=5)
+        response = self.authenticate()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WebAuthnCredential.objects.get().sign_count, 5)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'descriptors'}},
+    WEBAUTHN_CHALLENGE_STORE='webauthn_mfa.challenges.LocalMemoryChallengeStore',
+)
+class CredentialDescriptorCacheTests(WebAuthnTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.register()
+
+    def begin(self, ceremony):
+        return self.client.post(f'/api/v1/webauthn/{ceremony}/begin', format='json').json()
+
+    def test_begin_endpoints_run_no_credential_query(self):
+        self.begin('authenticate')
+        with self.assertNumQueries(0):
+            options = self.begin('authenticate')
+        self.assertEqual(len(options['allowCredentials']), 1)
+        with self.assertNumQueries(0):
+            options = self.begin('register')
+        self.assertEqual(len(options['excludeCredentials']), 1)
+
+    def test_register_complete_invalidates(self):
+        self.begin('authenticate')
+        self.register(SoftAuthenticator())
+        self.assertEqual(len(self.begin('authenticate')['allowCredentials']), 2)
+
+    def test_delete_device_invalidates(self):
+        self.begin('authenticate')
+        device = WebAuthnCredential.objects.get()
+        self.client.delete(f'/api/v1/webauthn/device/{device.pk}')
+        response = self.client.post('/api/v1/webauthn/authenticate/begin', format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class VerificationPoolTests(TestCase):
+    def test_saturated_pool_rejects_immediately(self):
+        pool = VerificationPool(mode='thread', max_workers=1, queue_depth=1)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(release.wait)
+        with self.assertRaises(VerificationPoolSaturated):
+            pool.submit(release.wait)
+
+        stats = pool.stats()
+        self.assertEqual((stats['running'], stats['queued'], stats['rejected']), (1, 1, 1))
+        self.assertEqual(stats['saturation'], 1.0)
+
+        release.set()
+        running.result(), queued.result()
+        stats = pool.stats()
+        self.assertEqual((stats['in_flight'], stats['completed'], stats['peak_in_flight']), (0, 2, 2))
+
+    def test_inline_mode_runs_in_caller(self):
+        pool = VerificationPool(mode='inline')
+        self.assertEqual(pool.run(threading.get_ident), threading.get_ident())
+
+
+class PooledCeremonyTests(WebAuthnTestMixin, TestCase):
+    @override_settings(WEBAUTHN_VERIFY_MODE='thread')
+    def test_thread_mode(self):
+        self.assertEqual(self.register().status_code, 200)
+        self.assertEqual(self.authenticate().status_code, 200)
+
+    @override_settings(WEBAUTHN_VERIFY_MODE='process', WEBAUTHN_VERIFY_POOL_SIZE=1)
+    def test_process_mode(self):
+        self.assertEqual(self.register().status_code, 200)
+        self.assertEqual(self.authenticate().status_code, 200)
+
+    @override_settings(WEBAUTHN_VERIFY_MODE='thread', WEBAUTHN_VERIFY_POOL_SIZE=1, WEBAUTHN_VERIFY_QUEUE_DEPTH=0)
+    def test_saturated_pool_returns_503(self):
+        from .executor import get_verification_pool
+
+        release = threading.Event()
+        blocker = get_verification_pool().submit(release.wait)
+        try:
+            response = self.register()
+        finally:
+            release.set()
+            blocker.result()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(
+        WEBAUTHN_VERIFY_MODE='thread', WEBAUTHN_VERIFY_POOL_SIZE=1, WEBAUTHN_VERIFY_QUEUE_DEPTH=1,
+        WEBAUTHN_VERIFY_TIMEOUT=0.05,
+    )
+    def test_verification_timeout_returns_503(self):
+        from .executor import get_verification_pool
+
+        release = threading.Event()
+        blocker = get_verification_pool().submit(release.wait)
+        try:
+            response = self.register()
+        finally:
+            release.set()
+            blocker.result()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['error'], 'WebAuthn verification timed out')
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_stats_endpoint_is_staff_only(self):
+        response = self.client.get('/api/v1/webauthn/metrics/verification-pool')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('saturation', response.json())
+        self.client.force_authenticate(User.objects.create_user(clerk_id='user_456', email='other@example.com'))
+        response = self.client.get('/api/v1/webauthn/metrics/verification-pool')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCeremonyTests(JWKSTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        identity_cache.clear()
+        self.user = User.objects.create_user(clerk_id='user_123', email='jane@example.com', is_staff=True)
+        self.headers = {'Authorization': f'Bearer {self.make_token()}'}
+        self.authenticator = SoftAuthenticator()
+
+    async def post(self, url, data=None):
+        return await self.async_client.post(url, data or {}, content_type='application/json', headers=self.headers)
+
+    async def register(self):
+        options = (await self.post('/api/v1/webauthn/register/begin')).json()
+        return await self.post(
+            '/api/v1/webauthn/register/complete',
+            {'credential': self.authenticator.register(options), 'keyName': 'YubiKey'},
+        )
+
+    async def authenticate(self, options=None):
+        options = options or (await self.post('/api/v1/webauthn/authenticate/begin')).json()
+        return await self.post('/api/v1/webauthn/authenticate/complete', {'assertion': self.authenticator.assert_(options)})
+
+    async def test_register_and_authenticate(self):
+        response = await self.register()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['credential']['name'], 'YubiKey')
+
+        response = await self.authenticate()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['verified'])
+        session = await self.async_client.asession()
+        self.assertTrue(await session.aget('webauthn_verified'))
+        self.assertFalse(await WebAuthnChallenge.objects.aexists())
+
+    async def test_challenge_cannot_be_replayed(self):
+        await self.register()
+        options = (await self.post('/api/v1/webauthn/authenticate/begin')).json()
+        self.assertEqual((await self.authenticate(options)).status_code, 200)
+        response = await self.authenticate(options)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'No valid challenge found')
+
+    async def test_concurrent_ceremonies(self):
+        await self.register()
+        begins = await asyncio.gather(*(self.post('/api/v1/webauthn/authenticate/begin') for _ in range(5)))
+        for options in [response.json() for response in begins]:
+            self.assertEqual((await self.authenticate(options)).status_code, 200)
+
+    @override_settings(WEBAUTHN_VERIFY_MODE='thread')
+    async def test_thread_mode(self):
+        self.assertEqual((await self.register()).status_code, 200)
+        self.assertEqual((await self.authenticate()).status_code, 200)
+
+    @override_settings(
+        WEBAUTHN_VERIFY_MODE='thread', WEBAUTHN_VERIFY_POOL_SIZE=1, WEBAUTHN_VERIFY_QUEUE_DEPTH=1,
+        WEBAUTHN_VERIFY_TIMEOUT=0.05,
+    )
+    async def test_verification_timeout_returns_503(self):
+        from .executor import get_verification_pool
+
+        release = threading.Event()
+        blocker = get_verification_pool().submit(release.wait)
+        try:
+            response = await self.register()
+        finally:
+            release.set()
+            blocker.result()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['error'], 'WebAuthn verification timed out')
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(get_verification_pool().stats()['in_flight'], 0)
+
+    async def test_devices(self):
+        await self.register()
+        response = await self.async_client.get('/api/v1/webauthn/user/user_123/devices', headers=self.headers)
+        self.assertEqual(response.json()['count'], 1)
+        device_id = response.json()['devices'][0]['id']
+        response = await self.async_client.delete(f'/api/v1/webauthn/device/{device_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.delete(f'/api/v1/webauthn/device/{device_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.post('/api/v1/webauthn/register/begin')
+        self.assertEqual(response.status_code, 403)
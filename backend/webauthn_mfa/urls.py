@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+if settings.ASYNC_VIEWS:
+    views = async_views
 
 urlpatterns = [
     path('register/begin', views.register_begin, name='webauthn-register-begin'),
@@ -8,4 +12,5 @@ urlpatterns = [
     path('authenticate/complete', views.authenticate_complete, name='webauthn-authenticate-complete'),
     path('user/<str:user_id>/devices', views.user_devices, name='webauthn-user-devices'),
     path('device/<int:device_id>', views.delete_device, name='webauthn-delete-device'),
-]
\ No newline at end of file
+    path('metrics/verification-pool', views.verification_pool_stats, name='webauthn-verification-pool-stats'),
+]
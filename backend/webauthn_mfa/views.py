@@ -1,20 +1,112 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from datetime import timedelta
-import secrets
+import asyncio
 import base64
-from webauthn import generate_registration_options, verify_registration_response, generate_authentication_options, verify_authentication_response
-from webauthn.helpers.structs import PublicKeyCredentialDescriptor, AuthenticatorSelectionCriteria, UserVerificationRequirement, AuthenticatorAttachment
 from django.conf import settings
-from .models import WebAuthnCredential, WebAuthnChallenge
+from authentication import mfa
+from authentication.touch import TouchBuffer
+from backend.replicas import use_replica
+from .challenges import challenge_from_client_data, get_challenge_store
+from .descriptors import get_credential_descriptors
+from .executor import VerificationPoolSaturated, get_verification_pool
+from .models import WebAuthnCredential
 from .serializers import WebAuthnCredentialSerializer
 
+last_used_touches = TouchBuffer(WebAuthnCredential, 'last_used_at', flush_interval=settings.WEBAUTHN_LAST_USED_FLUSH_INTERVAL)
+
+def registration_options(user, challenge, username, display_name, exclude_credentials):
+    """Registration options in the shape the frontend expects"""
+    # webauthn (and pydantic under it) is slow to import, so it loads on first use
+    from webauthn import generate_registration_options
+    from webauthn.helpers.structs import AuthenticatorSelectionCriteria, UserVerificationRequirement, AuthenticatorAttachment
+    
+    # Generate registration options
+    options = generate_registration_options(
+        rp_id=settings.WEBAUTHN_RP_ID,
+        rp_name=settings.WEBAUTHN_RP_NAME,
+        user_id=str(user.id),
+        user_name=username,
+        user_display_name=display_name,
+        challenge=challenge.encode(),
+        authenticator_selection=AuthenticatorSelectionCriteria(
+            authenticator_attachment=AuthenticatorAttachment.CROSS_PLATFORM,  # Exclude platform authenticators (fingerprint, Face ID)
+            user_verification=UserVerificationRequirement.PREFERRED
+        )
+    )
+    
+    # Convert options to format expected by frontend
+    return {
+        'challenge': list(challenge.encode()),
+        'rp': {
+            'id': settings.WEBAUTHN_RP_ID,
+            'name': settings.WEBAUTHN_RP_NAME
+        },
+        'user': {
+            'id': list(str(user.id).encode()),
+            'name': username,
+            'displayName': display_name
+        },
+        'pubKeyCredParams': [
+            {'type': 'public-key', 'alg': -7},   # ES256
+            {'type': 'public-key', 'alg': -257}, # RS256
+            {'type': 'public-key', 'alg': -8},   # EdDSA
+        ],
+        'timeout': options.timeout,
+        'attestation': options.attestation,
+        'excludeCredentials': exclude_credentials,
+        'authenticatorSelection': {
+            'authenticatorAttachment': 'cross-platform',  # Only external devices
+            'userVerification': options.authenticator_selection.user_verification if options.authenticator_selection else 'preferred'
+        }
+    }
+
+def registration_credential(credential_data, client_data_json):
+    """Build the RegistrationCredential to verify from the frontend's byte arrays"""
+    from webauthn.helpers.structs import AuthenticatorAttestationResponse, RegistrationCredential
+    
+    return RegistrationCredential(
+        id=credential_data['id'],
+        raw_id=bytes(credential_data['rawId']),
+        response=AuthenticatorAttestationResponse(
+            client_data_json=client_data_json,
+            attestation_object=bytes(credential_data['response']['attestationObject'])
+        ),
+        type=credential_data['type']
+    )
+
+def authentication_credential(assertion_data, raw_id, client_data_json):
+    """Build the AuthenticationCredential to verify from the frontend's byte arrays"""
+    from webauthn.helpers.structs import AuthenticatorAssertionResponse, AuthenticationCredential
+    
+    response = assertion_data['response']
+    return AuthenticationCredential(
+        id=assertion_data['id'],
+        raw_id=raw_id,
+        response=AuthenticatorAssertionResponse(
+            client_data_json=client_data_json,
+            authenticator_data=bytes(response['authenticatorData']),
+            signature=bytes(response['signature']),
+            user_handle=bytes(response['userHandle']) if response.get('userHandle') else None
+        ),
+        type=assertion_data['type']
+    )
+
+def is_verified(verification):
+    # Check if verification was successful (newer WebAuthn library structure)
+    if hasattr(verification, 'verified') and verification.verified:
+        return True
+    elif hasattr(verification, 'verification_successful') and verification.verification_successful:
+        return True
+    elif verification:  # Some versions return the verification object directly
+        return True
+    return False
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@use_replica
 def user_devices(request, user_id):
     """Get user's WebAuthn devices"""
     user = request.user
@@ -56,74 +148,20 @@ def register_begin(request):
     username = request.data.get('username', user.email)
     display_name = request.data.get('displayName', f"{user.first_name} {user.last_name}".strip() or user.email)
     
-    # Generate challenge
-    challenge = base64.urlsafe_b64encode(secrets.token_bytes(32)).decode('utf-8').rstrip('=')
+    # Generate and store challenge
+    challenge = get_challenge_store().issue(user, 'register')
     
-    # Store challenge
-    WebAuthnChallenge.objects.create(
-        user=user,
-        challenge=challenge,
-        challenge_type='register',
-        expires_at=timezone.now() + timedelta(minutes=5)
-    )
-    
-    # Get existing credentials
-    existing_credentials = WebAuthnCredential.objects.filter(user=user)
-    exclude_credentials = [
-        PublicKeyCredentialDescriptor(id=base64.b64decode(cred.credential_id + '=='))
-        for cred in existing_credentials
-    ]
-    
-    # Generate registration options
-    options = generate_registration_options(
-        rp_id=settings.WEBAUTHN_RP_ID,
-        rp_name=settings.WEBAUTHN_RP_NAME,
-        user_id=str(user.id),
-        user_name=username,
-        user_display_name=display_name,
-        challenge=challenge.encode(),
-        exclude_credentials=exclude_credentials,
-        authenticator_selection=AuthenticatorSelectionCriteria(
-            authenticator_attachment=AuthenticatorAttachment.CROSS_PLATFORM,  # Exclude platform authenticators (fingerprint, Face ID)
-            user_verification=UserVerificationRequirement.PREFERRED
-        )
-    )
+    # Existing credentials, precomputed and cached per user
+    exclude_credentials = get_credential_descriptors(user)
     
-    # Convert options to format expected by frontend
-    return Response({
-        'challenge': list(challenge.encode()),
-        'rp': {
-            'id': settings.WEBAUTHN_RP_ID,
-            'name': settings.WEBAUTHN_RP_NAME
-        },
-        'user': {
-            'id': list(str(user.id).encode()),
-            'name': username,
-            'displayName': display_name
-        },
-        'pubKeyCredParams': [
-            {'type': 'public-key', 'alg': -7},   # ES256
-            {'type': 'public-key', 'alg': -257}, # RS256
-            {'type': 'public-key', 'alg': -8},   # EdDSA
-        ],
-        'timeout': options.timeout,
-        'attestation': options.attestation,
-        'excludeCredentials': [
-            {
-                'id': list(cred.id),
-                'type': cred.type
-            } for cred in options.exclude_credentials
-        ],
-        'authenticatorSelection': {
-            'authenticatorAttachment': 'cross-platform',  # Only external devices
-            'userVerification': options.authenticator_selection.user_verification if options.authenticator_selection else 'preferred'
-        }
-    })
+    return Response(registration_options(user, challenge, username, display_name, exclude_credentials))
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def register_complete(request):
     """Verify WebAuthn registration response"""
+    from webauthn import verify_registration_response
+    
     user = request.user
     credential_data = request.data.get('credential')
     key_name = request.data.get('keyName', 'Security Key')
@@ -131,38 +169,22 @@ def register_complete(request):
     if not credential_data:
         return Response({'error': 'Missing credential data'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Extract challenge from stored challenges (get latest for this user)
+    # Consume the challenge the browser signed (single use)
     try:
-        challenge_obj = WebAuthnChallenge.objects.filter(
-            user=user,
-            challenge_type='register',
-            expires_at__gt=timezone.now()
-        ).latest('created_at')
-        challenge = challenge_obj.challenge
-    except WebAuthnChallenge.DoesNotExist:
+        client_data_json = bytes(credential_data['response']['clientDataJSON'])
+        challenge = challenge_from_client_data(client_data_json)
+    except Exception:
+        return Response({'error': 'Invalid client data'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not get_challenge_store().consume(user, 'register', challenge):
         return Response({'error': 'No valid challenge found'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        # Convert arrays back to bytes for the verification
-        raw_id = bytes(credential_data['rawId'])
-        attestation_object = bytes(credential_data['response']['attestationObject'])
-        client_data_json = bytes(credential_data['response']['clientDataJSON'])
-        
-        # Create a proper credential object for verification
-        from webauthn.helpers.structs import AuthenticatorAttestationResponse, RegistrationCredential
-        
-        credential = RegistrationCredential(
-            id=credential_data['id'],
-            raw_id=raw_id,
-            response=AuthenticatorAttestationResponse(
-                client_data_json=client_data_json,
-                attestation_object=attestation_object
-            ),
-            type=credential_data['type']
-        )
+        credential = registration_credential(credential_data, client_data_json)
         
         # Verify registration
-        verification = verify_registration_response(
+        verification = get_verification_pool().run(
+            verify_registration_response,
             credential=credential,
             expected_challenge=challenge.encode(),
             expected_origin=settings.WEBAUTHN_ORIGIN,
@@ -173,20 +195,22 @@ def register_complete(request):
         webauthn_credential = WebAuthnCredential.objects.create(
             user=user,
             credential_id=base64.b64encode(verification.credential_id).decode('utf-8'),
+            raw_id=verification.credential_id,
             public_key=base64.b64encode(verification.credential_public_key).decode('utf-8'),
             sign_count=verification.sign_count,
             name=key_name
         )
         
-        # Delete used challenge
-        challenge_obj.delete()
-        
         serializer = WebAuthnCredentialSerializer(webauthn_credential)
         return Response({
             'verified': True,
             'credential': serializer.data
         })
     
+    except VerificationPoolSaturated as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+    except (TimeoutError, asyncio.TimeoutError):
+        return Response({'error': 'WebAuthn verification timed out'}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
     except Exception as e:
         return Response({'error': f'Registration failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -199,33 +223,13 @@ def authenticate_begin(request):
     # Extract user ID from request
     user_id = request.data.get('userId')
     
-    # Check if user has any credentials
-    credentials = WebAuthnCredential.objects.filter(user=user)
-    if not credentials.exists():
+    # Check if user has any credentials (precomputed and cached per user)
+    allow_credentials = get_credential_descriptors(user)
+    if not allow_credentials:
         return Response({'error': 'No WebAuthn credentials registered'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Generate challenge
-    challenge = base64.urlsafe_b64encode(secrets.token_bytes(32)).decode('utf-8').rstrip('=')
-    
-    # Store challenge
-    WebAuthnChallenge.objects.create(
-        user=user,
-        challenge=challenge,
-        challenge_type='verify',
-        expires_at=timezone.now() + timedelta(minutes=5)
-    )
-    
-    # Generate authentication options
-    allow_credentials = []
-    for cred in credentials:
-        try:
-            credential_id = base64.b64decode(cred.credential_id + '==')
-            allow_credentials.append({
-                'id': list(credential_id),
-                'type': 'public-key'
-            })
-        except Exception:
-            continue
+    # Generate and store challenge
+    challenge = get_challenge_store().issue(user, 'verify')
     
     return Response({
         'challenge': list(challenge.encode()),
@@ -239,63 +243,44 @@ def authenticate_begin(request):
 @permission_classes([IsAuthenticated])
 def authenticate_complete(request):
     """Verify WebAuthn authentication response"""
+    from webauthn import verify_authentication_response
+    
     user = request.user
     assertion_data = request.data.get('assertion')
     
     if not assertion_data:
         return Response({'error': 'Missing assertion data'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Get challenge
-    try:
-        challenge_obj = WebAuthnChallenge.objects.filter(
-            user=user,
-            challenge_type='verify',
-            expires_at__gt=timezone.now()
-        ).latest('created_at')
-        challenge = challenge_obj.challenge
-    except WebAuthnChallenge.DoesNotExist:
-        return Response({'error': 'No valid challenge found'}, status=status.HTTP_400_BAD_REQUEST)
-    
     # Get credential
     credential_id = assertion_data.get('id')
     if not credential_id:
         return Response({'error': 'Missing credential ID'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # Consume the challenge the browser signed (single use)
     try:
-        # Find credential by base64 encoded ID
-        credential_id_b64 = base64.b64encode(bytes(assertion_data['rawId'])).decode('utf-8')
-        credential = WebAuthnCredential.objects.get(
-            user=user,
-            credential_id=credential_id_b64
-        )
+        client_data_json = bytes(assertion_data['response']['clientDataJSON'])
+        challenge = challenge_from_client_data(client_data_json)
+    except Exception:
+        return Response({'error': 'Invalid client data'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not get_challenge_store().consume(user, 'verify', challenge):
+        return Response({'error': 'No valid challenge found'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        # Find credential by its raw ID bytes
+        raw_id = bytes(assertion_data['rawId'])
+        credential = WebAuthnCredential.objects.only('public_key', 'sign_count', 'last_used_at').get(user=user, raw_id=raw_id)
+    except (KeyError, TypeError, ValueError):
+        return Response({'error': 'Missing credential ID'}, status=status.HTTP_400_BAD_REQUEST)
     except WebAuthnCredential.DoesNotExist:
         return Response({'error': 'Credential not found'}, status=status.HTTP_404_NOT_FOUND)
     
     try:
-        # Convert arrays back to bytes
-        raw_id = bytes(assertion_data['rawId'])
-        authenticator_data = bytes(assertion_data['response']['authenticatorData'])
-        client_data_json = bytes(assertion_data['response']['clientDataJSON'])
-        signature = bytes(assertion_data['response']['signature'])
-        user_handle = bytes(assertion_data['response']['userHandle']) if assertion_data['response'].get('userHandle') else None
-        
-        # Create proper assertion object
-        from webauthn.helpers.structs import AuthenticatorAssertionResponse, AuthenticationCredential
-        
-        assertion = AuthenticationCredential(
-            id=assertion_data['id'],
-            raw_id=raw_id,
-            response=AuthenticatorAssertionResponse(
-                client_data_json=client_data_json,
-                authenticator_data=authenticator_data,
-                signature=signature,
-                user_handle=user_handle
-            ),
-            type=assertion_data['type']
-        )
+        assertion = authentication_credential(assertion_data, raw_id, client_data_json)
         
         # Verify authentication
-        verification = verify_authentication_response(
+        verification = get_verification_pool().run(
+            verify_authentication_response,
             credential=assertion,
             expected_challenge=challenge.encode(),
             expected_origin=settings.WEBAUTHN_ORIGIN,
@@ -304,28 +289,13 @@ def authenticate_complete(request):
             credential_current_sign_count=credential.sign_count
         )
         
-        # Check if verification was successful (newer WebAuthn library structure)
-        if hasattr(verification, 'verified') and verification.verified:
-            verified = True
-        elif hasattr(verification, 'verification_successful') and verification.verification_successful:
-            verified = True
-        elif verification:  # Some versions return the verification object directly
-            verified = True
-        else:
-            verified = False
+        verified = is_verified(verification)
         
         if verified:
-            # Update sign count and last used
-            credential.sign_count = verification.new_sign_count
-            credential.last_used_at = timezone.now()
-            credential.save()
-            
-            # Delete used challenge
-            challenge_obj.delete()
-            
-            # Set admin session variables for successful WebAuthn verification
-            request.session['webauthn_verified'] = True
-            request.session['webauthn_verified_at'] = timezone.now().isoformat()
+            # Advance the sign count atomically; last_used_at is written in batches
+            if not credential.advance_sign_count(verification.new_sign_count):
+                return Response({'error': 'Sign count did not increase; possible cloned authenticator'}, status=status.HTTP_400_BAD_REQUEST)
+            last_used_touches.touch(credential)
             
             # Prepare response data
             response_data = {
@@ -337,9 +307,22 @@ def authenticate_complete(request):
             if 'admin_redirect_url' in request.session:
                 response_data['redirect_url'] = request.session.pop('admin_redirect_url')
             
-            return Response(response_data)
+            # Remember the verification for the admin (session flags or signed cookie)
+            response = Response(response_data)
+            mfa.mark_verified(request, response, user)
+            return response
         else:
             return Response({'error': 'Authentication verification failed'}, status=status.HTTP_400_BAD_REQUEST)
     
+    except VerificationPoolSaturated as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+    except (TimeoutError, asyncio.TimeoutError):
+        return Response({'error': 'WebAuthn verification timed out'}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
     except Exception as e:
-        return Response({'error': f'Authentication failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({'error': f'Authentication failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def verification_pool_stats(request):
+    """Saturation metrics for the WebAuthn verification pool"""
+    return Response(get_verification_pool().stats())
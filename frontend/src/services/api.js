@@ -78,13 +78,18 @@ class ApiService {
   }
 
   // Transfer endpoints
-  async initiateTransfer(transferData) {
-    const response = await this.client.post('/transfers/', transferData);
+  // Reuse the same idempotencyKey when retrying a submission so it is posted at most once
+  async initiateTransfer(transferData, idempotencyKey = crypto.randomUUID()) {
+    const response = await this.client.post('/transfers/', transferData, {
+      headers: { 'Idempotency-Key': idempotencyKey },
+    });
     return response.data;
   }
 
-  async getTransactionHistory(accountType = 'main') {
-    const response = await this.client.get(`/transactions/${accountType}/`);
+  // Pass the previous page's next_cursor to continue; it is null on the last page
+  async getTransactionHistory(accountType = 'main', cursor = null) {
+    const params = cursor ? { cursor } : {};
+    const response = await this.client.get(`/transactions/${accountType}/`, { params });
     return response.data;
   }
 }